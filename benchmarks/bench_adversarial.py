@@ -0,0 +1,80 @@
+r"""Worst-case time of the command line patterns on crafted tokens.
+
+Each family of crafted tokens is timed at doubling lengths, through the pattern
+alone and through a whole parse or normalization. Linear time shows as a growth
+factor of about 2 per doubling. The original nested-group path_re is timed on the first family at
+small lengths for comparison; it backtracks exponentially.
+
+    python -m benchmarks.bench_adversarial [--max-length N]
+"""
+import argparse
+import re
+import time
+
+from cyberspacy.core import classify_token, is_path_text, parse_cmdline
+from cyberspacy.expressions import email_expr, url_expr
+
+ORIGINAL_PATH_RE = re.compile(r"""(\\\?\?\\[^ ]+|\\\?\\[^ ]+)|("(([a-zA-Z]:)|([a-zA-Z]:\\Program Files \(x86\)))([^\"\s])+(\s((\S+\\)+\S*))*"|^[a-zA-Z]?:[^ ]+)""")
+
+url_re = re.compile(url_expr, re.VERBOSE | re.I | re.UNICODE)
+email_re = re.compile(email_expr, re.VERBOSE | re.I | re.UNICODE)
+
+
+def normalize_cmdline(text):
+    return parse_cmdline(text).normalize()
+
+
+# name -> (function, token of about n characters)
+FAMILIES = {
+    'path: runs of backslashes': (is_path_text, lambda n: '"C:a ' + 'a\\' * (n // 2) + ' '),
+    'path: several runs': (is_path_text, lambda n: '"C:a ' + ('a\\' * (n // 6) + ' ') * 3),
+    'path: many quoted starts': (is_path_text, lambda n: '"C:\\a ' * (n // 6)),
+    'cmd: unclosed quote': (classify_token, lambda n: '"' + 'a' * n),
+    'cmd: quoted lines': (classify_token, lambda n: '"\n' * (n // 2)),
+    'url: long user info': (url_re.match, lambda n: 'http://' + 'a' * n + '!'),
+    'email: long domain': (email_re.match, lambda n: 'a@' + 'a.' * (n // 2) + '1'),
+    'parse: quoted path': (parse_cmdline, lambda n: 'tool.exe "C:\\a ' + 'a\\' * (n // 2)),
+    'parse: many quoted starts': (parse_cmdline, lambda n: "tool.exe '" + '"C:\\a ' * (n // 6) + "'"),
+    'normalize: nested commands': (normalize_cmdline, lambda n: 'a "b ' * (n // 7) + 'c"' * (n // 7)),
+}
+
+
+def timed(func, text, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_adversarial',
+                                     description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-length', type=int, default=65536)
+    args = parser.parse_args(argv)
+
+    lengths = []
+    length = 1024
+    while length <= args.max_length:
+        lengths.append(length)
+        length *= 2
+
+    print(f'{"family":<28}' + ''.join(f'{n:>10,}' for n in lengths) + f'{"growth":>8}')
+    for name, (func, generate) in FAMILIES.items():
+        seconds = [timed(func, generate(n)) for n in lengths]
+        # The parses use the default token length budget, which caps the cost of
+        # the longest tokens
+        growth = (seconds[-1] / seconds[0]) ** (1 / (len(seconds) - 1)) if seconds[0] else 0.0
+        print(f'{name:<28}' + ''.join(f'{s * 1e3:>8.2f}ms' for s in seconds) + f'{growth:>8.2f}')
+
+    print()
+    print('original path_re on "path: runs of backslashes"')
+    for n in (20, 24, 28, 32, 36):
+        text = FAMILIES['path: runs of backslashes'][1](n)
+        print(f'{n:>6} chars: {timed(ORIGINAL_PATH_RE.search, text, repeat=1) * 1e3:>10.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Throughput of columnar.analyze_column against calling
+WindowsCommandlineProcessor.analyze row by row, on a column where command lines
+repeat as they do in endpoint telemetry.
+
+    python -m benchmarks.bench_columnar [rows] [distinct]
+"""
+import random
+import sys
+import time
+
+import pyarrow as pa
+
+from cyberspacy import WindowsCommandlineProcessor, columnar
+
+from .corpus import generate_cmd_lines
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(rows=200000, distinct=2000, seed=0):
+    rng = random.Random(seed)
+    distinct_lines = generate_cmd_lines(distinct, seed)
+    cmd_lines = [rng.choice(distinct_lines) for _ in range(rows)]
+    column = pa.array(cmd_lines, type=pa.string())
+
+    processor = WindowsCommandlineProcessor(cache_size=distinct)
+    by_row, analyses = timed(lambda: [processor.analyze(cmd_line) for cmd_line in cmd_lines])
+    from_list, _ = timed(lambda: columnar.analyze_column(cmd_lines, WindowsCommandlineProcessor()))
+    from_arrow, table = timed(lambda: columnar.analyze_column(column, WindowsCommandlineProcessor()))
+    plain, plain_table = timed(lambda: columnar.analyze_column(column, WindowsCommandlineProcessor(),
+                                                               dictionary=False))
+
+    print(f'rows: {rows:,} ({distinct:,} distinct)')
+    print(f'analyze per row:             {rows / by_row:>12,.0f} rows/sec')
+    print(f'analyze_column (list):       {rows / from_list:>12,.0f} rows/sec')
+    print(f'analyze_column (arrow):      {rows / from_arrow:>12,.0f} rows/sec')
+    print(f'analyze_column (no dict):    {rows / plain:>12,.0f} rows/sec')
+    print(f'output size dictionary/plain: {table.nbytes / 1e6:,.1f} MB / {plain_table.nbytes / 1e6:,.1f} MB')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""Throughput of TemplateIndex.add on command lines that repeat as they do in
+endpoint telemetry, and latency of TemplateIndex.match as the index grows, against
+comparing a signature with every template.
+
+    python -m benchmarks.bench_fingerprint [rows] [distinct]
+"""
+import random
+import sys
+import time
+
+import numpy
+
+from cyberspacy.fingerprint import TemplateIndex, template_tokens
+
+from .corpus import generate_cmd_lines
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(rows=200000, distinct=20000, seed=0):
+    rng = random.Random(seed)
+    distinct_lines = generate_cmd_lines(distinct, seed, pathological=0)
+    cmd_lines = [rng.choice(distinct_lines) for _ in range(rows)]
+
+    index = TemplateIndex()
+    seconds, _ = timed(lambda: list(index.add_many(cmd_lines)))
+    print(f'rows: {rows:,} ({distinct:,} distinct)')
+    print(f'add:   {rows / seconds:>10,.0f} rows/sec, {len(index):,} templates')
+    for template in index.most_common(5):
+        print(f'       {template.count:>8,}  {template.text[:80]}')
+
+    queries = generate_cmd_lines(1000, seed + 1, pathological=0)
+    print(f'{"templates":>10}{"match us":>12}{"linear scan us":>16}')
+    for size in (1000, 10000, 100000):
+        index = TemplateIndex()
+        for cmd_line in generate_cmd_lines(size, seed + 2, pathological=0):
+            index.add(cmd_line)
+        signatures = numpy.stack([template.signature for template in index])
+        parsed = [index.processor.parse(cmd_line) for cmd_line in queries]
+
+        lsh, _ = timed(lambda: [index.match(p) for p in parsed])
+
+        def scan(p):
+            signature = index.signature(template_tokens(p))
+            return numpy.count_nonzero(signatures == signature, axis=1).argmax()
+
+        linear, _ = timed(lambda: [scan(p) for p in parsed])
+        print(f'{len(index):>10,}{lsh / len(queries) * 1e6:>12.1f}{linear / len(queries) * 1e6:>16.1f}')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
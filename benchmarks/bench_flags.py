@@ -0,0 +1,64 @@
+"""Per-token cost of the IOC taggers' lexeme flags on text without IOCs.
+
+Compares each tagger's flag function with running a full regex on every token
+the way the flags used to: the pattern as it was before the URL pattern was
+rewritten, and the current pattern without the cheap character checks that gate it.
+
+    python -m benchmarks.bench_flags
+"""
+import re
+import timeit
+
+from spacy.lang.en import English
+
+from cyberspacy import EmailTagger, IPTagger, IPv6Tagger, URLTagger
+from cyberspacy.expressions import email_expr, ipv4_expr, ipv6_expr, url_expr
+
+from .corpus import generate_prose
+
+# url_expr before it was rewritten to fail without backtracking over the host
+ORIGINAL_URL_EXPR = r"""
+(?:(?:(?:(?:
+  (?:ht|f)tp(?:s?)://|~/)
+  (?:[-;:&=+$,\w'.]+@)?
+  (?:[A-Za-z0-9.-:]+))
+  |(?:(?:www\.|[-;:&=+$,\w'.]+@)
+  (?:[A-Za-z0-9.-:]+))|
+  (?:(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})))
+  (?:[-\w~!$+|.,=/\?'#%*:&@;]*))
+"""
+
+
+def main(sentences=2000, number=5):
+    nlp = English()
+    flags = [
+        ('ipv4', IPTagger(nlp, force_extension=True).is_ipv4_text, ipv4_expr, ipv4_expr),
+        ('ipv6', IPv6Tagger(nlp, force_extension=True).is_ipv6_text, ipv6_expr, ipv6_expr),
+        ('url', URLTagger(nlp, force_extension=True).is_url_text, ORIGINAL_URL_EXPR, url_expr),
+        ('email', EmailTagger(nlp, force_extension=True).is_email_addr_text, email_expr,
+         email_expr),
+    ]
+
+    tokens = [t.text for doc in nlp.pipe(generate_prose(sentences, ioc_rate=0.0)) for t in doc]
+    tokens += ['10:30', 'cafe', 'deadbeef', '2021-01-01T10:30:00', 'C:\\Windows', 'v1.2.3',
+               'x' * 5000]
+    calls = number * len(tokens)
+
+    baseline = timeit.timeit(lambda: [len(t) for t in tokens], number=number)
+    print(f'tokens:         {len(tokens):,}')
+    print(f'loop overhead:  {baseline / calls * 1e9:.0f} ns/token')
+    print(f'{"flag":<8}{"original regex":>16}{"current regex":>16}{"pre-filtered":>16}')
+
+    for name, flag, original_expr, expr in flags:
+        original = re.compile(original_expr, re.VERBOSE | re.I | re.UNICODE)
+        regex = re.compile(expr, re.VERBOSE | re.I | re.UNICODE)
+        assert not any(flag(t) for t in tokens)
+        before = timeit.timeit(lambda: [original.match(t) for t in tokens], number=number)
+        full = timeit.timeit(lambda: [regex.match(t) for t in tokens], number=number)
+        gated = timeit.timeit(lambda: [flag(t) for t in tokens], number=number)
+        print(f'{name:<8}{before / calls * 1e9:>11.0f} ns/t{full / calls * 1e9:>11.0f} ns/t'
+              f'{gated / calls * 1e9:>11.0f} ns/t')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Cold start latency: each statement is timed in a fresh interpreter.
+
+    python -m benchmarks.bench_import [--repeat N] [--output results.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = {
+    'import cyberspacy': 'import cyberspacy',
+    'import cyberspacy.core': 'import cyberspacy.core',
+    'first normalize': ('from cyberspacy import WindowsCommandlineProcessor; '
+                        r"WindowsCommandlineProcessor().normalize(r'C:\Windows\notepad.exe')"),
+    'first Doc': ('from cyberspacy import WindowsCommandlineProcessor; '
+                  r"WindowsCommandlineProcessor().nlp(r'C:\Windows\notepad.exe')"),
+    'import spacy': 'import spacy',
+}
+
+TIMER = '''
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+'''
+
+
+def cold_start(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', TIMER.format(statement=statement)],
+                             check=True, capture_output=True, text=True).stdout
+        timings.append(float(out) * 1000)
+    return {'median_ms': statistics.median(timings), 'min_ms': min(timings), 'max_ms': max(timings)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_import')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    results = {name: cold_start(statement, args.repeat) for name, statement in STATEMENTS.items()}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
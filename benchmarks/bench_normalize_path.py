@@ -0,0 +1,82 @@
+"""Per-path latency of NormalizeWinPath.normalize_path against the previous
+implementation, which ran one re.sub per rule, with and without the path cache,
+of the deduplicating normalize_paths on a corpus where paths repeat, and of the
+built-in rules against the built-in plus extended rules (RuleSet.extended).
+
+    python -m benchmarks.bench_normalize_path
+"""
+import re
+import timeit
+
+from cyberspacy.rules import RuleSet
+from cyberspacy.stemmer import NormalizeWinPath
+
+from .corpus import generate_paths
+
+PATHS = [
+    r'C:\Windows\System32\svchost.exe',
+    r'C:\Windows\SysWOW64\rundll32.exe',
+    r'"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe"',
+    r'"C:\Program Files\Microsoft Office\root\Office16\WINWORD.EXE"',
+    r'C:\Users\Alice\AppData\Local\Temp\7zS4A1B.tmp\setup.exe',
+    r'C:\Users\Bob\Documents\report.docx',
+    r'\??\C:\Windows\system32\conhost.exe',
+    r'\\?\Volume{26a21bda-a627-11d7-9931-806e6f6e6963}\file.txt',
+    r'C:\ProgramData\{8A9F3C12-0B1D-4E5F-9A7B-3C2D1E0F4A5B}\updater.exe',
+    r'D:\data\archive.zip',
+]
+
+
+def legacy_normalize_path(normalizer, path):
+    for rule in normalizer.rules:
+        path = re.sub(f"{rule['regex']}", rule['replacement'], path.lower())
+    return path
+
+
+def main(number=20000):
+    normalizer = NormalizeWinPath('x86_64', cache_size=0)
+    memoized = NormalizeWinPath('x86_64')
+
+    for path in PATHS:
+        assert normalizer.normalize_path(path) == legacy_normalize_path(normalizer, path), path
+
+    before = timeit.timeit(lambda: [legacy_normalize_path(normalizer, p) for p in PATHS], number=number)
+    after = timeit.timeit(lambda: [normalizer.normalize_path(p) for p in PATHS], number=number)
+    cached = timeit.timeit(lambda: [memoized.normalize_path(p) for p in PATHS], number=number)
+    calls = number * len(PATHS)
+
+    print(f'rules: {len(normalizer.rules)}')
+    print(f'sequential re.sub: {before / calls * 1e6:.2f} us/path')
+    print(f'single pass:       {after / calls * 1e6:.2f} us/path')
+    print(f'speedup:           {before / after:.1f}x')
+    print(f'cache hit:         {cached / calls * 1e6:.2f} us/path')
+
+    corpus = generate_paths(200000)
+    one_by_one = timeit.timeit(lambda: [normalizer.normalize_path(p) for p in corpus], number=1)
+    batch = timeit.timeit(lambda: NormalizeWinPath('x86_64').normalize_paths(corpus), number=1)
+    print(f'{len(corpus):,} paths ({len(set(corpus)):,} distinct)')
+    print(f'normalize_path each: {one_by_one:.2f} s')
+    print(f'normalize_paths:     {batch:.2f} s')
+
+    # Rules are combined into one regex, so the cost grows with the rules tried at
+    # each position of a path rather than with one full scan per rule
+    extended = NormalizeWinPath('x86_64', cache_size=0, rules=RuleSet.extended())
+    for path in PATHS:
+        assert extended.normalize_path(path) == legacy_normalize_path(extended, path), path
+    sequential = timeit.timeit(lambda: [legacy_normalize_path(extended, p) for p in PATHS], number=number)
+    single = timeit.timeit(lambda: [extended.normalize_path(p) for p in PATHS], number=number)
+    print(f'rules: {len(extended.rules)} (extended)')
+    print(f'sequential re.sub: {sequential / calls * 1e6:.2f} us/path')
+    print(f'single pass:       {single / calls * 1e6:.2f} us/path')
+
+    # Rules starting with a literal character are grouped on it, so adding them
+    # barely changes the cost of a path none of them match
+    for n in (10, 100, 1000):
+        rules = RuleSet({'regex': rf'%vendor{i}%', 'replacement': f'?v{i}'} for i in range(n))
+        many = NormalizeWinPath('x86_64', cache_size=0, rules=rules)
+        seconds = timeit.timeit(lambda: [many.normalize_path(p) for p in PATHS], number=number)
+        print(f'{n:>4} more rules:    {seconds / calls * 1e6:.2f} us/path')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Throughput of RaritySketch.add on command lines that repeat as they do in endpoint
+telemetry, the accuracy of its counts against exact counting, and building it in
+worker processes and merging the sketches.
+
+    python -m benchmarks.bench_sketches [rows] [distinct] [workers]
+"""
+import random
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.sketches import RaritySketch, event_features
+
+from .corpus import generate_cmd_lines
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def build(cmd_lines):
+    sketch = RaritySketch()
+    for _ in sketch.add_many(cmd_lines):
+        pass
+    return sketch
+
+
+def main(rows=200000, distinct=20000, workers=4, seed=0):
+    rng = random.Random(seed)
+    distinct_lines = generate_cmd_lines(distinct, seed, pathological=0)
+    # Skewed, so a few command lines are common and most are rare
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    cmd_lines = rng.choices(distinct_lines, weights, k=rows)
+
+    print(f'rows: {rows:,} ({distinct:,} distinct)')
+    sketch = RaritySketch()
+    seconds, _ = timed(lambda: [sketch.add(cmd_line) for cmd_line in cmd_lines[:rows // 10]])
+    print(f'add:      {rows // 10 / seconds:>10,.0f} rows/sec')
+    seconds, sketch = timed(lambda: build(cmd_lines))
+    print(f'add_many: {rows / seconds:>10,.0f} rows/sec, {sketch.nbytes / 2 ** 20:.1f}MB')
+
+    processor = WindowsCommandlineProcessor()
+    exact = {feature: Counter() for feature in ('normalized', 'normalized_paths', 'args', 'pairs')}
+    for cmd_line in cmd_lines:
+        for feature, values in event_features(processor.analyze(cmd_line)).items():
+            exact[feature].update(values)
+    print(f'{"feature":>18}{"distinct":>10}{"estimate":>10}{"rare":>8}{"exact":>8}')
+    for feature, counts in exact.items():
+        rare = [value for value, count in counts.items() if count <= 3]
+        overestimated = sum(sketch.count(feature, value) != counts[value] for value in rare)
+        print(f'{feature:>18}{len(counts):>10,}{sketch.distinct(feature):>10,}{len(rare):>8,}'
+              f'{1 - overestimated / max(len(rare), 1):>8.1%}')
+
+    def parallel():
+        chunks = [cmd_lines[i::workers] for i in range(workers)]
+        with Pool(workers) as pool:
+            sketches = pool.map(build, chunks)
+        merged = sketches[0]
+        for other in sketches[1:]:
+            merged.merge(other)
+        return merged
+
+    seconds, merged = timed(parallel)
+    print(f'{workers} workers: {rows / seconds:>6,.0f} rows/sec, '
+          f'{merged.events:,} events, {merged.distinct("normalized"):,} distinct')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
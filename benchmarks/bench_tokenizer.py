@@ -0,0 +1,105 @@
+"""Tokens/sec of CommandLineTokenizer.cmdline_split against the previous
+implementation, which re-parsed its patterns on every call.
+
+    python -m benchmarks.bench_tokenizer
+"""
+import re
+import time
+
+from cyberspacy.tokenizer import CommandLineTokenizer
+
+CORPUS = [
+    r'C:\Windows\System32\svchost.exe -k netsvcs -p -s Schedule',
+    r'C:\Windows\system32\svchost.exe -k LocalServiceNetworkRestricted -p',
+    r'"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe" --type=renderer --lang=en-US',
+    r'"C:\Program Files\Microsoft Office\root\Office16\WINWORD.EXE" /n "C:\Users\Alice\Documents\report.docx"',
+    r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\AppData\Local\Temp\install.bat --quiet"',
+    r'C:\Windows\System32\cmd.exe /c echo hello > C:\temp\out.txt',
+    r'powershell.exe -NoProfile -ExecutionPolicy Bypass -File C:\scripts\update.ps1',
+    r'C:\Windows\System32\rundll32.exe C:\Windows\System32\shell32.dll,Control_RunDLL',
+    r'schtasks.exe /create /tn "Updater" /tr "C:\ProgramData\updater.exe" /sc daily',
+    r'findstr /i "error" C:\logs\app.log | sort',
+]
+
+
+def legacy_cmdline_split(s):
+    RE_CMD_LEX = r'''((?<!\S)"[^"]+|(?<!\S)'[^']+)|(?<=\S)("|')|(\\\\(?=\\*")|\\")|(&&?|\|\|?|\d?>|[<])|([^\s"&|<>]+)|(\s+)|(.)'''
+
+    args = []
+    accu = ''
+    q = 0
+
+    cmd_ck = r'''(.*cmd\.exe|.*cmd\.EXE)\s(\/c|\/k|\-c|\-k)\s(.*$)'''
+
+    if re.match(cmd_ck, s):
+        args = list(re.findall(cmd_ck, s)[0])
+        if not re.match(r'^".*"$', args[-1]):
+            args[-1] = f'"{args[-1]}"'
+        return args
+
+    for rqs, lqs, esc, pipe, word, white, fail in re.findall(RE_CMD_LEX, s):
+        if word:
+            pass
+        elif esc:
+            word = esc[1]
+        elif white or pipe:
+            if q == 0:
+                if accu:
+                    args.append(accu)
+                if pipe:
+                    args.append(pipe)
+                accu = ''
+                continue
+            else:
+                if white:
+                    word = white
+                if pipe:
+                    word = pipe
+        elif fail:
+            raise ValueError("invalid or incomplete shell string")
+        elif rqs:
+            q += 1
+            word = rqs
+        elif lqs:
+            q -= 1
+            if q == 0:
+                args.append(accu + lqs)
+                accu = ''
+            else:
+                word = lqs
+        else:
+            word = rqs
+
+        accu += word
+
+    if accu:
+        args.append(accu)
+
+    return args
+
+
+def tokens_per_sec(split, corpus, repeat):
+    tokens = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for cmd_line in corpus:
+            tokens += len(split(cmd_line))
+    return tokens / (time.perf_counter() - start)
+
+
+def main(repeat=5000):
+    tokenizer = CommandLineTokenizer(None)
+
+    for cmd_line in CORPUS:
+        assert tokenizer.cmdline_split(cmd_line) == legacy_cmdline_split(cmd_line), cmd_line
+
+    before = tokens_per_sec(legacy_cmdline_split, CORPUS, repeat)
+    after = tokens_per_sec(tokenizer.cmdline_split, CORPUS, repeat)
+
+    print(f'previous lexer: {before:,.0f} tokens/sec')
+    print(f'current lexer:  {after:,.0f} tokens/sec')
+    print(f'speedup:        {after / before:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
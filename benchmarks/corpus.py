@@ -0,0 +1,128 @@
+"""Reproducible synthetic corpora for the benchmarks.
+
+Command lines mix common endpoint telemetry (services, browsers, Office,
+scheduled tasks), nested cmd.exe invocations, long base64 PowerShell blobs and
+pathological inputs such as very long tokens and deeply nested quoting. Prose
+is English text with IPv4 and IPv6 addresses, URLs and email addresses sprinkled in.
+"""
+import base64
+import random
+
+USERS = ['Alice', 'Bob', 'svc_backup', 'j.smith', 'Administrator']
+EXES = ['svchost.exe', 'rundll32.exe', 'conhost.exe', 'notepad.exe', 'regsvr32.exe', 'mshta.exe']
+ARGS = ['/c', '/k', '/q', '/s', '-k', '-p', '--type=renderer', '-NoProfile', '/i', '--silent']
+WORDS = ('the report shows that our team saw activity from a host which then contacted '
+         'several servers before the user was notified about it on friday').split()
+TLDS = ['com', 'net', 'org', 'io', 'ru']
+
+
+def _guid(rng):
+    return '{%08x-%04x-%04x-%04x-%012x}' % (rng.getrandbits(32), rng.getrandbits(16),
+                                             rng.getrandbits(16), rng.getrandbits(16),
+                                             rng.getrandbits(48))
+
+
+def _path(rng):
+    user = rng.choice(USERS)
+    return rng.choice([
+        rf'C:\Windows\System32\{rng.choice(EXES)}',
+        rf'C:\Windows\SysWOW64\{rng.choice(EXES)}',
+        rf'"C:\Program Files\Vendor {rng.randint(1, 99)}\app.exe"',
+        rf'"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe"',
+        rf'C:\Users\{user}\AppData\Local\Temp\{rng.getrandbits(24):x}.tmp',
+        rf'C:\Users\{user}\Documents\report{rng.randint(1, 9)}.docx',
+        rf'C:\ProgramData\{_guid(rng)}\updater.exe',
+        rf'\??\C:\Windows\system32\conhost.exe',
+        rf'D:\data\archive{rng.randint(1, 999)}.zip',
+    ])
+
+
+def _simple(rng):
+    parts = [_path(rng)]
+    for _ in range(rng.randint(0, 4)):
+        parts.append(rng.choice(ARGS))
+        if rng.random() < 0.5:
+            parts.append(rng.choice([_path(rng), str(rng.randint(0, 9999)), 'netsvcs']))
+    return ' '.join(parts)
+
+
+def _nested(rng):
+    return rf'C:\Windows\System32\cmd.exe /c "{_simple(rng)}"'
+
+
+def _powershell(rng):
+    script = ';'.join(f'$v{i} = "{rng.getrandbits(64):x}"' for i in range(rng.randint(20, 200)))
+    blob = base64.b64encode(script.encode('utf-16-le')).decode('ascii')
+    return rf'C:\Windows\System32\WindowsPowerShell\v1.0\powershell.exe -NoProfile -enc {blob}'
+
+
+def _pathological(rng):
+    return rng.choice([
+        'C:\\' + '\\'.join('a' * rng.randint(1, 8) for _ in range(rng.randint(200, 800))),
+        '"C:\\x' + ' a\\' * rng.randint(50, 200) + 'b',
+        'tool.exe ' + ' '.join(rng.choice(ARGS) for _ in range(rng.randint(200, 500))),
+        'x' * rng.randint(2000, 8000),
+    ])
+
+
+def generate_cmd_lines(n, seed=0, nested=0.15, powershell=0.05, pathological=0.01):
+    """Return n command lines; the keyword arguments are the share of each special kind"""
+    rng = random.Random(seed)
+    cmd_lines = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < pathological:
+            cmd_lines.append(_pathological(rng))
+        elif roll < pathological + powershell:
+            cmd_lines.append(_powershell(rng))
+        elif roll < pathological + powershell + nested:
+            cmd_lines.append(_nested(rng))
+        else:
+            cmd_lines.append(_simple(rng))
+    return cmd_lines
+
+
+def _adversarial(rng):
+    """Tokens crafted to make backtracking regexes blow up"""
+    size = rng.randint(1000, 8000)
+    return rng.choice([
+        'tool.exe "C:a ' + 'a\\' * (size // 2) + ' ',
+        'tool.exe "C:\\a \\" ' * (size // 9),
+        'tool.exe "' + 'a' * size,
+        'tool.exe http://' + 'a' * size + '!',
+        'tool.exe "b ' * (size // 12) + 'c"' * (size // 12),
+    ])
+
+
+def generate_adversarial_cmd_lines(n, seed=0):
+    """Return n command lines made of inputs crafted against the tagger's regexes"""
+    rng = random.Random(seed)
+    return [_adversarial(rng) for _ in range(n)]
+
+
+def generate_paths(n, seed=0):
+    rng = random.Random(seed)
+    return [_path(rng) for _ in range(n)]
+
+
+def _ioc(rng):
+    host = f'{rng.choice(WORDS)}{rng.randint(1, 99)}.{rng.choice(TLDS)}'
+    return rng.choice([
+        '.'.join(str(rng.randint(0, 255)) for _ in range(4)),
+        f'https://{host}/{rng.choice(WORDS)}?id={rng.randint(1, 9999)}',
+        f'www.{host}',
+        f'{rng.choice(USERS).lower()}@{host}',
+        ':'.join(f'{rng.getrandbits(16):x}' for _ in range(8)),
+        f'fe80::{rng.getrandbits(16):x}:{rng.getrandbits(16):x}',
+    ])
+
+
+def generate_prose(n, seed=0, ioc_rate=0.05):
+    """Return n English-like sentences where about ioc_rate of the words are IOCs"""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(n):
+        words = [_ioc(rng) if rng.random() < ioc_rate else rng.choice(WORDS)
+                 for _ in range(rng.randint(8, 40))]
+        sentences.append(' '.join(words).capitalize() + '.')
+    return sentences
@@ -0,0 +1,257 @@
+"""Benchmark suite for the tokenizer, taggers, path normalizer and processor.
+
+    python -m benchmarks.suite [--size N] [--seed N] [--only CASE ...]
+                               [--output results.json] [--compare baseline.json]
+
+Every case reports throughput (items/sec and tokens/sec), per-item p50/p99/max
+latency and the peak memory allocated while processing a sample of the corpus.
+Results are written as JSON so runs from different versions can be compared
+with --compare, which exits non-zero when a case regressed by more than
+--threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from cyberspacy.about import __version__
+
+from .corpus import generate_adversarial_cmd_lines, generate_cmd_lines, generate_paths, generate_prose
+
+CASES = {}
+
+
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def measure(func, items, count_tokens=None, memory_sample=200):
+    latencies = []
+    tokens = 0
+
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        result = func(item)
+        latencies.append(time.perf_counter() - item_start)
+        if count_tokens is not None:
+            tokens += count_tokens(result)
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows everything down, so memory is measured in its own pass
+    tracemalloc.start()
+    for item in items[:memory_sample]:
+        func(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'items': len(items),
+        'seconds': elapsed,
+        'items_per_sec': len(items) / elapsed if elapsed else 0.0,
+        'tokens_per_sec': tokens / elapsed if elapsed and count_tokens else None,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'max_us': latencies[-1] * 1e6 if latencies else 0.0,
+        'peak_memory_bytes': peak,
+    }
+
+
+def _command_line_nlp():
+    from spacy.lang.xx import Language
+    from cyberspacy import CommandLineTagger, CommandLineTokenizer
+
+    nlp = Language()
+    nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    nlp.add_pipe(CommandLineTagger(nlp), first=True)
+    return nlp
+
+
+def _english_nlp(*taggers):
+    from spacy.lang.en import English
+
+    nlp = English()
+    for tagger in taggers:
+        nlp.add_pipe(tagger(nlp, force_extension=True), last=True)
+    return nlp
+
+
+@case('tokenizer')
+def bench_tokenizer(corpus):
+    from cyberspacy import CommandLineTokenizer
+
+    tokenizer = CommandLineTokenizer(None)
+    return measure(tokenizer.cmdline_split, corpus['cmd_lines'], len)
+
+
+@case('core_parse')
+def bench_core_parse(corpus):
+    from cyberspacy.core import parse_cmdline
+
+    return measure(lambda cmd_line: parse_cmdline(cmd_line).normalize(), corpus['cmd_lines'])
+
+
+@case('cmdline_tagger')
+def bench_cmdline_tagger(corpus):
+    return measure(_command_line_nlp(), corpus['cmd_lines'], len)
+
+
+@case('normalize_path')
+def bench_normalize_path(corpus):
+    from cyberspacy.stemmer import NormalizeWinPath
+
+    return measure(NormalizeWinPath('x86_64', cache_size=0).normalize_path, corpus['paths'])
+
+
+@case('normalize_paths')
+def bench_normalize_paths(corpus):
+    from cyberspacy.stemmer import NormalizeWinPath
+
+    # One item is a batch of 100 paths, normalized with a fresh (empty) cache
+    batches = [corpus['paths'][i:i + 100] for i in range(0, len(corpus['paths']), 100)]
+    return measure(lambda paths: NormalizeWinPath('x86_64').normalize_paths(paths), batches, len)
+
+
+@case('processor_analyze')
+def bench_processor_analyze(corpus):
+    from cyberspacy import WindowsCommandlineProcessor
+
+    processor = WindowsCommandlineProcessor(cache_size=0)
+    return measure(processor.analyze, corpus['cmd_lines'], lambda a: len(a['tokens']))
+
+
+@case('adversarial')
+def bench_adversarial(corpus):
+    from cyberspacy import WindowsCommandlineProcessor
+
+    processor = WindowsCommandlineProcessor(cache_size=0)
+    return measure(processor.analyze, corpus['adversarial'], lambda a: len(a['tokens']))
+
+
+@case('ip_tagger')
+def bench_ip_tagger(corpus):
+    from cyberspacy import IPTagger
+
+    return measure(_english_nlp(IPTagger), corpus['prose'], len)
+
+
+@case('ipv6_tagger')
+def bench_ipv6_tagger(corpus):
+    from cyberspacy import IPv6Tagger
+
+    return measure(_english_nlp(IPv6Tagger), corpus['prose'], len)
+
+
+@case('url_tagger')
+def bench_url_tagger(corpus):
+    from cyberspacy import URLTagger
+
+    return measure(_english_nlp(URLTagger), corpus['prose'], len)
+
+
+@case('email_tagger')
+def bench_email_tagger(corpus):
+    from cyberspacy import EmailTagger
+
+    return measure(_english_nlp(EmailTagger), corpus['prose'], len)
+
+
+@case('stacked_ioc_taggers')
+def bench_stacked_ioc_taggers(corpus):
+    from cyberspacy import EmailTagger, IPTagger, URLTagger
+
+    return measure(_english_nlp(IPTagger, URLTagger, EmailTagger), corpus['prose'], len)
+
+
+@case('ioc_tagger')
+def bench_ioc_tagger(corpus):
+    from cyberspacy import IOCTagger
+
+    return measure(_english_nlp(IOCTagger), corpus['prose'], len)
+
+
+def build_corpus(size, seed):
+    return {
+        'cmd_lines': generate_cmd_lines(size, seed),
+        'paths': generate_paths(size, seed),
+        'prose': generate_prose(size, seed),
+        # Crafted inputs are slow to generate and process, keep them to a sample
+        'adversarial': generate_adversarial_cmd_lines(max(1, size // 20), seed),
+    }
+
+
+def run(size=2000, seed=0, only=None):
+    corpus = build_corpus(size, seed)
+    results = {}
+    for name, setup in CASES.items():
+        if only and name not in only:
+            continue
+        results[name] = setup(corpus)
+
+    return {
+        'cyberspacy_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'size': size, 'seed': seed},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.1):
+    """Return (case, metric, baseline, current) for every metric that regressed"""
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if result['items_per_sec'] < before['items_per_sec'] * (1 - threshold):
+            regressions.append((name, 'items_per_sec', before['items_per_sec'], result['items_per_sec']))
+        if result['p99_us'] > before['p99_us'] * (1 + threshold):
+            regressions.append((name, 'p99_us', before['p99_us'], result['p99_us']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help='items per corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=sorted(CASES), help='cases to run')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.seed, args.only)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f'REGRESSION {name} {metric}: {before:,.1f} -> {after:,.1f}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,35 @@
-from .processor import WindowsCommandlineProcessor
-from .tagger import IPTagger, EmailTagger, URLTagger, CommandLineTagger
-from .tokenizer import CommandLineTokenizer
+from importlib import import_module
 
 from .about import __version__
+
+# Public names and the submodule that defines them. Submodules are only imported
+# the first time one of their names is used, so importing cyberspacy (or just
+# cyberspacy.core) doesn't pay for loading spaCy.
+_lazy_attrs = {
+    'WindowsCommandlineProcessor': 'processor',
+    'IPTagger': 'tagger',
+    'IPv6Tagger': 'tagger',
+    'EmailTagger': 'tagger',
+    'URLTagger': 'tagger',
+    'IOCTagger': 'tagger',
+    'CommandLineTagger': 'tagger',
+    'CommandLineTokenizer': 'tokenizer',
+    'RuleSet': 'rules',
+    'TemplateIndex': 'fingerprint',
+    'RaritySketch': 'sketches',
+}
+
+__all__ = ['__version__'] + list(_lazy_attrs)
+
+
+def __getattr__(name):
+    module_name = _lazy_attrs.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs))
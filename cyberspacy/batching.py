@@ -0,0 +1,174 @@
+"""Micro-batching of concurrent asyncio requests.
+
+`MicroBatcher` collects the items submitted by concurrent coroutines for up to
+`max_delay` seconds (or until `max_batch_size` items are waiting) and runs them
+as one call of a batch function in an executor, so the event loop never blocks
+on parsing and thousands of requests become a handful of batch calls.
+
+    USAGE:
+    >>> import asyncio
+    >>> from cyberspacy.batching import MicroBatcher
+    >>> batcher = MicroBatcher(lambda items: [item.upper() for item in items])
+    >>> async def main():
+    ...     return await asyncio.gather(*(batcher.submit(s) for s in ['a', 'b', 'c']))
+    >>> asyncio.run(main())
+    ['A', 'B', 'C']
+    >>> batcher.batches
+    1
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import weakref
+
+
+class _LoopState(object):
+    """What a batcher keeps for the event loop its callers run on. Semaphores,
+    timers and futures belong to one loop, so each loop gets its own."""
+
+    __slots__ = ('waiting', 'timer', 'slots', 'running', 'tasks')
+
+    def __init__(self, max_pending, max_concurrency):
+        self.waiting = []
+        self.timer = None
+        self.slots = asyncio.Semaphore(max_pending)
+        self.running = asyncio.Semaphore(max_concurrency)
+        self.tasks = set()
+
+
+class MicroBatcher(object):
+
+    def __init__(self, func, max_batch_size=256, max_delay=0.002, max_pending=10000,
+                 executor=None, max_concurrency=1):
+        """Build a batcher around a batch function.
+
+        func (callable): Takes a list of items and returns a list of results in the
+            same order. Runs in the executor, never on the event loop. If it raises,
+            the items of the batch are retried one at a time, so only the callers
+            whose items fail get the exception.
+        max_batch_size (int): Most items passed to one call of func.
+        max_delay (float): Seconds the first item of a batch waits for more.
+        max_pending (int): Most items submitted but not yet answered. Further
+            submit calls wait for room, which pushes back on the producers.
+        executor (Executor): Where func runs. Defaults to a thread pool with
+            max_concurrency threads.
+        max_concurrency (int): Most batches running at once.
+        """
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+        if max_pending < max_batch_size:
+            raise ValueError('max_pending must be at least max_batch_size')
+
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._owns_executor = executor is None
+        self.batches = 0
+        self.items = 0
+
+        # Event loop -> _LoopState, so the batcher can be used from several loops,
+        # e.g. by successive asyncio.run calls
+        self._loops = weakref.WeakKeyDictionary()
+
+    async def submit(self, item):
+        """Return func's result for item once its batch has run"""
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = _LoopState(self.max_pending, self.max_concurrency)
+
+        async with state.slots:
+            future = loop.create_future()
+            state.waiting.append((item, future))
+            if len(state.waiting) >= self.max_batch_size:
+                self._flush(state)
+            elif state.timer is None:
+                state.timer = loop.call_later(self.max_delay, self._flush, state)
+            return await future
+
+    async def map(self, items):
+        """Yield the result for each item of an async or regular iterable, in order.
+
+        At most max_pending items are in flight at once, so arbitrarily long
+        streams are processed in bounded memory.
+        """
+        pending = deque()
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                pending.append(asyncio.ensure_future(self.submit(item)))
+                if len(pending) >= self.max_pending:
+                    yield await pending.popleft()
+        else:
+            for item in items:
+                pending.append(asyncio.ensure_future(self.submit(item)))
+                if len(pending) >= self.max_pending:
+                    yield await pending.popleft()
+
+        while pending:
+            yield await pending.popleft()
+
+    def _flush(self, state):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        while state.waiting:
+            batch = state.waiting[:self.max_batch_size]
+            del state.waiting[:self.max_batch_size]
+            # Keep a reference so the task isn't garbage collected while it runs
+            task = asyncio.ensure_future(self._run(state, batch))
+            state.tasks.add(task)
+            task.add_done_callback(state.tasks.discard)
+
+    async def _run(self, state, batch):
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_concurrency,
+                                               thread_name_prefix='cyberspacy-batch')
+
+        async with state.running:
+            try:
+                results = await loop.run_in_executor(self.executor, self.func,
+                                                     [item for item, future in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    self._set_exception(batch[0][1], e)
+                    return
+                # One bad item shouldn't fail the others, so find it by running
+                # each item of the batch on its own
+                for item, future in batch:
+                    await self._run_one(loop, item, future)
+                return
+
+        self.batches += 1
+        self.items += len(batch)
+        for (item, future), result in zip(batch, results):
+            # The caller may have been cancelled while the batch ran
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_one(self, loop, item, future):
+        if future.done():
+            return
+        try:
+            results = await loop.run_in_executor(self.executor, self.func, [item])
+        except Exception as e:
+            self._set_exception(future, e)
+            return
+        self.batches += 1
+        self.items += 1
+        if not future.done():
+            future.set_result(results[0])
+
+    @staticmethod
+    def _set_exception(future, exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    def close(self):
+        """Shut down the executor if the batcher created it"""
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts entries once it holds more than `maxsize` items.
+
+    policy (unicode): 'lru' evicts the least recently used entry, 'fifo' evicts
+        the oldest inserted entry regardless of how often it was read.
+
+    The cache can be shared between threads, e.g. a processor used both directly
+    and by the executor thread of its async methods.
+    """
+
+    policies = ('lru', 'fifo')
+
+    def __init__(self, maxsize=1024, policy='lru'):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if policy not in self.policies:
+            raise ValueError(f'policy must be one of {self.policies}')
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            if self.policy == 'lru':
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._data[key] = value
+                if self.policy == 'lru':
+                    self._data.move_to_end(key)
+                return
+
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'policy': self.policy
+            }
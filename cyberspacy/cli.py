@@ -0,0 +1,180 @@
+"""Command line interface for streaming command line normalization.
+
+    cyberspacy normalize [FILE ...] [--format lines|jsonl|csv] [--field PATH]
+                         [--batch-size N] [--workers N] [--rules FILE] [--stats]
+
+Reads command lines from FILEs (or stdin) and writes one JSON record per input
+record to stdout. Records are streamed, so memory use is bounded by the batch
+size and number of workers rather than the size of the input.
+"""
+import argparse
+import csv
+import json
+import sys
+from itertools import tee
+
+from . import instrument
+from .processor import WindowsCommandlineProcessor
+
+FORMATS = ('lines', 'jsonl', 'csv')
+
+
+def get_field(record, field_path, dotted=True):
+    """Return the value at a dotted field path in a nested dict, or None. With
+    dotted=False the field path is a single key, e.g. a CSV column name."""
+    value = record
+    for key in field_path.split('.') if dotted else (field_path,):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def iter_records(stream, input_format):
+    """Yield dict records from a text stream. A JSONL line that isn't a JSON object
+    yields the exception in its place."""
+    if input_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if input_format == 'jsonl':
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield e
+                continue
+            if not isinstance(record, dict):
+                record = TypeError(f'Expected a JSON object, got {type(record).__name__}')
+            yield record
+        else:
+            yield {'command_line': line}
+
+
+def open_inputs(paths):
+    for path in paths:
+        if path == '-':
+            yield sys.stdin
+        else:
+            with open(path, encoding='utf8', newline='') as f:
+                yield f
+
+
+def enrich(records, processor, field_path, output_field, include_nested_commands, batch_size,
+           dotted=True):
+    """Yield each record with its analysis added under output_field.
+
+    Records whose field is missing or not a string are passed through with a
+    null analysis. So are records whose command line can't be parsed, with the
+    error under output_field + '_error'. An exception in place of a record, e.g.
+    for a JSONL line that isn't a JSON object, becomes a record of just the null
+    analysis and the error.
+    """
+    records, to_parse = tee(records)
+    cmd_lines = (get_field(record, field_path, dotted) for record in to_parse)
+    cmd_lines = (cmd_line if isinstance(cmd_line, str) else '' for cmd_line in cmd_lines)
+
+    analyses = processor.analyze_many(cmd_lines,
+                                      include_nested_commands=include_nested_commands,
+                                      batch_size=batch_size, return_exceptions=True)
+    for record, analysis in zip(records, analyses):
+        if isinstance(record, Exception):
+            record, analysis = {}, record
+        if isinstance(analysis, Exception):
+            record[output_field] = None
+            record[f'{output_field}_error'] = f'{type(analysis).__name__}: {analysis}'
+        elif not isinstance(get_field(record, field_path, dotted), str):
+            record[output_field] = None
+        else:
+            record[output_field] = analysis
+        yield record
+
+
+def normalize(args):
+    if args.stats:
+        instrument.enable()
+    processor = WindowsCommandlineProcessor(n_process=args.workers, cache_size=args.cache_size,
+                                            rules=args.rules)
+    field_path = args.field or 'command_line'
+    output_field = args.output_field
+
+    records = (record
+               for stream in open_inputs(args.files or ['-'])
+               for record in iter_records(stream, args.format))
+
+    out = sys.stdout
+    # CSV column names are looked up as they are, even if they contain dots
+    for record in enrich(records, processor, field_path, output_field,
+                         not args.no_nested, args.batch_size, dotted=args.format != 'csv'):
+        out.write(json.dumps(record, ensure_ascii=False))
+        out.write('\n')
+    out.flush()
+    if args.stats:
+        instrument.disable()
+        print(instrument.format_snapshot(), file=sys.stderr)
+    return 0
+
+
+def positive_int(value):
+    """argparse type of options that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return number
+
+
+def non_negative_int(value):
+    """argparse type of options that must be at least 0"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'must be at least 0, got {value}')
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cyberspacy',
+                                     description='cybersecurity datatypes for spaCy')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    norm = commands.add_parser('normalize',
+                               help='tokenize, tag and normalize Windows command lines')
+    norm.add_argument('files', nargs='*', metavar='FILE',
+                      help='input files, "-" or nothing for stdin')
+    norm.add_argument('--format', choices=FORMATS, default='lines',
+                      help='input format (default: lines)')
+    norm.add_argument('--field',
+                      help='dotted path of the command line field for jsonl, or column name for '
+                           'csv (default: command_line)')
+    norm.add_argument('--output-field', default='cyberspacy',
+                      help='field the analysis is written to (default: cyberspacy)')
+    norm.add_argument('--batch-size', type=positive_int, default=1000,
+                      help='command lines per batch (default: 1000)')
+    norm.add_argument('--workers', type=positive_int, default=1,
+                      help='number of worker processes (default: 1)')
+    norm.add_argument('--cache-size', type=non_negative_int, default=1024,
+                      help='number of parsed command lines to memoize, 0 to disable '
+                           '(default: 1024)')
+    norm.add_argument('--no-nested', action='store_true',
+                      help="don't include args and paths of nested commands")
+    norm.add_argument('--rules', metavar='FILE',
+                      help='JSON or YAML file of path normalization rules used besides the '
+                           'built-in ones')
+    norm.add_argument('--stats', action='store_true',
+                      help='print per-stage timings to stderr when done (time spent in '
+                           'worker processes is not included)')
+    norm.set_defaults(func=normalize)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head), nothing left to do
+        return 0
@@ -0,0 +1,197 @@
+r"""Columnar command line enrichment with Apache Arrow.
+
+Takes a column of command lines (a pyarrow Array or ChunkedArray, a pandas Series
+or any iterable of strings) and returns Arrow record batches with four columns:
+
+- normalized (string): the normalized command line
+- args, paths, normalized_paths (list<string>): as returned by
+  WindowsCommandlineProcessor.analyze
+
+Input is processed in chunks of `chunk_size` rows so memory is bounded by the chunk
+rather than the column. Normalized command lines and the values of the list
+columns repeat a lot in real telemetry, so by default they are dictionary encoded.
+Null and non-string inputs, and command lines that can't be parsed, give null
+output rows. Pass a processor with n_process set to parse in worker processes; every
+chunk and Parquet row group goes through the processor's one pool, so close the
+processor when done.
+
+Needs pyarrow (pip install cyberspacy[arrow]), and pandas for analyze_series.
+
+    USAGE:
+    >>> from cyberspacy import columnar
+    >>> table = columnar.analyze_column([r'"C:\Program Files\MyProgram.exe" /d', None])
+    >>> assert table.column('normalized').to_pylist() == [r'"?pf64\myprogram.exe" /d', None]
+    >>> assert table.column('args').to_pylist() == [['/d'], None]
+"""
+from .processor import WindowsCommandlineProcessor, _chunks
+
+COLUMNS = ('normalized', 'args', 'paths', 'normalized_paths')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('cyberspacy.columnar needs pyarrow, install it with '
+                          'pip install cyberspacy[arrow]') from None
+    return pyarrow
+
+
+def output_schema(dictionary=True, prefix=''):
+    """Arrow schema of the batches returned by analyze_batch"""
+    pa = _import_pyarrow()
+    string = pa.dictionary(pa.int32(), pa.string()) if dictionary else pa.string()
+    return pa.schema([(prefix + 'normalized', string)] +
+                     [(prefix + name, pa.list_(string)) for name in COLUMNS[1:]])
+
+
+def _analyses(processor, cmd_lines, include_nested_commands):
+    """Yield (normalized, args, paths, normalized_paths) for each command line, or
+    None for one that can't be parsed"""
+    batch_size = max(1, len(cmd_lines) // (processor.n_process * 4))
+    for analysis in processor.analyze_many(cmd_lines, batch_size=batch_size,
+                                           include_nested_commands=include_nested_commands,
+                                           return_exceptions=True):
+        if isinstance(analysis, Exception):
+            yield None
+        else:
+            yield (analysis['normalized'], analysis['args'], analysis['paths'],
+                   analysis['normalized_paths'])
+
+
+def analyze_batch(cmd_lines, processor=None, include_nested_commands=True, dictionary=True,
+                  prefix=''):
+    """Analyze a list or pyarrow Array of command lines.
+
+    Each distinct command line in the batch is analyzed once and the output rows
+    are gathered from the distinct results, so duplicates cost next to nothing.
+
+    cmd_lines (list): Command lines, or a pyarrow Array of strings.
+    processor (WindowsCommandlineProcessor): Processor to parse with. Its cache is
+        reused across batches, and so are its n_process workers if set: the pool
+        is started by the first batch and kept until processor.close().
+    include_nested_commands (bool): Include args and paths of nested commands.
+    dictionary (bool): Dictionary encode the output strings.
+    prefix (unicode): Prepended to the output column names.
+    RETURNS (pyarrow.RecordBatch): One row per command line.
+    """
+    pa = _import_pyarrow()
+    import pyarrow.compute as pc
+
+    if processor is None:
+        processor = WindowsCommandlineProcessor()
+    if isinstance(cmd_lines, pa.ChunkedArray):
+        cmd_lines = cmd_lines.combine_chunks()
+    if not isinstance(cmd_lines, pa.Array):
+        cmd_lines = pa.array([cmd_line if isinstance(cmd_line, str) else None
+                              for cmd_line in cmd_lines], type=pa.string())
+
+    # Nulls stay null in the indices and so in every output column
+    encoded = cmd_lines.dictionary_encode()
+    indices = encoded.indices
+
+    normalized = []
+    offsets = ([0], [0], [0])
+    values = ([], [], [])
+    failed = []
+    for analysis in _analyses(processor, encoded.dictionary.to_pylist(), include_nested_commands):
+        failed.append(analysis is None)
+        if analysis is None:
+            analysis = ('', (), (), ())
+        normalized.append(analysis[0])
+        for column_offsets, column_values, column in zip(offsets, values, analysis[1:]):
+            column_values.extend(column)
+            column_offsets.append(len(column_values))
+
+    if any(failed):
+        # Rows of command lines that can't be parsed are null, like null inputs
+        row_failed = pc.fill_null(pc.take(pa.array(failed), indices), False)
+        indices = pc.if_else(row_failed, pa.scalar(None, indices.type), indices)
+
+    def strings(items):
+        array = pa.array(items, type=pa.string())
+        return array.dictionary_encode() if dictionary else array
+
+    if dictionary:
+        columns = [pa.DictionaryArray.from_arrays(indices, pa.array(normalized, type=pa.string()))]
+    else:
+        columns = [pc.take(pa.array(normalized, type=pa.string()), indices)]
+    for column_offsets, column_values in zip(offsets, values):
+        distinct = pa.ListArray.from_arrays(pa.array(column_offsets, type=pa.int32()),
+                                            strings(column_values))
+        columns.append(pc.take(distinct, indices))
+    return pa.RecordBatch.from_arrays(columns, schema=output_schema(dictionary, prefix))
+
+
+def _iter_chunks(column, chunk_size):
+    pa = _import_pyarrow()
+    if isinstance(column, pa.Array):
+        column = pa.chunked_array([column])
+    if isinstance(column, pa.ChunkedArray):
+        for chunk in column.chunks:
+            for offset in range(0, len(chunk), chunk_size):
+                yield chunk.slice(offset, chunk_size)
+        return
+
+    # pandas Series and other iterables, analyze_batch turns NaN and other
+    # non-strings into nulls
+    yield from _chunks(column, chunk_size)
+
+
+def iter_batches(column, processor=None, include_nested_commands=True, chunk_size=65536,
+                 dictionary=True, prefix=''):
+    """Lazily yield a RecordBatch for every chunk_size rows of column"""
+    if processor is None:
+        processor = WindowsCommandlineProcessor()
+    for chunk in _iter_chunks(column, chunk_size):
+        yield analyze_batch(chunk, processor, include_nested_commands, dictionary, prefix)
+
+
+def analyze_column(column, processor=None, include_nested_commands=True, chunk_size=65536,
+                   dictionary=True, prefix=''):
+    """Analyze a whole column. RETURNS (pyarrow.Table): One row per command line."""
+    pa = _import_pyarrow()
+    batches = iter_batches(column, processor, include_nested_commands, chunk_size,
+                           dictionary, prefix)
+    return pa.Table.from_batches(batches, schema=output_schema(dictionary, prefix))
+
+
+def analyze_series(series, processor=None, include_nested_commands=True, chunk_size=65536,
+                   dictionary=True, prefix=''):
+    """Analyze a pandas Series. RETURNS (pandas.DataFrame): With the index of series.
+    Dictionary encoded columns become categoricals."""
+    table = analyze_column(series, processor, include_nested_commands, chunk_size,
+                           dictionary, prefix)
+    frame = table.to_pandas()
+    frame.index = series.index
+    return frame
+
+
+def analyze_parquet(source, destination, column, processor=None, include_nested_commands=True,
+                    chunk_size=65536, dictionary=True, prefix='cyberspacy_'):
+    """Stream a Parquet file into a new one with the analysis columns appended.
+
+    Only chunk_size rows are held in memory at a time. The output columns are named
+    with prefix so they don't clash with the input columns.
+    RETURNS (int): The number of rows written.
+    """
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    if processor is None:
+        processor = WindowsCommandlineProcessor()
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow
+    for field in output_schema(dictionary, prefix):
+        schema = schema.append(field)
+
+    rows = 0
+    with pq.ParquetWriter(destination, schema) as writer:
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            analysis = analyze_batch(batch.column(column), processor, include_nested_commands,
+                                     dictionary, prefix)
+            arrays = batch.columns + analysis.columns
+            writer.write_table(pa.Table.from_batches([pa.RecordBatch.from_arrays(arrays,
+                                                                                 schema=schema)]))
+            rows += batch.num_rows
+    return rows
@@ -0,0 +1,344 @@
+r"""Pure Python command line parsing shared by the spaCy components.
+
+`parse_cmdline` tokenizes, tags and normalizes a Windows command line without
+building a spaCy `Doc`. `CommandLineTokenizer`, `CommandLineTagger` and
+`WindowsCommandlineProcessor` are adapters over the functions in this module.
+
+    USAGE:
+    >>> from cyberspacy.core import parse_cmdline
+    >>> parsed = parse_cmdline(r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt')
+    >>> assert parsed.tokens == [r'"C:\Program Files\MyProgram.exe"', '/d', r'C:\Users\Alice\file.txt']
+    >>> assert parsed.kinds == [PATH, ARG, PATH | VAL]
+    >>> assert parsed.normalize() == r'"?pf64\myprogram.exe" /d ?usr\file.txt'
+"""
+import re
+
+from .stemmer import NormalizeWinPath
+
+# Lexer for one command line argument at a time. The groups, in order, are: opening
+# quote and the quoted text after it, closing quote, escape, pipe/redirection
+# operator, bare word, whitespace and anything that can't be lexed.
+RE_CMD_LEX = re.compile(r'''((?<!\S)"[^"]+|(?<!\S)'[^']+)|(?<=\S)("|')|(\\\\(?=\\*")|\\")|(&&?|\|\|?|\d?>|[<])|([^\s"&|<>]+)|(\s+)|(.)''')
+RQS, LQS, ESC, PIPE, WORD, WHITE, FAIL = range(1, 8)
+
+# Used when a command line has no quotes, so nothing can be quoted or escaped
+RE_SIMPLE_LEX = re.compile(r'''&&?|\|\|?|\d?>|<|[^\s&|<>]+''')
+OPERATOR_CHARS = ('&', '|', '<', '>')
+
+# cmd.exe [/c command] and [/k command]
+RE_CMD_CK = re.compile(r'''(.*cmd\.exe|.*cmd\.EXE)\s(\/c|\/k|\-c|\-k)\s(.*$)''')
+RE_QUOTED = re.compile(r'^".*"$')
+
+
+def cmdline_split(s):
+    """Split a Windows command line into arguments, keeping quoted arguments whole"""
+    if 'cmd.' in s:
+        cmd_match = RE_CMD_CK.match(s)
+        if cmd_match:
+            args = list(cmd_match.groups())
+            if not RE_QUOTED.match(args[-1]):
+                args[-1] = f'"{args[-1]}"'
+            return args
+
+    if '"' not in s and "'" not in s:
+        if any(c in s for c in OPERATOR_CHARS):
+            return RE_SIMPLE_LEX.findall(s)
+        return s.split()
+
+    args = []
+    accu = []   # collects pieces of one arg
+    q = 0
+
+    for match in RE_CMD_LEX.finditer(s):
+        kind = match.lastindex
+        word = match.group(kind)
+
+        if kind == WORD:
+            accu.append(word)   # most frequent
+        elif kind == WHITE or kind == PIPE:
+            if q == 0:
+                if accu:
+                    args.append(''.join(accu))
+                    accu = []
+                if kind == PIPE:
+                    args.append(word)
+            else:
+                accu.append(word)
+        elif kind == ESC:
+            accu.append(word[1])
+        elif kind == RQS:
+            q += 1
+            accu.append(word)
+        elif kind == LQS:
+            q -= 1
+            accu.append(word)
+            if q == 0:
+                args.append(''.join(accu))
+                accu = []
+        else:
+            raise ValueError("invalid or incomplete shell string")
+
+    if accu:
+        args.append(''.join(accu))
+
+    return args
+
+
+# Token kinds assigned by CommandLineTagger. A token can have several kinds at once.
+PATH, ARG, CMD, VAL = 1, 2, 4, 8
+
+# Every pattern below is unambiguous, so a failed search backtracks a bounded
+# number of steps per character instead of trying every way of splitting the
+# token. In the quoted alternative of path_re each space-separated run after
+# the first must hold a backslash after its first character, which is what the
+# nested (\S+\\)+ groups of the original pattern matched.
+path_re = re.compile(r"""\\\?\??\\[^ ]|"[a-zA-Z]:(?:\\Program Files \(x86\))?[^"\s]+(?:\s\S[^\s\\]*\\\S*)*"|^[a-zA-Z]?:[^ ]""")
+path_prefix_re = re.compile(r"""\\\?\??\\[^ ]|^[a-zA-Z]?:[^ ]""")
+arg_re = re.compile(r"""(^(\/|-|--)\S*$)""")
+cmd_re = re.compile(r'''"[^"\n]*"''')
+# A value is anything that doesn't start with one of these characters
+val_excluded = frozenset('(/|-) ')
+
+# path_re.search tries the quoted alternative from every '"' followed by a drive,
+# so a token with many quotes is checked with _search_quoted_path instead
+MAX_QUOTES = 16
+# Tokens longer than this aren't classified by tag_tokens, see there
+MAX_TOKEN_LENGTH = 8192
+# Nested commands deeper than this aren't parsed. Each level lexes its text again,
+# so without a limit deep nesting costs time quadratic in the command line length.
+MAX_NESTING_DEPTH = 8
+
+_PF = '\\Program Files (x86)'
+_FIRST, _W0, _W1, _W2, _QUOTE, _DRIVE, _COLON = -1, -2, -3, -4, -5, -6, -7
+_letters = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def _search_quoted_path(text):
+    """Whether the quoted alternative of path_re matches anywhere in text.
+
+    Runs the pattern as an automaton over the set of states reachable at each
+    character, so it takes linear time however many quotes text holds. The
+    states are the positions in the pattern: in the first run, after a separating
+    space, in a later run before and after its inner backslash, after the opening
+    quote, drive letter and colon, and how much of _PF has been matched.
+    """
+    states = ()
+    for c in text:
+        space = c.isspace()
+        reached = set()
+        for state in states:
+            if state == _FIRST:
+                if c == '"':
+                    return True
+                reached.add(_W0 if space else _FIRST)
+            elif state == _W0:
+                if not space:
+                    reached.add(_W1)
+            elif state == _W1:
+                if c == '\\':
+                    reached.add(_W2)
+                elif not space:
+                    reached.add(_W1)
+            elif state == _W2:
+                if c == '"':
+                    return True
+                reached.add(_W0 if space else _W2)
+            elif state == _QUOTE:
+                if c in _letters:
+                    reached.add(_DRIVE)
+            elif state == _DRIVE:
+                if c == ':':
+                    reached.add(_COLON)
+            else:
+                k = 0 if state == _COLON else state
+                if (k == 0 or k == len(_PF)) and c != '"' and not space:
+                    reached.add(_FIRST)
+                if k < len(_PF) and c == _PF[k]:
+                    reached.add(k + 1)
+        if c == '"':
+            reached.add(_QUOTE)
+        states = reached
+    return False
+
+
+def is_path_text(text):
+    """Whether path_re.search(text) matches, in linear time"""
+    if text.count('"') > MAX_QUOTES:
+        return bool(path_prefix_re.search(text)) or _search_quoted_path(text)
+    return bool(path_re.search(text))
+
+
+def classify_token(text):
+    """Return the kinds of a command line token as a bit mask of PATH, ARG, CMD and VAL.
+
+    The first character decides whether a token can be an argument or a value,
+    and cheap substring checks rule out paths and nested commands before any
+    regex runs.
+    """
+    kind = 0
+    first = text[:1]
+
+    if first == '/' or first == '-':
+        if arg_re.search(text):
+            kind = ARG
+    elif first and first not in val_excluded:
+        kind = VAL
+
+    if (':' in text or '?\\' in text) and is_path_text(text):
+        kind |= PATH
+    if '"' in text and cmd_re.search(text):
+        kind |= CMD
+
+    return kind
+
+
+_normalizers = {}
+
+def get_normalizer(architecture='x86_64'):
+    """Return a shared NormalizeWinPath for the architecture"""
+    normalizer = _normalizers.get(architecture)
+    if normalizer is None:
+        normalizer = _normalizers[architecture] = NormalizeWinPath(architecture)
+    return normalizer
+
+
+def tag_tokens(tokens, normalizer, max_token_length=MAX_TOKEN_LENGTH):
+    """Return the kinds and stems of a sequence of command line tokens.
+
+    Kinds follow CommandLineTagger: a path is never also a nested command, and
+    the first token is never a value. Paths are stemmed with the normalizer,
+    other classified tokens stem to themselves and unclassified tokens to None.
+    Tokens longer than max_token_length (None for no limit) aren't matched against
+    any pattern; they are left unclassified and stem to themselves, so they pass
+    through normalization unchanged.
+    """
+    kinds = []
+    stems = []
+
+    for i, text in enumerate(tokens):
+        if max_token_length is not None and len(text) > max_token_length:
+            kinds.append(0)
+            stems.append(text)
+            continue
+
+        kind = classify_token(text)
+        if kind & PATH:
+            kind &= ~CMD
+            stems.append(normalizer.normalize_path(text))
+        elif kind:
+            stems.append(text)
+        else:
+            stems.append(None)
+        if i == 0:
+            kind &= ~VAL
+        kinds.append(kind)
+
+    return kinds, stems
+
+
+class ParsedCommandLine(object):
+    """Tokens of a command line with their kinds, stems and nested commands.
+
+    Nested commands are parsed the first time they are asked for, down to
+    MAX_NESTING_DEPTH levels. Nested commands below that are kept as they are.
+    """
+
+    __slots__ = ('text', 'tokens', 'kinds', 'stems', 'architecture', 'max_token_length',
+                 'normalizer', 'depth', '_sub_cmds')
+
+    def __init__(self, text, tokens, kinds, stems, architecture='x86_64',
+                 max_token_length=MAX_TOKEN_LENGTH, normalizer=None, depth=0):
+        self.text = text
+        self.tokens = tokens
+        self.kinds = kinds
+        self.stems = stems
+        self.architecture = architecture
+        self.max_token_length = max_token_length
+        self.normalizer = normalizer
+        self.depth = depth
+        self._sub_cmds = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.text!r})'
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def sub_cmd(self, i):
+        """Return the nested command held by token i, or None if it isn't one or
+        it is nested deeper than MAX_NESTING_DEPTH"""
+        if not self.kinds[i] & CMD or self.depth >= MAX_NESTING_DEPTH:
+            return None
+        if self._sub_cmds is None:
+            self._sub_cmds = {}
+        sub_cmd = self._sub_cmds.get(i)
+        if sub_cmd is None:
+            sub_cmd = self._sub_cmds[i] = parse_cmdline(self.tokens[i][1:-1], self.architecture,
+                                                        self.max_token_length, self.normalizer,
+                                                        self.depth + 1)
+        return sub_cmd
+
+    @property
+    def sub_cmds(self):
+        return [self.sub_cmd(i) for i in range(len(self.tokens))]
+
+    def normalize(self):
+        """Fully normalize the command line by stemming all tokens. Unclassified
+        tokens, e.g. pipes and parentheses, are kept as they are."""
+        stemmed = []
+        for i, kind in enumerate(self.kinds):
+            sub_cmd = self.sub_cmd(i)
+            if sub_cmd is not None:
+                stemmed.append(f'"{sub_cmd.normalize()}"')
+            else:
+                stem = self.stems[i]
+                stemmed.append(self.tokens[i] if stem is None else stem)
+        return ' '.join(stemmed)
+
+    def collect(self, include_nested_commands=True):
+        """Return (args, paths, normalized_paths), including those of nested commands
+        one level deep"""
+        cl_args = []
+        paths = []
+        normalized_paths = []
+
+        for i, kind in enumerate(self.kinds):
+            if kind & ARG:
+                cl_args.append(self.tokens[i])
+            if kind & PATH:
+                paths.append(self.tokens[i])
+                normalized_paths.append(self.stems[i])
+            if include_nested_commands and kind & CMD and not kind & (ARG | PATH):
+                sub_cmd = self.sub_cmd(i)
+                if sub_cmd is None:
+                    continue
+                for sub_kind, text, stem in zip(sub_cmd.kinds, sub_cmd.tokens, sub_cmd.stems):
+                    if sub_kind & ARG:
+                        cl_args.append(text)
+                    if sub_kind & PATH:
+                        paths.append(text)
+                        normalized_paths.append(stem)
+
+        return cl_args, paths, normalized_paths
+
+    def args(self, include_nested_commands=True):
+        return self.collect(include_nested_commands)[0]
+
+    def paths(self, include_nested_commands=True):
+        return self.collect(include_nested_commands)[1]
+
+    def normalized_paths(self, include_nested_commands=True):
+        return self.collect(include_nested_commands)[2]
+
+
+def parse_cmdline(s, architecture='x86_64', max_token_length=MAX_TOKEN_LENGTH, normalizer=None,
+                  depth=0):
+    """Tokenize, tag and stem a command line without spaCy. Paths are stemmed with
+    normalizer, e.g. a NormalizeWinPath with user rules, or the shared normalizer
+    for the architecture if it is None. depth is how deeply the command line is
+    nested in another one."""
+    tokens = cmdline_split(s)
+    kinds, stems = tag_tokens(tokens, normalizer or get_normalizer(architecture),
+                              max_token_length)
+    return ParsedCommandLine(s, tokens, kinds, stems, architecture, max_token_length,
+                             normalizer, depth)
@@ -42,14 +42,15 @@ ipv6_expr = r"""
 
 email_expr = r"""[\w!#$%&'*+/=?`{|}~^-]+(?:\.[\w!#$%&'*+/=?`{|}~^-]+)*@(?:[A-Z0-9-]+\.)+[A-Z]{2,6}"""
 
+# A scheme or ~/ (with optional user info), www., user info followed by @, or a
+# dotted quad, then the rest of the URL. The alternatives only share their first
+# host character with the tail, so a failed match never backtracks over the host.
 url_expr = r"""
-(?:(?:(?:(?:
-  (?:ht|f)tp(?:s?)://|~/)
-  (?:[-;:&=+$,\w'.]+@)?
-  (?:[A-Za-z0-9.-:]+))
-  |(?:(?:www\.|[-;:&=+$,\w'.]+@)
-  (?:[A-Za-z0-9.-:]+))|
-  (?:(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})))
-  (?:[-\w~!$+|.,=/\?'#%*:&@;]*))
+(?:
+  (?:(?:ht|f)tps?://|~/)(?:[-;:&=+$,\w'.]+@)?[A-Za-z0-9.-:]
+ |www\.[A-Za-z0-9.-:]
+ |[-;:&=+$,\w'.]+@[A-Za-z0-9.-:]
+ |\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}
+)
+[-\w~!$+|.,=/\?'#%*:&@;]*
 """
-
@@ -0,0 +1,331 @@
+r"""Command line fingerprints and a template index.
+
+A command line is reduced to its template tokens, the kind and stem of each token
+(see cyberspacy.core), with nested commands spliced in. From those:
+
+- fingerprint: a stable 64-bit hash. Command lines that normalize alike have the
+  same fingerprint, in every process and across runs.
+- minhash: a signature whose agreement with another estimates the Jaccard
+  similarity of the two token sets (unigrams and bigrams).
+- simhash: a 64-bit hash where similar command lines differ in few bits.
+
+TemplateIndex groups command lines into templates as they stream past. A command
+line joins the template of a command line with the same fingerprint, or whose
+example has the same skeleton (the same tokens once plain values are wildcarded),
+or failing that the most similar template found through locality sensitive hashing
+(LSH) of the MinHash signatures, if it is at least `threshold` similar. Otherwise it starts a new
+template. Lookups hash a handful of bands instead of comparing against every
+template, so they don't slow down as templates are added. Template positions whose
+tokens differ between members become wildcards.
+
+    USAGE:
+    >>> from cyberspacy.fingerprint import TemplateIndex
+    >>> index = TemplateIndex()
+    >>> a = index.add(r'C:\Windows\System32\svchost.exe -k netsvcs -p')
+    >>> b = index.add(r'C:\Windows\System32\svchost.exe -k LocalService -p')
+    >>> a is b, a.count, a.text
+    (True, 2, '?sys64\\svchost.exe -k <*> -p')
+    >>> template, similarity = index.match(r'c:\windows\system32\svchost.exe -k DcomLaunch -p')
+    >>> template is a
+    True
+"""
+from functools import lru_cache
+from hashlib import blake2b
+
+import numpy
+
+from .cache import LRUCache
+from .core import CMD, VAL
+
+WILDCARD = '<*>'
+# Template tokens of values that aren't also paths, args or nested commands
+_VALUE_PREFIX = f'{VAL}:'
+
+# Multiply-add hashing mod 2**64 stands in for the random permutations of MinHash
+_MAX_HASH = numpy.uint64(2 ** 64 - 1)
+
+# Most templates kept per LSH bucket, which bounds the work of a lookup
+MAX_BUCKET_SIZE = 32
+
+
+def template_tokens(parsed):
+    """Return the template tokens of a ParsedCommandLine, 'kind:stem' strings with
+    nested commands spliced in between quote tokens, as normalize does. Tokens over
+    the parse's max_token_length (e.g. encoded scripts) count as plain values."""
+    max_token_length = parsed.max_token_length
+    tokens = []
+    for i, kind in enumerate(parsed.kinds):
+        if max_token_length is not None and len(parsed.tokens[i]) > max_token_length:
+            tokens.append(f'{VAL}:{parsed.tokens[i]}')
+            continue
+        if kind & CMD:
+            try:
+                sub_cmd = parsed.sub_cmd(i)
+            except ValueError:
+                # A nested command that can't be split is kept whole
+                sub_cmd = None
+            if sub_cmd is not None:
+                tokens.append(f'{CMD}:"')
+                tokens.extend(template_tokens(sub_cmd))
+                tokens.append(f'{CMD}:"')
+                continue
+        stem = parsed.stems[i]
+        tokens.append(f'{kind}:{parsed.tokens[i] if stem is None else stem}'.lower())
+    return tokens
+
+
+# Template tokens repeat a lot across command lines
+@lru_cache(maxsize=65536)
+def _hash(text):
+    return int.from_bytes(blake2b(text.encode('utf8', 'surrogatepass'), digest_size=8).digest(),
+                          'little')
+
+
+def fingerprint(tokens):
+    """Stable 64-bit hash of a sequence of template tokens"""
+    return _hash('\x00'.join(tokens))
+
+
+def skeleton(tokens):
+    """The template tokens with plain values (e.g. service names or numbers) replaced
+    by WILDCARD"""
+    return [WILDCARD if token.startswith(_VALUE_PREFIX) else token for token in tokens]
+
+
+def shingle_hashes(tokens):
+    """64-bit hashes of the tokens, of each pair of adjacent tokens and of each pair
+    of adjacent skeleton tokens, so command lines that only differ in their values
+    share most shingles"""
+    wildcarded = skeleton(tokens)
+    hashes = {_hash(token) for token in tokens}
+    hashes.update(_hash(f'{a}\x00{b}') for a, b in zip(tokens, tokens[1:]))
+    hashes.update(_hash(f'{a}\x01{b}') for a, b in zip(wildcarded, wildcarded[1:]))
+    return numpy.fromiter(hashes, dtype=numpy.uint64, count=len(hashes))
+
+
+def _permutations(num_perm, seed):
+    rng = numpy.random.RandomState(seed)
+    # Odd multipliers, so each hash is a permutation of the 64-bit integers
+    a = rng.randint(0, 2 ** 63, size=num_perm, dtype=numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+    b = rng.randint(0, 2 ** 63, size=num_perm, dtype=numpy.uint64)
+    return a, b
+
+
+def minhash(tokens, num_perm=64, seed=1):
+    """MinHash signature of the shingles of a sequence of template tokens.
+
+    num_perm (int): Length of the signature.
+    seed (int): Signatures are only comparable if they share the seed.
+    RETURNS (numpy.ndarray): num_perm uint64 values.
+    """
+    return _minhash(shingle_hashes(tokens), _permutations(num_perm, seed))
+
+
+def _minhash(hashes, permutations):
+    a, b = permutations
+    if not len(hashes):
+        return numpy.full(len(a), _MAX_HASH, dtype=numpy.uint64)
+    return (hashes[:, None] * a + b).min(axis=0)
+
+
+def simhash(tokens):
+    """64-bit SimHash of the shingles of a sequence of template tokens"""
+    return _simhash(shingle_hashes(tokens))
+
+
+def _simhash(hashes):
+    if not len(hashes):
+        return 0
+    bits = (hashes[:, None] >> numpy.arange(64, dtype=numpy.uint64)) & numpy.uint64(1)
+    majority = bits.sum(axis=0) * 2 > len(hashes)
+    return int(numpy.packbits(majority[::-1]).view('>u8')[0])
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the token sets behind two MinHash signatures"""
+    return float(numpy.count_nonzero(signature == other)) / len(signature)
+
+
+def hamming(simhash, other):
+    """Number of bits two SimHashes differ in"""
+    return bin(simhash ^ other).count('1')
+
+
+class Template(object):
+    """A group of similar command lines.
+
+    The signature and simhash are those of the first member, which is kept as the
+    example. tokens holds the template tokens, with WILDCARD at the positions where
+    members of the same length differ.
+    """
+
+    __slots__ = ('id', 'fingerprint', 'signature', 'simhash', 'tokens', 'example', 'count')
+
+    def __init__(self, id, fingerprint, signature, simhash, tokens, example):
+        self.id = id
+        self.fingerprint = fingerprint
+        self.signature = signature
+        self.simhash = simhash
+        self.tokens = tokens
+        self.example = example
+        self.count = 0
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.id}, {self.text!r}, count={self.count})'
+
+    @property
+    def text(self):
+        """The template as a normalized command line"""
+        stems = [token if token == WILDCARD else token.split(':', 1)[1] for token in self.tokens]
+        return ' '.join(stems)
+
+    def update(self, tokens):
+        if len(tokens) == len(self.tokens):
+            self.tokens = [t if t == token else WILDCARD for t, token in zip(self.tokens, tokens)]
+
+    def to_dict(self):
+        return {'id': self.id, 'fingerprint': f'{self.fingerprint:016x}',
+                'simhash': f'{self.simhash:016x}', 'text': self.text,
+                'example': self.example, 'count': self.count}
+
+
+class TemplateIndex(object):
+
+    def __init__(self, threshold=0.6, num_perm=64, bands=16, seed=1, processor=None,
+                 fingerprint_cache_size=100000):
+        """Build an empty index.
+
+        threshold (float): Least estimated Jaccard similarity of a command line to
+            the example of the template it joins.
+        num_perm (int): Length of the MinHash signatures.
+        bands (int): Number of LSH bands the signatures are split into. More bands
+            find more candidates at lower similarities, at the cost of more lookups.
+        seed (int): Seed of the MinHash permutations.
+        processor (WindowsCommandlineProcessor): Parses the command lines, with its
+            architecture and rules. Defaults to one without a result cache.
+        fingerprint_cache_size (int): Number of fingerprints whose template is
+            remembered, so repeated command lines skip the similarity search.
+        """
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        if processor is None:
+            from .processor import WindowsCommandlineProcessor
+
+            processor = WindowsCommandlineProcessor(cache_size=0)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.processor = processor
+        self.templates = []
+        self._permutations = _permutations(num_perm, seed)
+        self._buckets = [{} for _ in range(bands)]
+        # Fingerprint of each template's example with its plain values wildcarded
+        self._skeletons = {}
+        self._fingerprints = LRUCache(fingerprint_cache_size) if fingerprint_cache_size else None
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def __getitem__(self, template_id):
+        return self.templates[template_id]
+
+    def add(self, cmd_line):
+        """Add a command line, or a ParsedCommandLine, and return its Template"""
+        parsed = self._parse(cmd_line)
+        tokens = template_tokens(parsed)
+        key = fingerprint(tokens)
+
+        template = self._fingerprints.get(key) if self._fingerprints is not None else None
+        if template is None:
+            skeleton_key = fingerprint(skeleton(tokens))
+            template = self._skeletons.get(skeleton_key)
+        if template is None:
+            hashes = shingle_hashes(tokens)
+            signature = _minhash(hashes, self._permutations)
+            template, _ = self._search(signature)
+            if template is None:
+                template = Template(len(self.templates), key, signature, _simhash(hashes),
+                                    tokens, parsed.text)
+                self.templates.append(template)
+                self._skeletons[skeleton_key] = template
+                self._insert(template)
+        if self._fingerprints is not None:
+            self._fingerprints.put(key, template)
+
+        template.update(tokens)
+        template.count += 1
+        return template
+
+    def add_many(self, cmd_lines):
+        """Lazily add each command line in an iterable, yielding its Template"""
+        for cmd_line in cmd_lines:
+            yield self.add(cmd_line)
+
+    def match(self, cmd_line):
+        """Return (Template, estimated similarity) of the known template a command
+        line belongs to, or None, without adding it"""
+        tokens = template_tokens(self._parse(cmd_line))
+        signature = self.signature(tokens)
+        template = None
+        if self._fingerprints is not None:
+            template = self._fingerprints.get(fingerprint(tokens))
+        if template is None:
+            template = self._skeletons.get(fingerprint(skeleton(tokens)))
+        if template is not None:
+            return template, similarity(template.signature, signature)
+
+        template, score = self._search(signature)
+        if template is None:
+            return None
+        return template, score
+
+    def signature(self, tokens):
+        """MinHash signature of template tokens with the index's permutations"""
+        return _minhash(shingle_hashes(tokens), self._permutations)
+
+    def most_common(self, n=None):
+        """Templates with the most members first"""
+        return sorted(self.templates, key=lambda template: -template.count)[:n]
+
+    def _parse(self, cmd_line):
+        if isinstance(cmd_line, str):
+            return self.processor.parse(cmd_line)
+        return cmd_line
+
+    def _band_keys(self, signature):
+        data = signature.tobytes()
+        step = self.rows * signature.itemsize
+        return [data[i:i + step] for i in range(0, len(data), step)]
+
+    def _insert(self, template):
+        for bucket, key in zip(self._buckets, self._band_keys(template.signature)):
+            templates = bucket.get(key)
+            if templates is None:
+                bucket[key] = [template]
+            elif len(templates) < MAX_BUCKET_SIZE:
+                # A full bucket holds templates that are alike in one band only; the
+                # template can still be found through its other bands
+                templates.append(template)
+
+    def _search(self, signature):
+        """Return the most similar template sharing a band with signature and its
+        similarity, or (None, 0.0) if none reaches the threshold"""
+        candidates = {}
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            for template in bucket.get(key, ()):
+                candidates[template.id] = template
+        if not candidates:
+            return None, 0.0
+
+        candidates = list(candidates.values())
+        signatures = numpy.stack([template.signature for template in candidates])
+        scores = numpy.count_nonzero(signatures == signature, axis=1)
+        best = int(scores.argmax())
+        score = float(scores[best]) / len(signature)
+        if score < self.threshold:
+            return None, 0.0
+        return candidates[best], score
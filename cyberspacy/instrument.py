@@ -0,0 +1,286 @@
+r"""Opt-in timing of the hot paths.
+
+While instrumentation is enabled, every call of the stages below is timed. Each
+stage keeps a call counter, a latency histogram and the top-N slowest inputs it
+was called with.
+
+- cmdline_split: tokenizing a command line
+- tag_tokens: classifying and stemming the tokens of a command line
+- parse_cmdline: the whole parse behind WindowsCommandlineProcessor (cache misses only)
+- cmdline_tagger: CommandLineTagger.__call__
+- sub_cmd: looking up a nested command, which parses it the first time
+- normalize_path: NormalizeWinPath.normalize_path, including its cache
+- ip_tagger, ipv6_tagger, url_tagger, email_tagger, ioc_tagger: the taggers' __call__
+- ipv4_flag, ipv6_flag, url_flag, email_flag, ioc_flag: the lexeme flag checks of
+  the IOC taggers
+
+Lexeme flags and extension getters are bound when a tagger is built, so the
+*_flag stages and CommandLineTagger's sub_cmd are only timed for taggers built
+while instrumentation is enabled.
+
+Timings are inclusive: a nested command's parse is counted in sub_cmd and again in
+the stages it runs. Stages are timed by swapping in wrapping functions when
+instrumentation is enabled and restoring the originals when it is disabled, so it
+costs nothing while it's off. Only stages whose module has already been imported
+are wrapped, so enabling it never imports spaCy. Each process has its own stats,
+so the worker processes used with n_process > 1 aren't included.
+
+    USAGE:
+    >>> from cyberspacy import instrument
+    >>> from cyberspacy.processor import WindowsCommandlineProcessor
+    >>> processor = WindowsCommandlineProcessor()
+    >>> with instrument.enabled(top_n=5):
+    ...     processor.normalize(r'C:\Windows\System32\svchost.exe -k netsvcs')
+    '?sys64\\svchost.exe -k netsvcs'
+    >>> stats = instrument.snapshot()
+    >>> stats['stages']['parse_cmdline']['count']
+    1
+    >>> stats['stages']['parse_cmdline']['slowest'][0]['input']
+    'C:\\Windows\\System32\\svchost.exe -k netsvcs'
+"""
+import heapq
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+
+# Stage name -> (module, class or None for a module level function, attribute)
+STAGES = {
+    'cmdline_split': [('cyberspacy.core', None, 'cmdline_split'),
+                      ('cyberspacy.tokenizer', None, 'cmdline_split')],
+    'tag_tokens': [('cyberspacy.core', None, 'tag_tokens'),
+                   ('cyberspacy.tagger', None, 'tag_tokens')],
+    'parse_cmdline': [('cyberspacy.processor', None, 'parse_cmdline')],
+    'cmdline_tagger': [('cyberspacy.tagger', 'CommandLineTagger', '__call__')],
+    'sub_cmd': [('cyberspacy.tagger', 'CommandLineTagger', 'get_sub_cmd'),
+                ('cyberspacy.core', 'ParsedCommandLine', 'sub_cmd')],
+    'normalize_path': [('cyberspacy.stemmer', 'NormalizeWinPath', 'normalize_path')],
+    'ip_tagger': [('cyberspacy.tagger', 'IPTagger', '__call__')],
+    'ipv6_tagger': [('cyberspacy.tagger', 'IPv6Tagger', '__call__')],
+    'url_tagger': [('cyberspacy.tagger', 'URLTagger', '__call__')],
+    'email_tagger': [('cyberspacy.tagger', 'EmailTagger', '__call__')],
+    'ioc_tagger': [('cyberspacy.tagger', 'IOCTagger', '__call__')],
+    'ipv4_flag': [('cyberspacy.tagger', 'IPTagger', 'is_ipv4_text')],
+    'ipv6_flag': [('cyberspacy.tagger', 'IPv6Tagger', 'is_ipv6_text')],
+    'url_flag': [('cyberspacy.tagger', 'URLTagger', 'is_url_text')],
+    'email_flag': [('cyberspacy.tagger', 'EmailTagger', 'is_email_addr_text')],
+    'ioc_flag': [('cyberspacy.tagger', 'IOCTagger', 'is_ioc_text')],
+}
+
+# Upper bounds, in microseconds, of the histogram buckets: 1us, 2us, 4us ... ~67s
+BUCKETS = tuple(2 ** i for i in range(27))
+
+# Stats being recorded into, or None while disabled. Wrappers that outlive a
+# session (bound flag checks, names imported while enabled) check it on every call.
+_stats = None
+_last_stats = None
+_patched = []
+
+
+class StageStats(object):
+
+    def __init__(self, top_n=10, max_input_length=1024):
+        self.top_n = top_n
+        self.max_input_length = max_input_length
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        # Min-heap of (seconds, sequence number, input) so the fastest is evicted first
+        self.slowest = []
+        self._sequence = count()
+
+    def record(self, seconds, item):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), len(BUCKETS))] += 1
+
+        if self.top_n and (len(self.slowest) < self.top_n or seconds > self.slowest[0][0]):
+            entry = (seconds, next(self._sequence), _describe(item))
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heapreplace(self.slowest, entry)
+
+    def percentile(self, q):
+        """Upper bound, in seconds, of the histogram bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        if bucket >= len(BUCKETS):
+            return self.max
+        return min(BUCKETS[bucket] / 1e6, self.max)
+
+    def to_dict(self):
+        slowest = []
+        for seconds, sequence, (text, length) in sorted(self.slowest, reverse=True):
+            if text is not None and length > self.max_input_length:
+                text = text[:self.max_input_length]
+            slowest.append({'seconds': seconds, 'input': text, 'length': length})
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+            'p50_us': self.percentile(0.50) * 1e6,
+            'p99_us': self.percentile(0.99) * 1e6,
+            'max_us': self.max * 1e6,
+            'histogram': {f'<={bound}us': n for bound, n in zip(BUCKETS, self.histogram) if n},
+            'histogram_overflow': self.histogram[-1],
+            'slowest': slowest,
+        }
+
+
+class Stats(object):
+
+    def __init__(self, top_n=10, max_input_length=1024):
+        self.top_n = top_n
+        self.max_input_length = max_input_length
+        self.started = time.time()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, item):
+        with self._lock:
+            stage_stats = self.stages.get(stage)
+            if stage_stats is None:
+                stage_stats = self.stages[stage] = StageStats(self.top_n, self.max_input_length)
+            stage_stats.record(seconds, item)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'elapsed_seconds': time.time() - self.started,
+                'stages': {name: stage.to_dict() for name, stage in self.stages.items()},
+            }
+
+
+def _describe(item):
+    """Return (text, length) for the input of a stage"""
+    text = getattr(item, 'text', item)
+    if not isinstance(text, str):
+        return None, 0
+    return text, len(text)
+
+
+def _wrap(stage, func, is_method):
+    if is_method:
+        @wraps(func)
+        def timed(self, item, *args, **kwargs):
+            stats = _stats
+            if stats is None:
+                return func(self, item, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, item, *args, **kwargs)
+            finally:
+                stats.record(stage, time.perf_counter() - start, item)
+    else:
+        @wraps(func)
+        def timed(item, *args, **kwargs):
+            stats = _stats
+            if stats is None:
+                return func(item, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(item, *args, **kwargs)
+            finally:
+                stats.record(stage, time.perf_counter() - start, item)
+    timed.__wrapped_stage__ = stage
+    return timed
+
+
+def enable(top_n=10, max_input_length=1024):
+    """Start timing the stages, discarding any previous stats.
+
+    top_n (int): Number of slowest inputs kept per stage.
+    max_input_length (int): Inputs longer than this are truncated in snapshots.
+    """
+    global _stats, _last_stats
+    _stats = _last_stats = Stats(top_n, max_input_length)
+    if _patched:
+        return
+
+    for stage, targets in STAGES.items():
+        for module_name, class_name, attr in targets:
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            owner = getattr(module, class_name) if class_name else module
+            # A function imported from another module may already be wrapped
+            original = owner.__dict__[attr]
+            if hasattr(original, '__wrapped_stage__'):
+                continue
+            setattr(owner, attr, _wrap(stage, original, class_name is not None))
+            _patched.append((owner, attr, original))
+
+
+def disable():
+    """Stop timing and restore the original functions. The stats are kept, so they
+    can still be read with snapshot until the next enable."""
+    global _stats
+    _stats = None
+    while _patched:
+        owner, attr, original = _patched.pop()
+        setattr(owner, attr, original)
+
+
+def is_enabled():
+    return _stats is not None
+
+
+@contextmanager
+def enabled(top_n=10, max_input_length=1024):
+    """Enable instrumentation for the duration of a with block"""
+    enable(top_n, max_input_length)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def reset():
+    """Discard the stats collected so far without changing whether timing is on"""
+    global _stats, _last_stats
+    if _stats is not None:
+        _stats = _last_stats = Stats(_stats.top_n, _stats.max_input_length)
+
+
+def snapshot():
+    """Return the stats collected so far as a JSON-serializable dict, or None if
+    instrumentation has never been enabled"""
+    if _last_stats is None:
+        return None
+    return _last_stats.to_dict()
+
+
+def export(path):
+    """Write snapshot() to a JSON file"""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def format_snapshot(stats=None):
+    """Return a plain text table of a snapshot, slowest stages (by total time) first"""
+    if stats is None:
+        stats = snapshot()
+    if not stats:
+        return ''
+    lines = [f"{'stage':<16}{'count':>10}{'total s':>10}{'mean us':>10}"
+             f"{'p50 us':>10}{'p99 us':>10}{'max us':>12}"]
+    stages = sorted(stats['stages'].items(), key=lambda item: -item[1]['total_seconds'])
+    for name, stage in stages:
+        lines.append(f"{name:<16}{stage['count']:>10}{stage['total_seconds']:>10.3f}"
+                     f"{stage['mean_us']:>10.1f}{stage['p50_us']:>10.0f}"
+                     f"{stage['p99_us']:>10.0f}{stage['max_us']:>12.0f}")
+    return '\n'.join(lines)
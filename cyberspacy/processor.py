@@ -1,59 +1,338 @@
-from spacy.lang.xx import Language
+from collections import deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 
-from .tokenizer import CommandLineTokenizer
-from .tagger import CommandLineTagger
+from .cache import LRUCache
+from .core import MAX_TOKEN_LENGTH, parse_cmdline
+
+# Each worker process builds its own pipeline once and keeps it for the life of the pool
+_worker_processor = None
+
+def _init_worker(architecture, cache_size, cache_policy, max_token_length, rules):
+    global _worker_processor
+    _worker_processor = WindowsCommandlineProcessor(architecture=architecture,
+                                                    cache_size=cache_size,
+                                                    cache_policy=cache_policy,
+                                                    max_token_length=max_token_length,
+                                                    rules=rules)
+
+def _normalize_chunk(return_exceptions, cmd_lines):
+    return list(_worker_processor.normalize_many(cmd_lines, batch_size=len(cmd_lines),
+                                                 return_exceptions=return_exceptions))
+
+def _analyze_chunk(return_exceptions, include_nested_commands, cmd_lines):
+    return list(_worker_processor.analyze_many(cmd_lines,
+                                               include_nested_commands=include_nested_commands,
+                                               batch_size=len(cmd_lines),
+                                               return_exceptions=return_exceptions))
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 class WindowsCommandlineProcessor(object):
     
-    def __init__(self):
-        self.nlp = Language()
-        self.nlp.tokenizer = CommandLineTokenizer(self.nlp.vocab)
+    def __init__(self, n_process=1, cache_size=1024, cache_policy='lru', architecture='x86_64',
+                 async_batch_size=256, async_max_delay=0.002, async_max_pending=10000,
+                 max_token_length=MAX_TOKEN_LENGTH, rules=None):
+        """Build the command line pipeline.
+
+        The normalize, analyze and get_* methods parse with cyberspacy.core and
+        never build a Doc. `self.nlp` is the equivalent spaCy pipeline for
+        callers that want Doc objects; it is built, and spaCy imported, the
+        first time it is used.
+
+        n_process (int): Number of worker processes used by the batch methods.
+        cache_size (int): Maximum number of parsed command lines to memoize. Set to
+            0 or None to disable the cache.
+        cache_policy (unicode): Eviction policy of the cache, 'lru' or 'fifo'.
+        architecture (unicode): Architecture of the host, 'x86' or 'x86_64'.
+        async_batch_size (int): Most command lines per batch of the async methods.
+        async_max_delay (float): Seconds an async request waits for others to batch with.
+        async_max_pending (int): Most async requests in flight before callers are made
+            to wait.
+        max_token_length (int): Longer tokens are left unclassified and passed through
+            normalization unchanged. None disables the limit.
+        rules (RuleSet): Path normalization rules used besides the built-in ones, or
+            a list of rule dicts or a rule file path, see cyberspacy.rules.
+        """
+        if n_process < 1:
+            raise ValueError('n_process must be at least 1')
+        self.n_process = n_process
+        self.architecture = architecture
+        self.cache_size = cache_size
+        self.cache_policy = cache_policy
+        self.cache = LRUCache(cache_size, cache_policy) if cache_size else None
+        self.async_batch_size = async_batch_size
+        self.async_max_delay = async_max_delay
+        self.async_max_pending = async_max_pending
+        self.max_token_length = max_token_length
+        # None uses the normalizer shared by every processor of the architecture
+        self.normalizer = None
+        if rules is not None:
+            from .stemmer import NormalizeWinPath
+
+            self.normalizer = NormalizeWinPath(architecture, rules=rules)
+        self._nlp = None
+        self._tagger = None
+        self._batchers = {}
+        self._executor = None
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Backstop for processors that are never closed
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.terminate()
 
-        self.tagger = CommandLineTagger(self.nlp, architecture='x86_64')
-        self.nlp.add_pipe(self.tagger, first=True)
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            from spacy.lang.xx import Language
+
+            from .tokenizer import CommandLineTokenizer
+            from .tagger import CommandLineTagger
+
+            nlp = Language()
+            nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+            self._tagger = CommandLineTagger(nlp, architecture=self.architecture,
+                                             max_token_length=self.max_token_length,
+                                             rules=self._rules())
+            nlp.add_pipe(self._tagger, first=True)
+            self._nlp = nlp
+        return self._nlp
+
+    @property
+    def tagger(self):
+        if self._tagger is None:
+            self.nlp  # building the pipeline creates the tagger
+        return self._tagger
     
     def normalize(self, cmd_line):
         """Fully normalize the command line by stemming all tokens"""
-        return self.nlp(cmd_line)._.normalize
+        return self._lookup(cmd_line)[1]
+
+    def normalize_many(self, cmd_lines, batch_size=1000, return_exceptions=False):
+        """Lazily yield the normalized form of each command line in an iterable.
+
+        return_exceptions (bool): Yield the exception raised by a command line that
+            can't be parsed in its place, instead of raising it and stopping.
+        """
+        if self.n_process > 1:
+            yield from self._map_parallel(_normalize_chunk, cmd_lines, batch_size,
+                                          return_exceptions)
+            return
+
+        for cmd_line in cmd_lines:
+            try:
+                normalized = self._lookup(cmd_line)[1]
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                normalized = e
+            yield normalized
+
+    def analyze(self, cmd_line, include_nested_commands=True):
+        """Return the tokens, args, paths, normalized paths and normalized command line
+        from a single parse"""
+        return self._to_analysis(self._lookup(cmd_line), include_nested_commands)
+
+    def analyze_many(self, cmd_lines, include_nested_commands=True, batch_size=1000,
+                     return_exceptions=False):
+        """Lazily yield the analysis of each command line in an iterable. With
+        return_exceptions, a command line that can't be parsed yields its exception
+        instead, as in normalize_many."""
+        if self.n_process > 1:
+            yield from self._map_parallel(_analyze_chunk, cmd_lines, batch_size,
+                                          return_exceptions, include_nested_commands)
+            return
+
+        for cmd_line in cmd_lines:
+            try:
+                analysis = self._to_analysis(self._lookup(cmd_line), include_nested_commands)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                analysis = e
+            yield analysis
+
+    def parse(self, cmd_line):
+        """Return the ParsedCommandLine (see cyberspacy.core) of a command line,
+        parsed with the processor's architecture, token length limit and rules.
+        The result isn't cached."""
+        return parse_cmdline(cmd_line, self.architecture, self.max_token_length,
+                             self.normalizer)
 
     def get_args(self, cmd_line, include_nested_commands=True):
         """Return arguments in the command line"""     
-        cl_args = []
-        
-        for t in self.nlp(cmd_line):
-            if t._.is_arg:
-                cl_args.append(t.text)
-            elif include_nested_commands and t._.is_cmd:
-                sub_cmd = self.nlp(self.tagger._remove_quotes(t.text))
-                sub_args = [st.text for st in sub_cmd if st._.is_arg]
-                cl_args.extend(sub_args)
-        
-        return cl_args
+        return list(self._lookup(cmd_line)[2 if include_nested_commands else 3][0])
     
     def get_paths(self, cmd_line, include_nested_commands=True):
         """Return a list of all paths"""
-        paths = []
-        
-        for t in self.nlp(cmd_line):
-            if t._.is_path:
-                paths.append(t.text)
-            elif include_nested_commands and t._.is_cmd:
-                sub_cmd = self.nlp(self.tagger._remove_quotes(t.text))
-                sub_paths = [st.text for st in sub_cmd if st._.is_path]
-                paths.extend(sub_paths)
-        return paths
+        return list(self._lookup(cmd_line)[2 if include_nested_commands else 3][1])
     
     def get_normalized_paths(self, cmd_line, include_nested_commands=True):
         """Return a list of all paths after stemming"""
-        paths = []
-        
-        for t in self.nlp(cmd_line):
-            if t._.is_path:
-                paths.append(t._.stem)
-            elif include_nested_commands and t._.is_cmd:
-                sub_cmd = self.nlp(self.tagger._remove_quotes(t.text))
-                sub_paths = [st._.stem for st in sub_cmd if st._.is_path]
-                paths.extend(sub_paths)
-        
-        return paths
+        return list(self._lookup(cmd_line)[2 if include_nested_commands else 3][2])
+
+    async def anormalize(self, cmd_line):
+        """Coroutine version of normalize. Concurrent calls are parsed together in
+        a worker thread (or the worker processes if n_process > 1), so the event loop
+        is never blocked on parsing."""
+        return await self._batcher('normalize').submit(cmd_line)
+
+    async def anormalize_many(self, cmd_lines):
+        """Asynchronously yield the normalized form of each command line in an async
+        or regular iterable, with at most async_max_pending in flight"""
+        async for normalized in self._batcher('normalize').map(cmd_lines):
+            yield normalized
+
+    async def aanalyze(self, cmd_line, include_nested_commands=True):
+        """Coroutine version of analyze, batched like anormalize"""
+        return await self._batcher('analyze', include_nested_commands).submit(cmd_line)
+
+    async def aanalyze_many(self, cmd_lines, include_nested_commands=True):
+        """Asynchronously yield the analysis of each command line in an async or
+        regular iterable, with at most async_max_pending in flight"""
+        async for analysis in self._batcher('analyze', include_nested_commands).map(cmd_lines):
+            yield analysis
+
+    def close(self):
+        """Shut down the worker pool of the batch methods and the executor used by the
+        async methods. They are started again if the processor is used after."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self._batchers = {}
+
+    def cache_info(self):
+        """Return hit, miss and eviction counters of the result cache"""
+        if self.cache is None:
+            return None
+        return self.cache.info()
+
+    def _lookup(self, cmd_line):
+        if self.cache is None:
+            return self._summarize(self.parse(cmd_line))
+
+        entry = self.cache.get(cmd_line)
+        if entry is None:
+            entry = self._summarize(self.parse(cmd_line))
+            self.cache.put(cmd_line, entry)
+        return entry
+
+    def _rules(self):
+        """The user rules as a picklable list, or None"""
+        if self.normalizer is None:
+            return None
+        return self.normalizer.user_rules.to_dict()['rules']
+
+    def _batcher(self, method, *args):
+        key = (method,) + args
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            from .batching import MicroBatcher
+
+            if self._executor is None:
+                self._executor = self._async_executor()
+            if self.n_process > 1:
+                chunk_func = _normalize_chunk if method == 'normalize' else _analyze_chunk
+                func = partial(chunk_func, False, *args)
+            else:
+                many = self.normalize_many if method == 'normalize' else self.analyze_many
+                func = lambda cmd_lines: list(many(cmd_lines, *args))
+            batcher = MicroBatcher(func, max_batch_size=self.async_batch_size,
+                                   max_delay=self.async_max_delay,
+                                   max_pending=self.async_max_pending,
+                                   executor=self._executor, max_concurrency=self.n_process)
+            self._batchers[key] = batcher
+        return batcher
+
+    def _async_executor(self):
+        if self.n_process > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            initargs = (self.architecture, self.cache_size, self.cache_policy,
+                        self.max_token_length, self._rules())
+            return ProcessPoolExecutor(self.n_process, initializer=_init_worker,
+                                       initargs=initargs)
+
+        # Parsing holds the GIL, so more threads would not parse any faster
+        from concurrent.futures import ThreadPoolExecutor
+
+        return ThreadPoolExecutor(1, thread_name_prefix='cyberspacy-batch')
+
+    def _map_parallel(self, func, cmd_lines, batch_size, return_exceptions, *args):
+        """Run func over chunks of cmd_lines in a worker pool and yield results in input order.
+
+        Only a bounded number of chunks are in flight at once so arbitrarily long
+        iterables can be streamed through the pool. Workers return the exception of
+        each command line that fails in its place, so one bad line doesn't lose the
+        rest of its chunk; unless return_exceptions, it is raised here in order.
+        """
+        max_in_flight = self.n_process * 2
+        pool = self._worker_pool()
+        pending = deque()
+        for chunk in _chunks(cmd_lines, batch_size):
+            pending.append(pool.apply_async(func, (True,) + args + (chunk,)))
+            if len(pending) >= max_in_flight:
+                yield from self._results(pending.popleft().get(), return_exceptions)
+        while pending:
+            yield from self._results(pending.popleft().get(), return_exceptions)
+
+    def _worker_pool(self):
+        """The pool of the batch methods, started on first use and kept until close"""
+        if self._pool is None:
+            # Workers keep their own result caches so only misses are parsed in each process
+            initargs = (self.architecture, self.cache_size, self.cache_policy,
+                        self.max_token_length, self._rules())
+            self._pool = Pool(self.n_process, initializer=_init_worker, initargs=initargs)
+        return self._pool
+
+    @staticmethod
+    def _results(results, return_exceptions):
+        for result in results:
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            yield result
+
+    @staticmethod
+    def _summarize(parsed):
+        """Collect everything the public methods return from a ParsedCommandLine.
+
+        RETURNS (tuple): (tokens, normalized, nested, flat) where nested and flat are
+            (args, paths, normalized_paths) with and without nested commands.
+        """
+        return (
+            tuple(parsed.tokens),
+            parsed.normalize(),
+            tuple(tuple(values) for values in parsed.collect(include_nested_commands=True)),
+            tuple(tuple(values) for values in parsed.collect(include_nested_commands=False))
+        )
 
+    @staticmethod
+    def _to_analysis(entry, include_nested_commands):
+        tokens, normalized, nested, flat = entry
+        cl_args, paths, normalized_paths = nested if include_nested_commands else flat
+        return {
+            'tokens': list(tokens),
+            'args': list(cl_args),
+            'paths': list(paths),
+            'normalized_paths': list(normalized_paths),
+            'normalized': normalized
+        }
@@ -0,0 +1,229 @@
+r"""User-defined path normalization rules.
+
+A RuleSet is an ordered collection of rules, each a regex and the string its
+matches are replaced with. NormalizeWinPath compiles its built-in rules and a
+RuleSet into a single regex, so a path is scanned once however many rules there
+are, and rules added later only cost a recompile.
+
+At each position of a path the first rule that matches wins, and scanning goes on
+after the replaced text. Rules with a higher priority are tried first, rules of
+equal priority in the order they were added, after the built-in ones. The built-in
+rules have priority 0, except the catch-all ?win\ and ?c\ rules and {guid}, which
+have priority -10, so a user rule with the default priority of 0 is tried before
+them.
+
+Regexes are matched against the lowercased path and can refer to the normalizer's
+settings as ${name}, e.g. ${systemdrive} for c:\ with an optional \\?\ or \??\
+prefix. They must not use backreferences or named groups. Rules that start with
+a literal character are cheapest: at each position of a path, all rules starting
+with a character other than the one there are skipped at once. Replacements are regex
+replacement templates without group references, so a backslash is written \\.
+
+A rule file is JSON (or YAML, with PyYAML installed) holding a list of rules under
+"rules", each with a regex, a replacement and optionally a name and a priority.
+
+    USAGE:
+    >>> from cyberspacy.rules import RuleSet
+    >>> from cyberspacy.stemmer import NormalizeWinPath
+    >>> rules = RuleSet().add(r'${systemdrive}programdata\\', r'?progdata\\', name='programdata')
+    >>> normalizer = NormalizeWinPath(rules=rules)
+    >>> normalizer.normalize_path(r'C:\ProgramData\App\app.exe')
+    '?progdata\\app\\app.exe'
+    >>> normalizer.add_rule(r'app\.exe', 'app')
+    >>> normalizer.normalize_path(r'C:\ProgramData\App\app.exe')
+    '?progdata\\app\\app'
+"""
+import json
+import re
+from types import MappingProxyType
+
+RULE_FIELDS = ('name', 'regex', 'replacement', 'priority')
+PLACEHOLDER_RE = re.compile(r'\$\{(\w+)\}')
+# Rules are combined into one regex, where group numbers refer to other rules
+BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+# Optional rules for paths the built-in rules leave alone, see RuleSet.extended.
+# Where they can, they start with a literal character (lookbehinds come after it)
+# so NormalizeWinPath.compile_rules can group them.
+EXTENDED_RULES = (
+    {'name': 'shadow_copy', 'priority': 1,
+     'regex': r'\\(?:\\\?\\globalroot\\)?device\\harddiskvolumeshadowcopy\d+\\',
+     'replacement': r'?vss\\'},
+    {'name': 'volume', 'priority': 1,
+     'regex': r'\\device\\harddiskvolume\d+\\',
+     'replacement': r'?vol\\'},
+    {'name': 'unc', 'priority': 1,
+     'regex': r'\\(?<![^\s"\']\\)\\(?![?.]\\)[^\\]+\\[^\\]+\\',
+     'replacement': r'?unc\\'},
+    {'name': 'roaming_appdata', 'priority': 1,
+     'regex': r'${systemdrive}${usrPath}appdata\\roaming\\',
+     'replacement': r'?appdata\\'},
+    {'name': 'local_appdata', 'priority': 1,
+     'regex': r'${systemdrive}${usrPath}appdata\\local\\(?!temp\\)',
+     'replacement': r'?localappdata\\'},
+    {'name': 'programdata',
+     'regex': r'${systemdrive}programdata\\',
+     'replacement': r'?progdata\\'},
+    {'name': 'env_appdata', 'regex': r'%appdata%\\', 'replacement': r'?appdata\\'},
+    {'name': 'env_localappdata', 'regex': r'%localappdata%\\', 'replacement': r'?localappdata\\'},
+    {'name': 'env_temp', 'regex': r'%(?:temp|tmp)%\\', 'replacement': r'?usrtmp\\'},
+    {'name': 'env_userprofile', 'regex': r'%userprofile%\\', 'replacement': r'?usr\\'},
+    {'name': 'env_programdata', 'regex': r'%(?:programdata|allusersprofile)%\\',
+     'replacement': r'?progdata\\'},
+    {'name': 'env_windir', 'regex': r'%(?:systemroot|windir)%\\', 'replacement': r'?win\\'},
+    {'name': 'env_systemdrive', 'regex': r'%systemdrive%\\', 'replacement': r'?c\\'},
+    {'name': 'env_var', 'priority': -20,
+     'regex': r'%[a-z_][\w()]*%',
+     'replacement': '?env'},
+    {'name': 'sid', 'priority': -20,
+     'regex': r's(?<!\ws)-1-\d+(?:-\d+)+',
+     'replacement': '{sid}'},
+    {'name': 'hash', 'priority': -20,
+     'regex': r'\b(?:[0-9a-f]{64}|[0-9a-f]{40}|[0-9a-f]{32})\b',
+     'replacement': '{hash}'},
+    {'name': 'tmp_name', 'priority': -20,
+     'regex': r'(?<=\\)[^\\/"\s]+\.tmp\b',
+     'replacement': '{tmp}'},
+)
+
+
+def _import_yaml():
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError('Loading YAML rules needs PyYAML, install it with '
+                          'pip install cyberspacy[yaml]') from None
+    return yaml
+
+
+def expand(regex, settings):
+    """Replace the ${name} placeholders in regex with the settings they name"""
+    def replace(match):
+        name = match.group(1)
+        if name not in settings:
+            raise ValueError(f'Unknown setting ${{{name}}} in rule regex {regex!r}')
+        return settings[name]
+    return PLACEHOLDER_RE.sub(replace, regex)
+
+
+class RuleSet(object):
+
+    def __init__(self, rules=()):
+        """Build a rule set.
+
+        rules (iterable): Rules to add, as dicts with a regex, a replacement and
+            optionally a name and a priority.
+        """
+        self._rules = []
+        self._added = 0
+        self.extend(rules)
+
+    def add(self, regex, replacement, name=None, priority=0):
+        """Add a rule. The regex and replacement are checked here, so a bad rule
+        raises ValueError instead of breaking the compiled normalizer.
+
+        regex (unicode): Pattern matched against lowercased paths. May refer to
+            settings as ${name}.
+        replacement (unicode): Replacement template.
+        name (unicode): Unique name of the rule, used by remove. Defaults to
+            'rule' and the number of rules added before it.
+        priority (int): Rules with a higher priority are tried first.
+        RETURNS (RuleSet): self, so calls can be chained.
+        """
+        if not isinstance(regex, str) or not isinstance(replacement, str):
+            raise TypeError('A rule regex and replacement must be strings')
+        if name is None:
+            name = f'rule{self._added}'
+        if name in self:
+            raise ValueError(f'There already is a rule named {name!r}')
+
+        try:
+            # Settings are only known to the normalizer, any group stands in for them
+            compiled = re.compile(PLACEHOLDER_RE.sub('(?:)', regex))
+        except re.error as e:
+            raise ValueError(f'Invalid regex in rule {name!r}: {e}') from None
+        if compiled.groupindex:
+            raise ValueError(f'Rule {name!r} must not use named groups')
+        if compiled.groups and BACKREFERENCE_RE.search(regex):
+            raise ValueError(f'Rule {name!r} must not use backreferences')
+        try:
+            re.match('', '').expand(replacement)
+        except (re.error, IndexError) as e:
+            raise ValueError(f'Invalid replacement in rule {name!r}: {e}') from None
+
+        self._rules.append(MappingProxyType({'name': name, 'regex': regex,
+                                             'replacement': replacement,
+                                             'priority': int(priority)}))
+        self._added += 1
+        return self
+
+    def extend(self, rules):
+        """Add each rule of an iterable of dicts. RETURNS (RuleSet): self."""
+        for rule in rules:
+            unknown = set(rule) - set(RULE_FIELDS)
+            if unknown:
+                raise ValueError(f"Unknown rule fields {', '.join(sorted(unknown))}")
+            self.add(**rule)
+        return self
+
+    def remove(self, name):
+        """Remove the rule with the given name"""
+        for i, rule in enumerate(self._rules):
+            if rule['name'] == name:
+                del self._rules[i]
+                return
+        raise KeyError(name)
+
+    def copy(self):
+        return type(self)(self._rules)
+
+    def __contains__(self, name):
+        return any(rule['name'] == name for rule in self._rules)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __iter__(self):
+        """Iterate over the rules in the order they are tried"""
+        return iter(sorted(self._rules, key=lambda rule: -rule['priority']))
+
+    def key(self):
+        """A hashable value that is equal for rule sets that normalize alike"""
+        return tuple((rule['regex'], rule['replacement'], rule['priority']) for rule in self)
+
+    def to_dict(self):
+        return {'rules': [dict(rule) for rule in self._rules]}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a rule set from {'rules': [...]} or a list of rules"""
+        if isinstance(data, dict):
+            data = data.get('rules', ())
+        return cls(data)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    @classmethod
+    def from_yaml(cls, text):
+        return cls.from_dict(_import_yaml().safe_load(text))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a rule set from a .json, .yaml or .yml file"""
+        path = str(path)
+        with open(path, encoding='utf8') as f:
+            text = f.read()
+        if path.endswith(('.yaml', '.yml')):
+            return cls.from_yaml(text)
+        return cls.from_json(text)
+
+    @classmethod
+    def extended(cls):
+        """Rules for shadow copies, volumes, UNC shares, AppData and ProgramData,
+        environment variables, SIDs, hex hashes and temp file names"""
+        return cls(EXTENDED_RULES)
@@ -0,0 +1,196 @@
+r"""Compact serialization of CommandLineTagger annotations.
+
+spaCy serializes `Doc.user_data` with msgpack. That can't hold the nested Docs
+that `sub_cmd` caches there, and it writes every extension value under a key of
+its own. The functions in this module swap the CommandLineTagger entries for one
+packed record:
+
+- a kind byte per token, made of the PATH/ARG/CMD/VAL bits of cyberspacy.core
+- each token's stem as a StringStore ID, or 0 if it has none, plus the stem strings
+  themselves so the record can be loaded into another Vocab
+- nested commands flattened into a list, each pointing at its parent command and
+  the cmd token it was parsed from
+
+Loading restores the token attributes, the getter index and the nested commands,
+without running the tagger. The loading process still needs a CommandLineTagger,
+which registers the extensions and names the attributes.
+
+    USAGE:
+    >>> from spacy.lang.xx import Language
+    >>> from cyberspacy import CommandLineTagger, CommandLineTokenizer
+    >>> from cyberspacy import serialize
+    >>> nlp = Language()
+    >>> nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    >>> tagger = CommandLineTagger(nlp)
+    >>> nlp.add_pipe(tagger)
+    >>> doc = nlp(r'C:\Windows\System32\cmd.exe /c "C:\a.exe /q"')
+    >>> data = serialize.to_bytes(doc, tagger)
+    >>> restored = serialize.from_bytes(data, tagger)
+    >>> assert restored._.normalize == doc._.normalize
+"""
+from spacy.tokens import Doc
+
+from .core import PATH, ARG, CMD, VAL
+from .tagger import _record_index
+
+# Key of the packed record in Doc.user_data
+USER_DATA_KEY = 'cyberspacy'
+FORMAT_VERSION = 1
+
+
+def _kind_attrs(tagger):
+    return ((PATH, tagger._is_path), (ARG, tagger._is_arg), (VAL, tagger._is_val),
+            (CMD, tagger._is_cmd))
+
+
+def pack(doc, tagger):
+    """Return the tagger's annotations of doc and its nested commands as a
+    msgpack-serializable dict. Nested commands are parsed if they haven't been yet.
+    """
+    strings = doc.vocab.strings
+    kind_attrs = _kind_attrs(tagger)
+    stem_table = {}
+    records = []
+
+    # Breadth first, so every record's parent comes before it
+    pending = [(-1, -1, doc)]
+    for position, (parent, token_i, current) in enumerate(pending):
+        kinds = bytearray(len(current))
+        stems = []
+        for token in current:
+            underscore = token._
+            kind = 0
+            for bit, attr in kind_attrs:
+                if underscore.get(attr):
+                    kind |= bit
+            kinds[token.i] = kind
+
+            stem = underscore.get(tagger._stem)
+            if stem is None:
+                stems.append(0)
+            else:
+                stem_table[stem] = None
+                stems.append(strings.add(stem))
+
+            if kind & CMD:
+                sub_cmd = underscore.get(tagger._sub_cmd)
+                if sub_cmd is not None:
+                    pending.append((position, token.i, sub_cmd))
+
+        record = {'parent': parent, 'token': token_i, 'kinds': bytes(kinds), 'stems': stems}
+        if parent >= 0:
+            record['words'] = [token.text for token in current]
+            record['spaces'] = bytes(bool(token.whitespace_) for token in current)
+        records.append(record)
+
+    return {'version': FORMAT_VERSION, 'strings': list(stem_table), 'docs': records}
+
+
+def unpack(doc, packed, tagger):
+    """Restore the annotations returned by pack onto doc, a Doc with the same
+    tokens as the one that was packed. RETURNS (Doc): doc.
+    """
+    if packed['version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported cyberspacy serialization version {packed['version']}")
+
+    vocab = doc.vocab
+    for string in packed['strings']:
+        vocab.strings.add(string)
+
+    kind_attrs = _kind_attrs(tagger)
+    docs = []
+    for record in packed['docs']:
+        if record['parent'] < 0:
+            current = doc
+        else:
+            current = Doc(vocab, words=list(record['words']),
+                          spaces=[bool(space) for space in record['spaces']])
+            parent = docs[record['parent']]
+            parent.user_data[(tagger.name, tagger._sub_cmd, record['token'])] = current
+            tagger.set_depth(current, tagger.get_depth(parent) + 1)
+        docs.append(current)
+
+        indices = {attr: [] for bit, attr in kind_attrs}
+        for token, kind, stem_id in zip(current, record['kinds'], record['stems']):
+            if stem_id:
+                token._.set(tagger._stem, vocab.strings[stem_id])
+            for bit, attr in kind_attrs:
+                if kind & bit:
+                    token._.set(attr, True)
+                    indices[attr].append(token.i)
+        for attr, attr_indices in indices.items():
+            _record_index(current, attr, attr_indices)
+
+    return doc
+
+
+def _is_packed_key(key, tagger):
+    """Whether a user_data key holds a value pack replaces"""
+    if not isinstance(key, tuple) or len(key) < 3:
+        return False
+    if key[0] == '._.':
+        return key[1] in (tagger._stem, tagger._is_path, tagger._is_arg, tagger._is_val,
+                          tagger._is_cmd)
+    if key[:2] == ('cyberspacy', 'index'):
+        return key[2] in (tagger._is_path, tagger._is_arg, tagger._is_val, tagger._is_cmd)
+    return key[:2] == (tagger.name, tagger._sub_cmd)
+
+
+def packed_user_data(doc, tagger):
+    """Return a copy of doc.user_data with the tagger's entries replaced by a
+    packed record under USER_DATA_KEY.
+    """
+    user_data = {key: value for key, value in doc.user_data.items()
+                 if not _is_packed_key(key, tagger)}
+    user_data[USER_DATA_KEY] = pack(doc, tagger)
+    return user_data
+
+
+def restore(doc, tagger):
+    """Unpack the record packed_user_data added to doc.user_data, if any"""
+    packed = doc.user_data.pop(USER_DATA_KEY, None)
+    if packed is not None:
+        unpack(doc, packed, tagger)
+    return doc
+
+
+def to_bytes(doc, tagger, **kwargs):
+    """Doc.to_bytes with the tagger's annotations packed. kwargs are passed on."""
+    user_data = doc.user_data
+    doc.user_data = packed_user_data(doc, tagger)
+    try:
+        return doc.to_bytes(**kwargs)
+    finally:
+        doc.user_data = user_data
+
+
+def from_bytes(data, tagger, vocab=None):
+    """Load a Doc written by to_bytes. vocab defaults to the tagger's."""
+    if vocab is None:
+        vocab = tagger.nlp.vocab
+    doc = Doc(vocab).from_bytes(data)
+    return restore(doc, tagger)
+
+
+def add_to_docbin(docbin, doc, tagger):
+    """DocBin.add with the tagger's annotations packed into the stored user_data"""
+    if not docbin.store_user_data:
+        raise ValueError('The DocBin must be created with store_user_data=True')
+
+    user_data = doc.user_data
+    doc.user_data = packed_user_data(doc, tagger)
+    try:
+        docbin.add(doc)
+    finally:
+        doc.user_data = user_data
+
+
+def get_docs(docbin, tagger, vocab=None):
+    """DocBin.get_docs, restoring annotations added with add_to_docbin"""
+    # DocBin only restores user_data when the loading DocBin was also created with it
+    if not docbin.store_user_data:
+        raise ValueError('The DocBin must be created with store_user_data=True')
+    if vocab is None:
+        vocab = tagger.nlp.vocab
+    for doc in docbin.get_docs(vocab):
+        yield restore(doc, tagger)
@@ -0,0 +1,350 @@
+r"""Fixed memory frequency sketches and rarity scores of command lines.
+
+RaritySketch counts, for every event (a command line or its analysis from
+WindowsCommandlineProcessor), each of its features:
+
+- normalized: the normalized command line
+- normalized_paths: each normalized path
+- args: each argument
+- pairs: each argument with the program, the normalized first token of the command line
+
+Counts are kept in a count-min sketch and the number of distinct values of each
+feature in a HyperLogLog, so memory stays the same however many events are added.
+Counts are never underestimated, and with conservative updates rarely
+overestimated. Sketches with the same dimensions can be merged, e.g. ones built by
+separate worker processes. The merged distinct counts are those of one sketch built
+from every event, and the merged counts are still never underestimated.
+
+The rarity of a value is 1 - log(count + 1) / log(events + 1): 1.0 for a value
+never seen before and 0.0 for one seen in every event. An event scores the rarity
+of its normalized command line and the highest rarity among its paths, args and
+pairs, and overall the highest of those.
+
+    USAGE:
+    >>> from cyberspacy.sketches import RaritySketch
+    >>> sketch = RaritySketch(width=2 ** 12)
+    >>> for _ in range(99):
+    ...     _ = sketch.add(r'C:\Windows\System32\svchost.exe -k netsvcs -p')
+    >>> sketch.add(r'C:\Windows\System32\svchost.exe -k netsvcs -p')['score']
+    0.0
+    >>> sketch.score(r'C:\Windows\System32\svchost.exe -k netsvcs -x')['pairs']
+    1.0
+    >>> sketch.count('args', '-k'), sketch.distinct('args')
+    (100, 2)
+"""
+import json
+import math
+import struct
+
+import numpy
+
+from .fingerprint import _hash
+
+FEATURES = ('normalized', 'normalized_paths', 'args', 'pairs')
+FORMAT_VERSION = 1
+
+_LOW_BITS = numpy.uint64(0xffffffff)
+_32 = numpy.uint64(32)
+
+
+def _array(hashes):
+    return numpy.array(hashes, dtype=numpy.uint64)
+
+
+def _hashes(keys):
+    return _array([_hash(key) for key in keys])
+
+
+def _bit_length(values):
+    """bit_length of each uint64, exactly: frexp of floats below 2**32 is exact"""
+    high = (values >> _32).astype(numpy.float64)
+    low = (values & _LOW_BITS).astype(numpy.float64)
+    return numpy.where(high > 0, numpy.frexp(high)[1] + 32, numpy.frexp(low)[1])
+
+
+class CountMinSketch(object):
+    """Approximate counts of 64-bit hashes in a depth x width table of counters.
+
+    Each row maps a hash to one counter, through double hashing of its two 32-bit
+    halves. A count is the least of its counters, never less than the true count.
+    """
+
+    def __init__(self, width=2 ** 18, depth=4):
+        if width < 1 or depth < 1:
+            raise ValueError('width and depth must be at least 1')
+        self.width = width
+        self.depth = depth
+        self.table = numpy.zeros(width * depth, dtype=numpy.uint64)
+        self._rows = numpy.arange(depth, dtype=numpy.uint64)
+        self._offsets = self._rows * numpy.uint64(width)
+
+    def _cells(self, hashes):
+        h1 = hashes & _LOW_BITS
+        h2 = (hashes >> _32) | numpy.uint64(1)
+        return (h1[:, None] + self._rows * h2[:, None]) % numpy.uint64(self.width) + self._offsets
+
+    def add(self, hashes, counts=1):
+        """Add counts, one per hash or the same for all, to an array of distinct
+        hashes, with a conservative update: only the counters below the new count of
+        a hash are raised"""
+        cells = self._cells(hashes)
+        counts = self.table[cells].min(axis=1) + numpy.asarray(counts, dtype=numpy.uint64)
+        numpy.maximum.at(self.table, cells.ravel(), numpy.repeat(counts, self.depth))
+
+    def query(self, hashes):
+        """Array of the estimated counts of an array of hashes"""
+        return self.table[self._cells(hashes)].min(axis=1)
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Only sketches with the same width and depth can be merged')
+        self.table += other.table
+        return self
+
+
+class HyperLogLog(object):
+    """Approximate number of distinct 64-bit hashes, in 2 ** precision one-byte
+    registers. The standard error is about 1.04 / sqrt(2 ** precision)."""
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.registers = numpy.zeros(2 ** precision, dtype=numpy.uint8)
+
+    def add(self, hashes):
+        bits = 64 - self.precision
+        index = (hashes >> numpy.uint64(bits)).astype(numpy.intp)
+        rest = hashes & numpy.uint64((1 << bits) - 1)
+        # Position of the first 1 bit of the rest of the hash, counted from the left
+        rank = (bits + 1 - _bit_length(rest)).astype(numpy.uint8)
+        numpy.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / numpy.ldexp(1.0, -self.registers.astype(numpy.int64)).sum()
+        zeros = int(numpy.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError('Only HyperLogLogs with the same precision can be merged')
+        numpy.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+
+def rarity(count, events):
+    """1.0 for a value never seen before, 0.0 for one seen in every event"""
+    if count <= 0 or events <= 0:
+        return 1.0
+    return max(0.0, 1.0 - math.log1p(count) / math.log1p(events))
+
+
+def event_features(analysis):
+    """Return {feature: [values]} of an analysis dict, as returned by
+    WindowsCommandlineProcessor.analyze. Pairs are (program, arg) tuples. Each value
+    is listed once."""
+    tokens = analysis['tokens']
+    paths = analysis['paths']
+    normalized_paths = analysis['normalized_paths']
+    program = None
+    if tokens:
+        program = normalized_paths[0] if paths and paths[0] == tokens[0] else tokens[0]
+    args = list(dict.fromkeys(analysis['args']))
+    return {
+        'normalized': [analysis['normalized']],
+        'normalized_paths': list(dict.fromkeys(normalized_paths)),
+        'args': args,
+        'pairs': [(program, arg) for arg in args] if program is not None else [],
+    }
+
+
+def _key(feature_id, value):
+    if feature_id == 3:
+        return f'3\x00{value[0]}\x00{value[1]}'
+    return f'{feature_id}\x00{value}'
+
+
+class RaritySketch(object):
+
+    def __init__(self, width=2 ** 18, depth=4, precision=14, processor=None):
+        """Build an empty sketch. It takes width * depth * 8 bytes for the counts and
+        4 * 2 ** precision bytes for the distinct counts, 8.3MB by default.
+
+        width (int): Counters per row of the count-min sketch. Counts are
+            overestimated by at most about 2.7 / width of the values added.
+        depth (int): Rows of the count-min sketch. An overestimate is within that
+            bound except with probability about exp(-depth).
+        precision (int): The distinct counts of each feature use 2 ** precision
+            registers, for a standard error of about 1.04 / sqrt(2 ** precision).
+        processor (WindowsCommandlineProcessor): Analyzes the command lines that
+            are added as strings. Defaults to one with the default settings.
+        """
+        self.counts = CountMinSketch(width, depth)
+        self.distinct_counts = [HyperLogLog(precision) for _ in FEATURES]
+        self.events = 0
+        self._processor = processor
+
+    def __getstate__(self):
+        # Processors can hold worker pools, and aren't needed to merge sketches
+        state = self.__dict__.copy()
+        state['_processor'] = None
+        return state
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            from .processor import WindowsCommandlineProcessor
+
+            self._processor = WindowsCommandlineProcessor()
+        return self._processor
+
+    @property
+    def nbytes(self):
+        return self.counts.table.nbytes + sum(hll.registers.nbytes for hll in self.distinct_counts)
+
+    def add(self, event):
+        """Count the features of an event, a command line or its analysis dict, and
+        return its scores from before it was added"""
+        return self._add_batch([self._hashed(event)])[0]
+
+    def add_many(self, events, batch_size=1000, return_exceptions=False):
+        """Lazily add each event in an iterable, yielding its scores. The sketch is
+        updated a batch at a time, and events are scored as if added one by one.
+
+        return_exceptions (bool): Yield the exception raised by a command line that
+            can't be parsed in place of its scores, and go on with the next event,
+            as WindowsCommandlineProcessor.analyze_many does. It isn't counted.
+        """
+        batch = []
+        for event in events:
+            try:
+                batch.append(self._hashed(event))
+            except Exception as e:
+                if not return_exceptions:
+                    # The events before it are still added
+                    yield from self._add_mixed_batch(batch)
+                    raise
+                batch.append(e)
+            if len(batch) >= batch_size:
+                yield from self._add_mixed_batch(batch)
+                batch = []
+        if batch:
+            yield from self._add_mixed_batch(batch)
+
+    def score(self, event):
+        """Return the scores of an event without adding it: {feature: rarity} with
+        the highest rarity among the values of each feature (0.0 if it has none),
+        and the highest of those under 'score'"""
+        hashed = self._hashed(event)
+        hashes = [h for feature_hashes in hashed for h in feature_hashes]
+        counts = dict(zip(hashes, self.counts.query(_array(hashes)).tolist()))
+        return self._scores(hashed, counts, self.events)
+
+    def count(self, feature, value):
+        """Estimated number of events a feature value was seen in"""
+        hashes = _hashes([_key(FEATURES.index(feature), value)])
+        return int(self.counts.query(hashes)[0])
+
+    def distinct(self, feature):
+        """Estimated number of distinct values of a feature"""
+        return self.distinct_counts[FEATURES.index(feature)].count()
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same dimensions to this one"""
+        self.counts.merge(other.counts)
+        for hll, other_hll in zip(self.distinct_counts, other.distinct_counts):
+            hll.merge(other_hll)
+        self.events += other.events
+        return self
+
+    def to_bytes(self):
+        header = json.dumps({
+            'version': FORMAT_VERSION,
+            'width': self.counts.width,
+            'depth': self.counts.depth,
+            'precision': self.distinct_counts[0].precision,
+            'events': self.events,
+        }).encode('utf8')
+        registers = b''.join(hll.registers.tobytes() for hll in self.distinct_counts)
+        return struct.pack('<I', len(header)) + header + self.counts.table.tobytes() + registers
+
+    @classmethod
+    def from_bytes(cls, data, processor=None):
+        size, = struct.unpack_from('<I', data)
+        header = json.loads(data[4:4 + size].decode('utf8'))
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported sketch format version {header['version']}")
+        sketch = cls(header['width'], header['depth'], header['precision'], processor)
+        sketch.events = header['events']
+        offset = 4 + size
+        table = sketch.counts.table
+        table[:] = numpy.frombuffer(data, dtype=table.dtype, count=len(table), offset=offset)
+        offset += table.nbytes
+        for hll in sketch.distinct_counts:
+            registers = hll.registers
+            registers[:] = numpy.frombuffer(data, dtype=registers.dtype, count=len(registers),
+                                            offset=offset)
+            offset += registers.nbytes
+        return sketch
+
+    def _analyze(self, event):
+        if isinstance(event, dict):
+            return event
+        if isinstance(event, str):
+            return self.processor.analyze(event)
+        # A ParsedCommandLine
+        args, paths, normalized_paths = event.collect()
+        return {'tokens': event.tokens, 'args': args, 'paths': paths,
+                'normalized_paths': normalized_paths, 'normalized': event.normalize()}
+
+    def _hashed(self, event):
+        """[[hash of each value] of each feature] of an event"""
+        features = event_features(self._analyze(event))
+        return [[_hash(_key(feature_id, value)) for value in features[feature]]
+                for feature_id, feature in enumerate(FEATURES)]
+
+    def _add_mixed_batch(self, batch):
+        """Add the hashed events of a batch that may hold exceptions, and return
+        their scores with the exceptions in place"""
+        scores = iter(self._add_batch([hashed for hashed in batch
+                                       if not isinstance(hashed, Exception)]))
+        return [hashed if isinstance(hashed, Exception) else next(scores) for hashed in batch]
+
+    def _add_batch(self, batch):
+        """Add the hashed events of a batch, with one lookup and one update of the
+        sketches, and return their scores"""
+        unique = numpy.unique(_array([h for hashed in batch
+                                      for feature_hashes in hashed for h in feature_hashes]))
+        before = self.counts.query(unique)
+        # Counts as of each event: the sketch's, plus the earlier events of the batch
+        counts = dict(zip(unique.tolist(), before.tolist()))
+        all_scores = []
+        for hashed in batch:
+            all_scores.append(self._scores(hashed, counts, self.events))
+            for feature_hashes in hashed:
+                for h in feature_hashes:
+                    counts[h] += 1
+            self.events += 1
+
+        after = numpy.fromiter((counts[h] for h in unique.tolist()), dtype=numpy.uint64,
+                               count=len(unique))
+        self.counts.add(unique, after - before)
+        for feature_id, hll in enumerate(self.distinct_counts):
+            hll.add(_array([h for hashed in batch for h in hashed[feature_id]]))
+        return all_scores
+
+    @staticmethod
+    def _scores(hashed, counts, events):
+        scores = {}
+        for feature, feature_hashes in zip(FEATURES, hashed):
+            if feature_hashes:
+                scores[feature] = rarity(min(counts[h] for h in feature_hashes), events)
+            else:
+                scores[feature] = 0.0
+        scores['score'] = max(scores.values())
+        return scores
@@ -1,11 +1,24 @@
+import ipaddress
 import re
+from types import MappingProxyType
 from urllib.parse import urlparse
 
+from .cache import LRUCache
+from .rules import RuleSet, expand
+
 def stem_ip_addr(ip_addr, subnets_to_keep):
     """Return the first N subnets of the IP address"""    
     split = ip_addr.split('.')
     return '.'.join(split[:subnets_to_keep])
 
+def stem_ipv6_addr(ip_addr, hextets_to_keep):
+    """Return the first N hextets of the fully expanded IPv6 address"""
+    try:
+        exploded = ipaddress.IPv6Address(ip_addr).exploded
+    except ValueError:
+        return ip_addr
+    return ':'.join(exploded.split(':')[:hextets_to_keep])
+
 def get_domain(token):
     """Extract the domain from a URL by removing the path"""
     parsed = urlparse(token)
@@ -20,6 +33,76 @@ def get_domain(token):
         else:
             return parsed.path[:slash_idx]
  
+def _class_end(regex, i):
+    """Return the index after the character set starting at regex[i], where ] is
+    literal right after [ or [^"""
+    i += 1
+    if regex[i:i + 1] == '^':
+        i += 1
+    if regex[i:i + 1] == ']':
+        i += 1
+    while i < len(regex) and regex[i] != ']':
+        i += 2 if regex[i] == '\\' else 1
+    return i + 1
+
+def _has_top_level_alternation(regex):
+    depth = 0
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '[':
+            i = _class_end(regex, i)
+            continue
+        if char == '\\':
+            i += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and not depth:
+            return True
+        i += 1
+    return False
+
+def _uncapture(regex):
+    """Make the capturing groups of a regex non-capturing.
+
+    The regex engine saves the marks of every group up to the highest one set
+    when it backtracks, so in a regex combining many rules a capturing group near
+    the end would make every position cost more with each rule added.
+    """
+    parts = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '[':
+            end = _class_end(regex, i)
+        elif char == '\\':
+            end = i + 2
+        else:
+            end = i + 1
+            if char == '(' and regex[i + 1:i + 2] != '?':
+                char = '(?:'
+        parts.append(char if end == i + 1 else regex[i:end])
+        i = end
+    return ''.join(parts)
+
+def _split_leading_literal(regex):
+    """Return the regex for the literal character a regex starts with and the rest
+    of the regex, or None if it doesn't start with a single literal character"""
+    if regex[:1] == '\\':
+        if len(regex) < 2 or regex[1].isalnum():
+            return None
+        literal = regex[:2]
+    elif not regex or regex[0] in '.^$*+?{}[]|()':
+        return None
+    else:
+        literal = regex[0]
+    rest = regex[len(literal):]
+    if rest[:1] in ('*', '+', '?', '{') or _has_top_level_alternation(regex):
+        return None
+    return literal, rest
+ 
 class NormalizeWinPath(object):
  
     settings = {
@@ -43,80 +126,348 @@ class NormalizeWinPath(object):
         }
     }
     
-    rules = []
-    
-    def __init__(self, architecture='x86_64'):
-        self.settings['architecture']= architecture
-        self.generate_rules()
+    # Compiled rule sets shared by every normalizer built for the same class,
+    # architecture and user rules. Bounded, so a service that builds normalizers
+    # for many different rule sets doesn't keep all of them alive.
+    _compiled = LRUCache(32)
     
+    def __init__(self, architecture='x86_64', cache_size=4096, rules=None):
+        """Build a normalizer for paths on a host of the given architecture.
+
+        architecture (unicode): Architecture of the host, 'x86' or 'x86_64'.
+        cache_size (int): Maximum number of normalized paths to memoize. Set to 0 or
+            None to disable the cache.
+        rules (RuleSet): Rules used besides the built-in ones, see cyberspacy.rules.
+            Also accepts a list of rule dicts or the path of a JSON or YAML rule
+            file. The rules are copied; use add_rule to add more.
+        """
+        if rules is None:
+            rules = RuleSet()
+        elif isinstance(rules, RuleSet):
+            rules = rules.copy()
+        elif isinstance(rules, str) or hasattr(rules, '__fspath__'):
+            rules = RuleSet.from_file(rules)
+        else:
+            rules = RuleSet(rules)
+
+        self.architecture = architecture
+        self.user_rules = rules
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self._compile()
+
+    def _compile(self, share=True):
+        """Compile the rules, reusing a rule set compiled for another normalizer.
+        With share=False a newly compiled rule set isn't kept for other normalizers,
+        so rule sets built up one rule at a time don't evict the shared ones."""
+        key = (type(self), self.architecture, self.user_rules.key())
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            settings = self.generate_settings(self.architecture)
+            rules = self.merge_rules(settings, self.generate_rules(settings), self.user_rules)
+            sequential = tuple((re.compile(rule['regex']), rule['replacement']) for rule in rules)
+            compiled = (settings, rules) + self.compile_rules(settings, rules) + (sequential,)
+            if share:
+                self._compiled.put(key, compiled)
+        (self.settings, self.rules, self._rules_re, self._replacements,
+         self._sequential) = compiled
+
+    def add_rule(self, regex, replacement, name=None, priority=0):
+        """Add a rule, see RuleSet.add. The rules are recompiled into a single regex
+        and the path cache is cleared."""
+        self.user_rules.add(regex, replacement, name, priority)
+        try:
+            self._compile(share=False)
+        except Exception:
+            self.user_rules.remove(self.user_rules._rules[-1]['name'])
+            raise
+        if self.cache is not None:
+            self.cache.clear()
+
+    def remove_rule(self, name):
+        """Remove the user rule with the given name, see RuleSet.remove. The rules
+        are recompiled and the path cache is cleared."""
+        self.user_rules.remove(name)
+        self._compile(share=False)
+        if self.cache is not None:
+            self.cache.clear()
+
     def normalize_path(self, path):
-        for rule in self.rules:
-            path = re.sub(f"{rule['regex']}", rule['replacement'], path.lower())
+        if self.cache is None:
+            return self._normalize(path)
+
+        normalized = self.cache.get(path)
+        if normalized is None:
+            normalized = self._normalize(path)
+            self.cache.put(path, normalized)
+        return normalized
+
+    def _normalize(self, path):
+        """Apply the rules in a single pass over the path.
+
+        The single pass gives the same result as applying the rules one after
+        another when exactly one rule replaces text, no rule before it matches
+        inside that text and no rule matches the result: the rules before it then
+        don't match, it replaces just that text and the rules after it don't match
+        the result. A path where several rules replace text, e.g.
+        C:\\Users\\bob\\??\\C:\\Windows\\x where a later rule can match across the edge
+        of an earlier replacement, has the rules applied one after another.
+        """
+        path = path.lower()
+        rules_re = self._rules_re
+        match = rules_re.search(path)
+        if match is None:
+            return path
+
+        following = rules_re.search(path, match.start() + 1)
+        while following is not None and following.start() < match.end():
+            # Groups are named rule0, rule1, ... in the order the rules are tried
+            if int(following.lastgroup[4:]) < int(match.lastgroup[4:]):
+                return self._normalize_sequentially(path)
+            following = rules_re.search(path, following.start() + 1)
+        if following is not None:
+            return self._normalize_sequentially(path)
+
+        normalized = path[:match.start()] + self._replacements[match.lastgroup] + path[match.end():]
+        if rules_re.search(normalized) is not None:
+            return self._normalize_sequentially(path)
+        return normalized
+
+    def _normalize_sequentially(self, path):
+        for rule_re, replacement in self._sequential:
+            path = rule_re.sub(replacement, path.lower())
         return path
-  
-    def generate_rules(self):
-        if self.settings['architecture'] == 'x86_64':
-            self.settings.update(self.system_specific_settings['x86_64'])
-        elif self.settings['architecture'] == 'x86':
-            self.settings.update(self.system_specific_settings['x86'])       
+
+    def normalize_paths(self, paths):
+        """Normalize many paths, each distinct path only once.
+
+        paths (iterable): Paths, or a 1-d NumPy array or pandas Series of them. Values
+            that aren't strings (e.g. None or NaN) are returned unchanged.
+        RETURNS: A list of normalized paths in input order, or an array or Series
+            like paths (with the same index) when given one.
+        """
+        if hasattr(paths, 'tolist'):
+            values = paths.tolist()
         else:
+            values = list(paths)
+
+        normalized = {}
+        for path in values:
+            if path not in normalized:
+                normalized[path] = self.normalize_path(path) if isinstance(path, str) else path
+        results = [normalized[path] for path in values]
+
+        if hasattr(paths, 'to_numpy') and hasattr(paths, 'index'):
+            # pandas Series
+            return type(paths)(results, index=paths.index, name=paths.name, dtype=object)
+        if hasattr(paths, 'tolist'):
+            import numpy
+            return numpy.array(results, dtype=object)
+        return results
+
+    def cache_info(self):
+        """Return hit, miss and eviction counters of the path cache"""
+        if self.cache is None:
+            return None
+        return self.cache.info()
+
+    @staticmethod
+    def merge_rules(settings, builtin_rules, user_rules):
+        """Return the built-in and user rules in the order they are tried, highest
+        priority first and built-in rules first among equals, with the settings
+        the user rules refer to expanded"""
+        rules = list(builtin_rules)
+        for rule in user_rules:
+            rule = dict(rule, regex=expand(rule['regex'], settings))
+            rules.append(MappingProxyType(rule))
+        rules.sort(key=lambda rule: -rule.get('priority', 0))
+        return tuple(rules)
+
+    @classmethod
+    def compile_rules(cls, settings, rules):
+        """Compile the rules into one regex so each path is scanned in a single pass.
+
+        Rules are arranged in a prefix trie on their leading drive and directory
+        (systemdrive, then systemroot) so the shared prefix is only matched once per
+        position. Below that, rules are grouped on their leading literal characters,
+        so at each position the regex engine skips a whole group of rules on a single
+        character compare and the cost of a miss doesn't grow with the number of
+        rules. Only rules that can't match at the same position are reordered, and
+        each rule ends in an empty named group, so at each position the first rule
+        that matches wins just like it did when the rules were applied one after
+        another. Where matches of different rules overlap the single pass can differ
+        from that, see _normalize. Other groups are made non-capturing and
+        replacement templates are expanded once here.
+
+        RETURNS (tuple): The compiled regex and a mapping of group name to replacement.
+        """
+        anchors = sorted((_uncapture(settings['systemdrive']), _uncapture(settings['systemroot'])),
+                         key=len)
+        trie = []
+        replacements = {}
+
+        for i, rule in enumerate(rules):
+            name = f'rule{i}'
+            node, regex, consumed = trie, _uncapture(rule['regex']), 0
+            for anchor in anchors:
+                if len(anchor) > consumed and regex.startswith(anchor):
+                    prefix = regex[consumed:len(anchor)]
+                    if not (node and node[-1][0] == prefix):
+                        node.append((prefix, []))
+                    node = node[-1][1]
+                    consumed = len(anchor)
+            node.append(((name,), regex[consumed:]))
+            replacements[name] = re.match('', '').expand(rule['replacement'])
+
+        try:
+            compiled = re.compile(cls._render_trie(trie))
+        except re.error as e:
+            # User rules are checked when added, but the built-in rules of a subclass aren't
+            raise ValueError(f'The rules can not be combined: {e}') from None
+        return compiled, MappingProxyType(replacements)
+
+    @classmethod
+    def _render_trie(cls, node):
+        branches = []
+        leaves = []
+        for key, value in node:
+            if isinstance(value, list):
+                branches.extend(cls._render_leaves(leaves))
+                leaves = []
+                branches.append(f'{key}(?:{cls._render_trie(value)})')
+            else:
+                leaves.append((value, key[0]))
+        branches.extend(cls._render_leaves(leaves))
+        # No branch has a top level |, see _render_leaves
+        return '|'.join(branches)
+
+    @classmethod
+    def _render_leaves(cls, leaves):
+        """Render (regex, group name) pairs as alternatives, grouping the ones that
+        start with the same literal character under it.
+
+        The regex engine checks the first literal of each alternative before trying
+        it, so a path character that starts none of a group's rules costs one compare.
+        Rules starting with different literals never match at the same position and
+        can be grouped out of order; a rule without a leading literal keeps its place.
+        """
+        branches = []
+        groups = {}
+        for regex, name in leaves:
+            split = _split_leading_literal(regex)
+            if split is None:
+                branches.append(f'(?:{regex})(?P<{name}>)' if regex else f'(?P<{name}>)')
+                groups = {}
+                continue
+            literal, rest = split
+            # Keyed on the character, as e.g. % and \% match the same one
+            char = literal[-1]
+            if char not in groups:
+                groups[char] = (literal, [])
+                branches.append(groups[char])
+            groups[char][1].append((rest, name))
+
+        rendered = []
+        for branch in branches:
+            if isinstance(branch, str):
+                rendered.append(branch)
+            elif len(branch[1]) == 1:
+                rest, name = branch[1][0]
+                rendered.append(f'{branch[0]}{rest}(?P<{name}>)')
+            else:
+                alternatives = cls._render_leaves(branch[1])
+                if len(alternatives) == 1:
+                    rendered.append(f'{branch[0]}{alternatives[0]}')
+                else:
+                    rendered.append(f"{branch[0]}(?:{'|'.join(alternatives)})")
+        return rendered
+  
+    @classmethod
+    def generate_settings(cls, architecture):
+        if architecture not in cls.system_specific_settings:
             raise ValueError('the architecture of the host is x86 or x86_64')
-        
-        self.rules.append(
+
+        settings = dict(cls.settings, architecture=architecture)
+        settings.update(cls.system_specific_settings[architecture])
+        return MappingProxyType(settings)
+
+    @staticmethod
+    def generate_rules(settings):
+        rules = []
+
+        rules.append(
             {
-                'regex': f"{self.settings['systemroot']}{self.settings['Sys86']}",
-                'replacement': '?sys32'
+                'regex': f"{settings['systemroot']}{settings['Sys86']}",
+                'replacement': '?sys32',
+                'name': 'sys32',
+                'priority': 0
             }
         )
         
-        if self.settings['architecture'] == 'x86_64':
-            self.rules.append(
+        if settings['architecture'] == 'x86_64':
+            rules.append(
                 {
-                    'regex': f"{self.settings['systemroot']}{self.settings['Sys64']}",
-                    'replacement': '?sys64'
+                    'regex': f"{settings['systemroot']}{settings['Sys64']}",
+                    'replacement': '?sys64',
+                    'name': 'sys64',
+                    'priority': 0
                 }
             )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['systemdrive']}{self.settings['ProgFiles86']}",
-                'replacement': '?pf86'
+                'regex': f"{settings['systemdrive']}{settings['ProgFiles86']}",
+                'replacement': '?pf86',
+                'name': 'pf86',
+                'priority': 0
             }
         )
-        if self.settings['architecture'] == 'x86_64':
-            self.rules.append(
+        if settings['architecture'] == 'x86_64':
+            rules.append(
                 {
-                    'regex': f"{self.settings['systemdrive']}{self.settings['ProgFiles64']}",
-                    'replacement': '?pf64'
+                    'regex': f"{settings['systemdrive']}{settings['ProgFiles64']}",
+                    'replacement': '?pf64',
+                    'name': 'pf64',
+                    'priority': 0
                 }
             )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['systemdrive']}{self.settings['usrTempPath']}",
-                'replacement': '?usrtmp\\\\'
+                'regex': f"{settings['systemdrive']}{settings['usrTempPath']}",
+                'replacement': '?usrtmp\\\\',
+                'name': 'usrtmp',
+                'priority': 0
             }
         )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['systemdrive']}{self.settings['usrPath']}",
-                'replacement': '?usr\\\\'
+                'regex': f"{settings['systemdrive']}{settings['usrPath']}",
+                'replacement': '?usr\\\\',
+                'name': 'usr',
+                'priority': 0
             }
         )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['systemroot']}",
-                'replacement': '?win\\\\'
+                'regex': f"{settings['systemroot']}",
+                'replacement': '?win\\\\',
+                'name': 'win',
+                'priority': -10
             }
         )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['systemdrive']}",
-                'replacement': '?c\\\\'
+                'regex': f"{settings['systemdrive']}",
+                'replacement': '?c\\\\',
+                'name': 'c',
+                'priority': -10
             }
         )
-        self.rules.append(
+        rules.append(
             {
-                'regex': f"{self.settings['guid']}",
-                'replacement': '{guid}'
+                'regex': f"{settings['guid']}",
+                'replacement': '{guid}',
+                'name': 'guid',
+                'priority': -10
             }
         )
 
+        return tuple(MappingProxyType(rule) for rule in rules)
@@ -1,15 +1,59 @@
 import re
+from bisect import bisect_left
 
 from spacy.matcher import Matcher
 from spacy.tokens import Doc, Span, Token
 from spacy.symbols import ORTH, LEMMA
 from spacy.lang.xx import Language
 
-from .expressions import ipv4_expr, url_expr, email_expr
-from .stemmer import get_domain, stem_ip_addr
+from .core import PATH, ARG, CMD, VAL, MAX_NESTING_DEPTH, MAX_TOKEN_LENGTH, classify_token, tag_tokens
+from .expressions import ipv4_expr, ipv6_expr, url_expr, email_expr
+from .stemmer import get_domain, stem_ip_addr, stem_ipv6_addr
 from .stemmer import NormalizeWinPath
 
 
+# Taggers record the sorted indices of the tokens they flag in Doc.user_data, so
+# the Doc and Span getters answer from the index instead of calling token._.get
+# on every token. Docs without an index (e.g. attributes set by hand) are scanned.
+def _index_key(attr):
+    return ('cyberspacy', 'index', attr)
+
+
+def _record_index(doc, attr, indices):
+    key = _index_key(attr)
+    previous = doc.user_data.get(key)
+    if previous:
+        indices = sorted(set(previous).union(indices))
+    doc.user_data[key] = indices
+
+
+def _index_bounds(tokens, attr):
+    if isinstance(tokens, Span):
+        doc, start, end = tokens.doc, tokens.start, tokens.end
+    else:
+        doc, start, end = tokens, 0, len(tokens)
+    indices = doc.user_data.get(_index_key(attr))
+    if indices is None:
+        return doc, start, None, 0, 0
+    return doc, start, indices, bisect_left(indices, start), bisect_left(indices, end)
+
+
+def has_indexed(tokens, attr):
+    """Whether any token of a Doc or Span has attr set"""
+    doc, start, indices, lo, hi = _index_bounds(tokens, attr)
+    if indices is None:
+        return any(token._.get(attr) for token in tokens)
+    return lo < hi
+
+
+def iter_indexed(tokens, attr):
+    """(index, token) tuples of the tokens of a Doc or Span that have attr set"""
+    doc, start, indices, lo, hi = _index_bounds(tokens, attr)
+    if indices is None:
+        return [(i, t) for i, t in enumerate(tokens) if t._.get(attr)]
+    return [(i - start, doc[i]) for i in indices[lo:hi]]
+
+
 class CommandLineTagger(object):
     
     name='cmdline_tagger'
@@ -27,7 +71,9 @@ class CommandLineTagger(object):
                'has_cmd', 'is_cmd', 'cmd',
                'sub_cmd',
                'tokens',
-               'normalize')
+               'normalize'),
+        max_token_length=MAX_TOKEN_LENGTH,
+        rules=None
     ):
         
         self._has_path, self._is_path, self._path,\
@@ -42,23 +88,10 @@ class CommandLineTagger(object):
         if nlp is None:
             nlp = Language()
         self.nlp = nlp
-        self.matcher = Matcher(nlp.vocab)
-        self.normalizer = NormalizeWinPath(architecture)
-
-        path_re = r"""(\\\?\?\\[^ ]+|\\\?\\[^ ]+)|("(([a-zA-Z]:)|([a-zA-Z]:\\Program Files \(x86\)))([^\"\s])+(\s((\S+\\)+\S*))*"|^[a-zA-Z]?:[^ ]+)"""
-        arg_re = r"""(^(\/|-|--)\S*$)"""
-        cmd_re = r"""(".*")"""
-        val_re = r"""^[^(\/|-|\-\-| )]+"""
-
-        path = [{"TEXT": {"REGEX": path_re}}]
-        arg = [{"TEXT": {"REGEX": arg_re}}]
-        cmd = [{"TEXT": {"REGEX": cmd_re}}]
-        val = [{"TEXT": {"REGEX": val_re}}]
-        
-        self.matcher.add('path', None, path)
-        self.matcher.add('arg', None, arg)
-        self.matcher.add('cmd', None, cmd)
-        self.matcher.add('val', None, val)
+        # rules are user path normalization rules, see cyberspacy.rules
+        self.normalizer = NormalizeWinPath(architecture, rules=rules)
+        # Longer tokens are left unclassified and stem to themselves, see tag_tokens
+        self.max_token_length = max_token_length
 
         Doc.set_extension(self._has_path, getter=self.has_path, force=True)
         Doc.set_extension(self._path, getter=self.iter_path, force=True)
@@ -86,65 +119,68 @@ class CommandLineTagger(object):
         Span.set_extension(self._has_cmd, getter=self.has_cmd, force=True)
         Span.set_extension(self._cmd, getter=self.iter_cmd, force=True)
         Token.set_extension(self._is_cmd, default=False, force=True)
-        Token.set_extension(self._sub_cmd, default=None, force=True)
+        Token.set_extension(self._sub_cmd, getter=self.get_sub_cmd, force=True)
         
         Doc.set_extension(self._tokens, getter=self.iter_tokens, force=True)
         
         Doc.set_extension(self._normalize, getter=self.normalize_cmd, force=True)
         
     def __call__(self, doc):
-        matches = self.matcher(doc)
-        spans = []
-        
-        for match_id, start, end in matches:
-            span = doc[start : end]
-
-            for token in span:
-                if doc.vocab.strings[match_id] == 'path':
-                    token._.set(self._is_path, True)
-                    token._.set(self._stem, self.normalizer.normalize_path(token.text))
-                
-                elif doc.vocab.strings[match_id] == 'cmd':
-                    if not token._.is_path:
-                        token._.set(self._is_cmd, True)
-                        token._.set(self._sub_cmd, self.nlp(token.text[1:-1]))
-                 
-                if doc.vocab.strings[match_id] == 'arg':
-                    token._.set(self._is_arg, True)
-                                                      
-                elif doc.vocab.strings[match_id] == 'val' and start>0:
-                    token._.set(self._is_val, True)
-                
-                if not token._.is_path:
-                    token._.set(self._stem, token.text)
-                                                   
-            spans.append(span)
-            
+        is_path, is_arg, is_cmd, is_val, stem = \
+            self._is_path, self._is_arg, self._is_cmd, self._is_val, self._stem
+        kinds, stems = tag_tokens([token.text for token in doc], self.normalizer,
+                                  self.max_token_length)
+        paths, args, vals, cmds = [], [], [], []
+
+        # Only non-default values are written; unmatched tokens keep is_* False and no stem
+        for token, kind, token_stem in zip(doc, kinds, stems):
+            if token_stem is None:
+                continue
+
+            underscore = token._
+            underscore.set(stem, token_stem)
+            if kind & PATH:
+                underscore.set(is_path, True)
+                paths.append(token.i)
+            if kind & CMD:
+                underscore.set(is_cmd, True)
+                cmds.append(token.i)
+            if kind & ARG:
+                underscore.set(is_arg, True)
+                args.append(token.i)
+            if kind & VAL:
+                underscore.set(is_val, True)
+                vals.append(token.i)
+
+        _record_index(doc, is_path, paths)
+        _record_index(doc, is_arg, args)
+        _record_index(doc, is_val, vals)
+        _record_index(doc, is_cmd, cmds)
         return doc
     
     def has_path(self, tokens):
-        return any(token._.get(self._is_path) for token in tokens)
+        return has_indexed(tokens, self._is_path)
 
     def iter_path(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_path)]
+        return iter_indexed(tokens, self._is_path)
     
     def has_arg(self, tokens):
-        return any(token._.get(self._is_arg) for token in tokens)
+        return has_indexed(tokens, self._is_arg)
 
     def iter_arg(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_arg)]
+        return iter_indexed(tokens, self._is_arg)
 
     def has_val(self, tokens):
-        return any(token._.get(self._is_val) for token in tokens)
+        return has_indexed(tokens, self._is_val)
 
     def iter_val(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_val)]
+        return iter_indexed(tokens, self._is_val)
 
     def has_cmd(self, tokens):
-        return any(token._.get(self._is_cmd) for token in tokens)
+        return has_indexed(tokens, self._is_cmd)
 
     def iter_cmd(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_cmd)]
+        return iter_indexed(tokens, self._is_cmd)
     
     def iter_tokens(self, tokens):
         return [t.text for t in tokens]
@@ -152,16 +188,47 @@ class CommandLineTagger(object):
     def iter_stems(self, tokens):
         return [t._.stem for t in tokens]
     
+    def get_sub_cmd(self, token):
+        """Parse the nested command held by a cmd token.
+
+        The nested command is only parsed the first time it is asked for. The
+        resulting Doc is kept in the parent's user_data so later lookups from
+        normalization or the processor reuse the same parse. Nested commands
+        deeper than MAX_NESTING_DEPTH aren't parsed and return None.
+        """
+        if not token._.get(self._is_cmd):
+            return None
+
+        depth = self.get_depth(token.doc)
+        if depth >= MAX_NESTING_DEPTH:
+            return None
+
+        key = (self.name, self._sub_cmd, token.i)
+        sub_cmd = token.doc.user_data.get(key)
+        if sub_cmd is None:
+            sub_cmd = self.nlp(token.text[1:-1])
+            self.set_depth(sub_cmd, depth + 1)
+            token.doc.user_data[key] = sub_cmd
+        return sub_cmd
+
+    def get_depth(self, doc):
+        """Return how deeply doc is nested in another command line"""
+        return doc.user_data.get((self.name, 'depth'), 0)
+
+    def set_depth(self, doc, depth):
+        doc.user_data[(self.name, 'depth')] = depth
+
     def normalize_cmd(self, tokens):
         stemmed = []
 
         for t in tokens:
-            if t._.is_cmd:
-                sub_cmd = self.nlp(self._remove_quotes(t.text))
-                normalized_sub = self._add_quotes(sub_cmd._.normalize)
+            sub_cmd = t._.get(self._sub_cmd)
+            if sub_cmd is not None:
+                normalized_sub = self._add_quotes(sub_cmd._.get(self._normalize))
                 stemmed.append(normalized_sub)
             else:
-                stemmed.append(t._.stem)
+                stem = t._.stem
+                stemmed.append(t.text if stem is None else stem)
 
         return ' '.join(stemmed)
 
@@ -174,6 +241,39 @@ class CommandLineTagger(object):
     def _add_quotes(s):
         return f'"{s}"'
 
+# Compiled once and shared by the taggers that classify a kind of token
+ipv4_re = re.compile(ipv4_expr, re.VERBOSE | re.I | re.UNICODE)
+url_re = re.compile(url_expr, re.VERBOSE | re.I | re.UNICODE)
+email_addr_re = re.compile(email_expr, re.VERBOSE | re.I | re.UNICODE)
+
+
+def is_ipv4_text(text, max_length=64):
+    # An address starts with a digit and has three dots, the regex only runs on those
+    if not text[:1].isdigit() or text.count('.') < 3:
+        return False
+    if max_length is not None and len(text) > max_length:
+        return False
+    return bool(ipv4_re.match(text))
+
+
+def is_url_text(text, max_length=2048):
+    # url_expr fails on most words as fast as any character check in Python could,
+    # so it isn't gated on one
+    if max_length is not None and len(text) > max_length:
+        return False
+    return bool(url_re.match(text))
+
+
+def is_email_addr_text(text, max_length=254):
+    # The local part can't contain '@' and the domain needs a dot after it
+    at = text.find('@')
+    if at < 1 or text.find('.', at) < 0:
+        return False
+    if max_length is not None and len(text) > max_length:
+        return False
+    return bool(email_addr_re.match(text))
+
+
 class IPTagger(object):
     """spaCy v2.0 pipeline component for adding IP meta data to `Doc` objects.
     
@@ -196,7 +296,7 @@ class IPTagger(object):
     name='ip_tagger'
 
     def __init__(self, nlp, pattern_id='IPTagger', attrs=('has_ipv4', 'is_ipv4', 'ipv4'), force_extension=False,
-                 subnets_to_keep=4):
+                 subnets_to_keep=4, max_length=64):
         """Initialise the pipeline component.
 
         nlp (Language): The shared nlp object. Used to initialise the matcher
@@ -207,6 +307,7 @@ class IPTagger(object):
             ('has_ipv4', 'is_ipv4', 'ipv4').
         force_extension (bool): Force creation of extension objects.
         subnets_to_keep (int): Number of subnets to include in lemmatization.
+        max_length (int): Longer tokens are never tagged. None disables the limit.
         RETURNS (callable): A spaCy pipeline component.
         """
         self._has_ipv4, self._is_ipv4, self._ipv4 = attrs
@@ -215,12 +316,11 @@ class IPTagger(object):
         if (subnets_to_keep < 1) or (subnets_to_keep > 4):
             raise ValueError('Subnets_to_keep must be in the range 1-4')
         self.subnets_to_keep = subnets_to_keep
+        self.max_length = max_length
 
         # Add IPv4 rule to matcher
-        self._ipv4_re = re.compile(ipv4_expr, re.VERBOSE | re.I | re.UNICODE)
-        ipv4_mask = lambda text: bool(self._ipv4_re.match(text))
-        ipv4_flag = nlp.vocab.add_flag(ipv4_mask)
-        self.matcher.add('IPV4', None, [{ipv4_flag: True}])
+        self.ipv4_flag = nlp.vocab.add_flag(self.is_ipv4_text)
+        self.matcher.add('IPV4', None, [{self.ipv4_flag: True}])
         
         # Add attributes
         # Need to force since extensions are global by default
@@ -245,13 +345,119 @@ class IPTagger(object):
                 token.lemma_ = stem_ip_addr(token.text, self.subnets_to_keep)
             spans.append(span)
 
+        _record_index(doc, self._is_ipv4, [span.start for span in spans])
         return doc
 
+    def is_ipv4_text(self, text):
+        return is_ipv4_text(text, self.max_length)
+
     def has_ipv4(self, tokens):
-        return any(token._.get(self._is_ipv4) for token in tokens)
+        return has_indexed(tokens, self._is_ipv4)
 
     def iter_ipv4(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_ipv4)]        
+        return iter_indexed(tokens, self._is_ipv4)
+
+
+# Characters an IPv6 address can contain, including the IPv4 suffix of the mixed form
+ipv6_chars = frozenset('0123456789abcdefABCDEF:.')
+
+
+class IPv6Tagger(object):
+    """spaCy v2.0 pipeline component for adding IPv6 meta data to `Doc` objects.
+    
+        USAGE:
+        >>> import spacy
+        >>> from spacy.lang.en import English
+        >>> from cyberspacy import IPv6Tagger
+        >>> nlp = English()
+        >>> ipv6_Tagger = IPv6Tagger(nlp, token_match=True)
+        >>> nlp.add_pipe(ipv6_Tagger, first=True)
+        >>> doc = nlp(u'This is a sentence which contains 2001:db8::1 as an IP address')
+        >>> assert doc._.has_ipv6 == True
+        >>> assert doc[0]._.is_ipv6 == False
+        >>> assert doc[6]._.is_ipv6 == True
+        >>> assert len(doc._.ipv6) == 1
+        >>> idx, ipv6_token = doc._.ipv6[0]
+        >>> assert idx == 6
+        >>> assert ipv6_token.text == '2001:db8::1'
+
+    English and other tokenizers split '2001:db8::1' on ':'. With token_match=True
+    the tagger replaces nlp.tokenizer.token_match with one that keeps IPv6
+    addresses whole and defers to the previous token_match otherwise. This changes
+    the tokenization of every Doc made by nlp and isn't undone if the tagger is
+    removed from the pipeline.
+    """
+    name='ipv6_tagger'
+
+    def __init__(self, nlp, pattern_id='IPv6Tagger', attrs=('has_ipv6', 'is_ipv6', 'ipv6'), force_extension=False,
+                 hextets_to_keep=8, token_match=False):
+        """Initialise the pipeline component.
+
+        nlp (Language): The shared nlp object. Used to initialise the matcher
+            with the shared `Vocab`, and create `Doc` match patterns.
+        pattern_id (unicode): ID of match pattern, defaults to 'IPv6Tagger'. Can be
+            changed to avoid ID clashes.
+        attrs (tuple): Attributes to set on the ._ property. Defaults to
+            ('has_ipv6', 'is_ipv6', 'ipv6').
+        force_extension (bool): Force creation of extension objects.
+        hextets_to_keep (int): Number of hextets to include in lemmatization.
+        token_match (bool): Stop nlp's tokenizer from splitting IPv6 addresses on
+            ':' by replacing its token_match. Off by default, see above.
+        RETURNS (callable): A spaCy pipeline component.
+        """
+        self._has_ipv6, self._is_ipv6, self._ipv6 = attrs
+        self.matcher = Matcher(nlp.vocab)
+
+        if (hextets_to_keep < 1) or (hextets_to_keep > 8):
+            raise ValueError('Hextets_to_keep must be in the range 1-8')
+        self.hextets_to_keep = hextets_to_keep
+
+        # Add IPv6 rule to matcher. The regex is lookahead heavy, so it only
+        # runs on lexemes that pass the character checks in is_ipv6_text.
+        self._ipv6_re = re.compile(ipv6_expr, re.VERBOSE | re.I | re.UNICODE)
+        ipv6_flag = nlp.vocab.add_flag(self.is_ipv6_text)
+        self.matcher.add('IPV6', None, [{ipv6_flag: True}])
+
+        # Tokenizers such as English split on ':', so keep whole addresses together
+        tokenizer = getattr(nlp, 'tokenizer', None)
+        if token_match and hasattr(tokenizer, 'token_match'):
+            previous_match = tokenizer.token_match
+            tokenizer.token_match = lambda text: (self.is_ipv6_text(text) or
+                                                  bool(previous_match and previous_match(text)))
+
+        # Add attributes
+        Doc.set_extension(self._has_ipv6, getter=self.has_ipv6, force=force_extension)
+        Doc.set_extension(self._ipv6, getter=self.iter_ipv6, force=force_extension)
+        Span.set_extension(self._has_ipv6, getter=self.has_ipv6, force=force_extension)
+        Span.set_extension(self._ipv6, getter=self.iter_ipv6, force=force_extension)
+        Token.set_extension(self._is_ipv6, default=False, force=force_extension)
+
+    def __call__(self, doc):
+        """Apply the pipeline component to a `Doc` object.
+
+        doc (Doc): The `Doc` returned by the previous pipeline component.
+        RETURNS (Doc): The modified `Doc` object.
+        """
+        matches = self.matcher(doc)
+        for match_id, start, end in matches:
+            for token in doc[start : end]:
+                token._.set(self._is_ipv6, True)
+                token.lemma_ = stem_ipv6_addr(token.text, self.hextets_to_keep)
+
+        _record_index(doc, self._is_ipv6, [start for match_id, start, end in matches])
+        return doc
+
+    def is_ipv6_text(self, text):
+        # Cheap checks every IPv6 address passes, so the full regex only runs on candidates
+        if ':' not in text or len(text) > 45 or not ipv6_chars.issuperset(text):
+            return False
+        return bool(self._ipv6_re.fullmatch(text))
+
+    def has_ipv6(self, tokens):
+        return has_indexed(tokens, self._is_ipv6)
+
+    def iter_ipv6(self, tokens):
+        return iter_indexed(tokens, self._is_ipv6)
 
 
 class URLTagger(object):
@@ -275,7 +481,8 @@ class URLTagger(object):
     """
     name='url_tagger'
 
-    def __init__(self, nlp, pattern_id='URLTagger', attrs=('has_url', 'is_url', 'url'), force_extension=False):
+    def __init__(self, nlp, pattern_id='URLTagger', attrs=('has_url', 'is_url', 'url'), force_extension=False,
+                 max_length=2048):
         """Initialise the pipeline component.
 
         nlp (Language): The shared nlp object. Used to initialise the matcher
@@ -285,16 +492,16 @@ class URLTagger(object):
         attrs (tuple): Attributes to set on the ._ property. Defaults to
             ('has_url', 'is_url', 'url').
         force_extension (bool): Force creation of extension objects.
+        max_length (int): Longer tokens are never tagged. None disables the limit.
         RETURNS (callable): A spaCy pipeline component.
         """
         self._has_url, self._is_url, self._url = attrs
         self.matcher = Matcher(nlp.vocab)
+        self.max_length = max_length
 
         # Add  URL rule to matcher
-        self._url_re = re.compile(url_expr, re.VERBOSE | re.I | re.UNICODE)
-        url_mask = lambda text: bool(self._url_re.match(text))
-        url_flag = nlp.vocab.add_flag(url_mask)
-        self.matcher.add('url', None, [{url_flag: True}])
+        self.url_flag = nlp.vocab.add_flag(self.is_url_text)
+        self.matcher.add('url', None, [{self.url_flag: True}])
         
         # Add attributes
         Doc.set_extension(self._has_url, getter=self.has_url, force=force_extension)
@@ -318,13 +525,20 @@ class URLTagger(object):
                 token.lemma_ = get_domain(token.text)
             spans.append(span)
 
+        _record_index(doc, self._is_url, [span.start for span in spans])
         return doc
 
+    def is_url_text(self, text):
+        # Inlined, a call to the module level is_url_text costs as much as the regex
+        if self.max_length is not None and len(text) > self.max_length:
+            return False
+        return bool(url_re.match(text))
+
     def has_url(self, tokens):
-        return any(token._.get(self._is_url) for token in tokens)
+        return has_indexed(tokens, self._is_url)
 
     def iter_url(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_url)]     
+        return iter_indexed(tokens, self._is_url)
 
 class EmailTagger(object):
     """spaCy v2.0 pipeline component for adding email address meta data to `Doc` objects.
@@ -347,7 +561,8 @@ class EmailTagger(object):
     """
     name='email_addr_tagger'
 
-    def __init__(self, nlp, pattern_id='EmailAddrTagger', attrs=('has_email_addr', 'is_email_addr', 'email_addr'), force_extension=False):
+    def __init__(self, nlp, pattern_id='EmailAddrTagger', attrs=('has_email_addr', 'is_email_addr', 'email_addr'), force_extension=False,
+                 max_length=254):
         """Initialise the pipeline component.
 
         nlp (Language): The shared nlp object. Used to initialise the matcher
@@ -357,16 +572,16 @@ class EmailTagger(object):
         attrs (tuple): Attributes to set on the ._ property. Defaults to
             ('has_email_addr', 'is_email_addr', 'email_addr').
         force_extension (bool): Force creation of extension objects.
+        max_length (int): Longer tokens are never tagged. None disables the limit.
         RETURNS (callable): A spaCy pipeline component.
         """
         self._has_email_addr, self._is_email_addr, self._email_addr = attrs
         self.matcher = Matcher(nlp.vocab)
+        self.max_length = max_length
 
         # Add email address rule to matcher
-        self._email_addr_re = re.compile(email_expr, re.VERBOSE | re.I | re.UNICODE)
-        email_addr_mask = lambda text: bool(self._email_addr_re.match(text))
-        email_addr_flag = nlp.vocab.add_flag(email_addr_mask)
-        self.matcher.add('email_addr', None, [{email_addr_flag: True}])
+        self.email_addr_flag = nlp.vocab.add_flag(self.is_email_addr_text)
+        self.matcher.add('email_addr', None, [{self.email_addr_flag: True}])
         
         # Add attributes
         Doc.set_extension(self._has_email_addr, getter=self.has_email_addr, force=force_extension)
@@ -389,11 +604,138 @@ class EmailTagger(object):
                 token._.set(self._is_email_addr, True)
             spans.append(span)
 
+        _record_index(doc, self._is_email_addr, [span.start for span in spans])
         return doc
 
+    def is_email_addr_text(self, text):
+        return is_email_addr_text(text, self.max_length)
+
     def has_email_addr(self, tokens):
-        return any(token._.get(self._is_email_addr) for token in tokens)
+        return has_indexed(tokens, self._is_email_addr)
 
     def iter_email_addr(self, tokens):
-        return [(i, t) for i, t in enumerate(tokens) if t._.get(self._is_email_addr)]
+        return iter_indexed(tokens, self._is_email_addr)
+
+
+# Kinds of IOC assigned by IOCTagger. A token can be several at once.
+IOC_IPV4, IOC_URL, IOC_EMAIL_ADDR = 1, 2, 4
+
+
+class IOCTagger(object):
+    """spaCy v2.0 pipeline component that tags IPv4 addresses, URLs and email
+    addresses in a single pass over each `Doc`.
+
+    It sets the same attributes and lemmas as IPTagger, URLTagger and EmailTagger,
+    so it can replace a pipeline that stacks all three. Each lexeme is classified
+    once, with one lexeme flag, and each `Doc` is scanned by one matcher. Tokens that
+    are both an IPv4 address and a URL keep the IPv4 lemma.
+
+        USAGE:
+        >>> import spacy
+        >>> from spacy.lang.en import English
+        >>> from cyberspacy import IOCTagger
+        >>> nlp = English()
+        >>> ioc_Tagger = IOCTagger(nlp)
+        >>> nlp.add_pipe(ioc_Tagger, first=True)
+        >>> doc = nlp(u'Mail test@example.com about https://example.com and 2.3.4.5')
+        >>> assert doc[1]._.is_email_addr == True
+        >>> assert doc[3]._.is_url == True
+        >>> assert doc[3].lemma_ == 'example.com'
+        >>> assert doc[5]._.is_ipv4 == True
+        >>> assert len(doc._.ipv4) == 1
+    """
+    name='ioc_tagger'
+
+    def __init__(self, nlp, pattern_id='IOCTagger',
+                 attrs=('has_ipv4', 'is_ipv4', 'ipv4',
+                        'has_url', 'is_url', 'url',
+                        'has_email_addr', 'is_email_addr', 'email_addr'),
+                 force_extension=False, subnets_to_keep=4, max_length=(64, 2048, 254)):
+        """Initialise the pipeline component.
+
+        nlp (Language): The shared nlp object. Used to initialise the matcher
+            with the shared `Vocab`, and create `Doc` match patterns.
+        pattern_id (unicode): ID of match pattern, defaults to 'IOCTagger'. Can be
+            changed to avoid ID clashes.
+        attrs (tuple): Attributes to set on the ._ property, the attrs of the
+            IPv4, URL and email taggers in that order.
+        force_extension (bool): Force creation of extension objects.
+        subnets_to_keep (int): Number of subnets to include in IPv4 lemmatization.
+        max_length (tuple): max_length of the IPv4, URL and email taggers.
+        RETURNS (callable): A spaCy pipeline component.
+        """
+        (self._has_ipv4, self._is_ipv4, self._ipv4,
+         self._has_url, self._is_url, self._url,
+         self._has_email_addr, self._is_email_addr, self._email_addr) = attrs
+        if (subnets_to_keep < 1) or (subnets_to_keep > 4):
+            raise ValueError('Subnets_to_keep must be in the range 1-4')
+        self.subnets_to_keep = subnets_to_keep
+        self.max_length = max_length
+
+        # Each lexeme is classified once, when it is added to the vocab. The kinds
+        # of the lexemes that are any IOC are kept for __call__, and the single flag
+        # lets one matcher find those tokens
+        self._kinds = {}
+        self.ioc_flag = nlp.vocab.add_flag(self.is_ioc_text)
+        self.matcher = Matcher(nlp.vocab)
+        self.matcher.add(pattern_id, None, [{self.ioc_flag: True}])
+
+        for has_attr, is_attr, iter_attr in ((self._has_ipv4, self._is_ipv4, self._ipv4),
+                                             (self._has_url, self._is_url, self._url),
+                                             (self._has_email_addr, self._is_email_addr,
+                                              self._email_addr)):
+            has_getter = lambda tokens, attr=is_attr: has_indexed(tokens, attr)
+            iter_getter = lambda tokens, attr=is_attr: iter_indexed(tokens, attr)
+            Doc.set_extension(has_attr, getter=has_getter, force=force_extension)
+            Doc.set_extension(iter_attr, getter=iter_getter, force=force_extension)
+            Span.set_extension(has_attr, getter=has_getter, force=force_extension)
+            Span.set_extension(iter_attr, getter=iter_getter, force=force_extension)
+            Token.set_extension(is_attr, default=False, force=force_extension)
+
+    def __call__(self, doc):
+        """Apply the pipeline component to a `Doc` object.
+
+        doc (Doc): The `Doc` returned by the previous pipeline component.
+        RETURNS (Doc): The modified `Doc` object.
+        """
+        kinds = self._kinds
+        ipv4s, urls, email_addrs = [], [], []
+        for match_id, start, end in self.matcher(doc):
+            token = doc[start]
+            kind = kinds[token.text]
+            if kind & IOC_IPV4:
+                token._.set(self._is_ipv4, True)
+                token.lemma_ = stem_ip_addr(token.text, self.subnets_to_keep)
+                ipv4s.append(start)
+            if kind & IOC_URL:
+                token._.set(self._is_url, True)
+                if not kind & IOC_IPV4:
+                    token.lemma_ = get_domain(token.text)
+                urls.append(start)
+            if kind & IOC_EMAIL_ADDR:
+                token._.set(self._is_email_addr, True)
+                email_addrs.append(start)
+
+        _record_index(doc, self._is_ipv4, sorted(ipv4s))
+        _record_index(doc, self._is_url, sorted(urls))
+        _record_index(doc, self._is_email_addr, sorted(email_addrs))
+        return doc
 
+    def classify(self, text):
+        """Return the kinds of IOC text is, a bit mask of IOC_IPV4, IOC_URL and
+        IOC_EMAIL_ADDR"""
+        ipv4_length, url_length, email_addr_length = self.max_length
+        kind = 0
+        if is_ipv4_text(text, ipv4_length):
+            kind |= IOC_IPV4
+        if is_url_text(text, url_length):
+            kind |= IOC_URL
+        if is_email_addr_text(text, email_addr_length):
+            kind |= IOC_EMAIL_ADDR
+        return kind
+
+    def is_ioc_text(self, text):
+        kind = self.classify(text)
+        if kind:
+            self._kinds[text] = kind
+        return bool(kind)
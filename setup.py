@@ -30,10 +30,19 @@ def setup_package():
         url=about['__uri__'],
         version=about['__version__'],
         license=about['__license__'],
-        packages=find_packages(),
+        packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
         install_requires=[
             'spacy>=2.0.0,<3.0.0',
+            'numpy>=1.15.0',
             ],
+        extras_require={
+            'arrow': ['pyarrow>=10.0.0'],
+            'pandas': ['pyarrow>=10.0.0', 'pandas'],
+            'yaml': ['pyyaml'],
+        },
+        entry_points={
+            'console_scripts': ['cyberspacy = cyberspacy.cli:main'],
+        },
         zip_safe=False,
     )
 
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from cyberspacy.cli import main, get_field
+
+
+def read_output(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+def test_get_field():
+    record = {'process': {'command_line': 'a.exe'}, 'id': 1}
+    assert get_field(record, 'process.command_line') == 'a.exe'
+    assert get_field(record, 'process.missing') is None
+    assert get_field(record, 'id.command_line') is None
+    assert get_field({'process.cmd': 'a.exe'}, 'process.cmd', dotted=False) == 'a.exe'
+    assert get_field({'process.cmd': 'a.exe'}, 'process.cmd') is None
+
+def test_normalize_lines(tmp_path, capsys):
+    path = tmp_path / 'cmd_lines.txt'
+    path.write_text('C:\\Windows\\System32\\svchost.exe -k netsvcs\n\n"C:\\Program Files\\App\\app.exe" /q\n')
+    assert main(['normalize', str(path), '--batch-size', '1']) == 0
+    records = read_output(capsys)
+    assert [r['cyberspacy']['normalized'] for r in records] == [r'?sys64\svchost.exe -k netsvcs', r'"?pf64\app\app.exe" /q']
+    assert records[0]['command_line'] == r'C:\Windows\System32\svchost.exe -k netsvcs'
+    assert records[0]['cyberspacy']['args'] == ['-k']
+    assert records[0]['cyberspacy']['paths'] == [r'C:\Windows\System32\svchost.exe']
+    assert records[0]['cyberspacy']['normalized_paths'] == [r'?sys64\svchost.exe']
+    assert records[0]['cyberspacy']['tokens'] == [r'C:\Windows\System32\svchost.exe', '-k', 'netsvcs']
+
+def test_normalize_jsonl(tmp_path, capsys):
+    path = tmp_path / 'events.jsonl'
+    events = [{'id': 1, 'process': {'cmd': r'C:\Windows\notepad.exe x.txt'}}, {'id': 2}]
+    path.write_text('\n'.join(json.dumps(e) for e in events))
+    main(['normalize', str(path), '--format', 'jsonl', '--field', 'process.cmd', '--output-field', 'norm'])
+    records = read_output(capsys)
+    assert records[0]['id'] == 1
+    assert records[0]['norm']['normalized'] == r'?win\notepad.exe x.txt'
+    assert records[1] == {'id': 2, 'norm': None}
+
+def test_normalize_csv(tmp_path, capsys):
+    path = tmp_path / 'events.csv'
+    path.write_text('host,cmd\nws1,"""C:\\Program Files\\App\\app.exe"" /q"\n')
+    main(['normalize', str(path), '--format', 'csv', '--field', 'cmd'])
+    records = read_output(capsys)
+    assert records[0]['host'] == 'ws1'
+    assert records[0]['cyberspacy']['normalized'] == r'"?pf64\app\app.exe" /q'
+
+    # Column names are used as they are
+    path.write_text('host,process.cmd\nws1,C:\\Windows\\notepad.exe\n')
+    main(['normalize', str(path), '--format', 'csv', '--field', 'process.cmd'])
+    assert read_output(capsys)[0]['cyberspacy']['normalized'] == r'?win\notepad.exe'
+
+def test_normalize_bad_jsonl(tmp_path, capsys):
+    path = tmp_path / 'events.jsonl'
+    path.write_text('{"command_line": "a.exe /q"}\n{nope\n"abc"\n[1]\n{"command_line": "b.exe"}\n')
+    assert main(['normalize', str(path), '--format', 'jsonl']) == 0
+    records = read_output(capsys)
+    assert [r['cyberspacy']['normalized'] for r in (records[0], records[4])] == ['a.exe /q', 'b.exe']
+    assert records[1]['cyberspacy'] is None
+    assert records[1]['cyberspacy_error'].startswith('JSONDecodeError')
+    assert records[2] == {'cyberspacy': None,
+                          'cyberspacy_error': 'TypeError: Expected a JSON object, got str'}
+    assert records[3]['cyberspacy_error'] == 'TypeError: Expected a JSON object, got list'
+
+def test_normalize_bad_line(tmp_path, capsys):
+    path = tmp_path / 'cmd_lines.txt'
+    path.write_text('C:\\Windows\\notepad.exe\na.exe "\ntasklist | findstr x\n')
+    for workers in ('1', '2'):
+        assert main(['normalize', str(path), '--batch-size', '2', '--workers', workers]) == 0
+        records = read_output(capsys)
+        assert [r['command_line'] for r in records] == [r'C:\Windows\notepad.exe', 'a.exe "',
+                                                        'tasklist | findstr x']
+        assert records[1]['cyberspacy'] is None
+        assert records[1]['cyberspacy_error'].startswith('ValueError')
+        assert records[2]['cyberspacy']['normalized'] == 'tasklist | findstr x'
+        assert 'cyberspacy_error' not in records[2]
+
+def test_normalize_requires_command():
+    with pytest.raises(SystemExit):
+        main([])
+
+@pytest.mark.parametrize('option,value', [('--workers', '0'), ('--batch-size', '-5'),
+                                          ('--cache-size', '-1'), ('--workers', 'x')])
+def test_normalize_rejects_bad_numbers(option, value, capsys):
+    with pytest.raises(SystemExit) as e:
+        main(['normalize', option, value])
+    assert e.value.code == 2
+    assert option in capsys.readouterr().err
+
+def test_normalize_stats(tmp_path, capsys):
+    path = tmp_path / 'cmd_lines.txt'
+    path.write_text('C:\\Windows\\System32\\svchost.exe -k netsvcs\n')
+    assert main(['normalize', str(path), '--stats']) == 0
+    assert 'parse_cmdline' in capsys.readouterr().err
+
+def test_normalize_rules(tmp_path, capsys):
+    rules = tmp_path / 'rules.json'
+    rules.write_text(json.dumps({'rules': [{'regex': r'${systemdrive}programdata\\', 'replacement': r'?progdata\\'}]}))
+    path = tmp_path / 'cmd_lines.txt'
+    path.write_text('C:\\ProgramData\\app.exe /q\n')
+    main(['normalize', str(path), '--rules', str(rules)])
+    assert read_output(capsys)[0]['cyberspacy']['normalized'] == r'?progdata\app.exe /q'
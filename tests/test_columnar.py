@@ -0,0 +1,94 @@
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from cyberspacy import columnar
+from cyberspacy.processor import WindowsCommandlineProcessor
+
+CMD_LINES = [
+    r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+    r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\a.exe /q C:\b.txt"',
+    r'notepad.exe',
+    r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+]
+
+def expected(include_nested_commands=True):
+    processor = WindowsCommandlineProcessor()
+    return [processor.analyze(cmd_line, include_nested_commands) for cmd_line in CMD_LINES]
+
+@pytest.mark.parametrize('dictionary', [True, False])
+@pytest.mark.parametrize('include_nested_commands', [True, False])
+def test_analyze_column(dictionary, include_nested_commands):
+    column = pa.chunked_array([pa.array(CMD_LINES[:1]), pa.array(CMD_LINES[1:] + [None])])
+    table = columnar.analyze_column(column, include_nested_commands=include_nested_commands,
+                                    chunk_size=2, dictionary=dictionary)
+    assert table.schema == columnar.output_schema(dictionary)
+    for name in columnar.COLUMNS:
+        values = [analysis[name] for analysis in expected(include_nested_commands)]
+        assert table.column(name).to_pylist() == values + [None]
+
+def test_analyze_batch_dictionary_encodes_duplicates():
+    batch = columnar.analyze_batch(CMD_LINES * 50)
+    normalized = batch.column(0)
+    assert len(normalized) == 200
+    assert len(normalized.dictionary) == 3
+    assert batch.column(1).to_pylist()[:4] == [analysis['args'] for analysis in expected()]
+
+def test_analyze_series():
+    pd = pytest.importorskip('pandas')
+    series = pd.Series(CMD_LINES + [float('nan'), 5], index=list('abcdef'))
+    frame = columnar.analyze_series(series, prefix='cl_')
+    assert list(frame.columns) == ['cl_' + name for name in columnar.COLUMNS]
+    assert list(frame.index) == list('abcdef')
+    assert frame['cl_normalized'].tolist()[:4] == [analysis['normalized'] for analysis in expected()]
+    assert frame['cl_normalized'].isna().tolist()[4:] == [True, True]
+
+def test_analyze_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    source, destination = tmp_path / 'in.parquet', tmp_path / 'out.parquet'
+    pq.write_table(pa.table({'id': list(range(len(CMD_LINES))), 'cmd_line': CMD_LINES}), source)
+    assert columnar.analyze_parquet(source, destination, 'cmd_line', chunk_size=3) == len(CMD_LINES)
+
+    table = pq.read_table(destination)
+    assert table.column('id').to_pylist() == list(range(len(CMD_LINES)))
+    assert table.column('cyberspacy_normalized_paths').to_pylist() == \
+        [analysis['normalized_paths'] for analysis in expected()]
+
+def test_unparseable_rows(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    cmd_lines = [CMD_LINES[0], 'a.exe "', 'tasklist | findstr x', 'a.exe "', None]
+    batch = columnar.analyze_batch(cmd_lines)
+    assert batch.column(0).to_pylist() == [expected()[0]['normalized'], None,
+                                           'tasklist | findstr x', None, None]
+    assert batch.column(1).to_pylist()[1:] == [None, [], None, None]
+
+    source, destination = tmp_path / 'in.parquet', tmp_path / 'out.parquet'
+    pq.write_table(pa.table({'cmd_line': cmd_lines}), source)
+    processor = WindowsCommandlineProcessor(n_process=2)
+    assert columnar.analyze_parquet(source, destination, 'cmd_line', processor=processor,
+                                    chunk_size=2) == len(cmd_lines)
+    table = pq.read_table(destination)
+    assert table.column('cyberspacy_normalized').to_pylist() == batch.column(0).to_pylist()
+    processor.close()
+
+def test_batches_share_worker_pool(tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from cyberspacy import processor as processor_module
+
+    pools = []
+    def counting_pool(*args, **kwargs):
+        pools.append(real_pool(*args, **kwargs))
+        return pools[-1]
+    real_pool = processor_module.Pool
+    monkeypatch.setattr(processor_module, 'Pool', counting_pool)
+
+    source, destination = tmp_path / 'in.parquet', tmp_path / 'out.parquet'
+    pq.write_table(pa.table({'cmd_line': CMD_LINES * 3}), source)
+    with WindowsCommandlineProcessor(n_process=2) as processor:
+        # Six row batches, one pool
+        columnar.analyze_parquet(source, destination, 'cmd_line', processor=processor,
+                                 chunk_size=2)
+        columnar.analyze_column(CMD_LINES, processor, chunk_size=1)
+    assert len(pools) == 1
+    assert pq.read_table(destination).column('cyberspacy_normalized').to_pylist() == \
+        [analysis['normalized'] for analysis in expected()] * 3
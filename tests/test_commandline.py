@@ -1,9 +1,12 @@
+import asyncio
+
 from spacy.lang.xx import Language
 import pytest
 
 from cyberspacy.tokenizer import CommandLineTokenizer
-from cyberspacy.tagger import CommandLineTagger
+from cyberspacy.tagger import CommandLineTagger, classify_token, PATH, ARG, CMD, VAL
 from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.batching import MicroBatcher
 
 @pytest.fixture(scope='function')
 def nlp():
@@ -33,6 +36,16 @@ def test_cmdline_tokenizer(nlp):
     assert doc_cmd_c._.tokens == [r'C:\Windows\System32\cmd.exe', r'/c', r'"C:\Users\Alice\file.txt --f C:\test.py"']
     assert doc_cmd_k._.tokens == [r'C:\Windows\System32\cmd.exe', r'/k', r'"C:\Users\Alice\file.txt --f C:\test.py"']
 
+def test_cmdline_split_operators(nlp):
+    tokenizer = CommandLineTokenizer(nlp.vocab)
+    assert tokenizer.cmdline_split(r'tool.exe   /a  -b') == ['tool.exe', '/a', '-b']
+    assert tokenizer.cmdline_split(r'findstr /i error C:\logs\app.log | sort') == ['findstr', '/i', 'error', r'C:\logs\app.log', '|', 'sort']
+    assert tokenizer.cmdline_split(r'echo a&&echo b 2>C:\err.txt') == ['echo', 'a', '&&', 'echo', 'b', '2>', r'C:\err.txt']
+    assert tokenizer.cmdline_split(r'say "hi | there" now') == ['say', '"hi | there"', 'now']
+    assert tokenizer.cmdline_split('') == []
+    with pytest.raises(ValueError):
+        tokenizer.cmdline_split('say ""')
+
 def test_cmdline_path(nlp):
     nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
     cmdline_tagger = CommandLineTagger(nlp)
@@ -46,6 +59,26 @@ def test_cmdline_path(nlp):
     assert path.text == r'"C:\Program Files\MyProgram.exe"'
     assert path._.stem == r'"?pf64\myprogram.exe"'
     
+def test_cmdline_span_index(nlp):
+    nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    nlp.add_pipe(CommandLineTagger(nlp), last=True)
+    doc = nlp(r'C:\Windows\System32\cmd.exe /c C:\a.exe /q C:\b.txt -v 3')
+
+    def scan(tokens, attr):
+        return [(i, t.i) for i, t in enumerate(tokens) if t._.get(attr)]
+
+    for attr, getter in [('is_path', 'path'), ('is_arg', 'arg'), ('is_val', 'val'), ('is_cmd', 'cmd')]:
+        for tokens in [doc, doc[1:4], doc[4:], doc[2:2], doc[5:6]]:
+            expected = scan(tokens, attr)
+            assert [(i, t.i) for i, t in tokens._.get(getter)] == expected
+            assert tokens._.get('has_' + getter) == bool(expected)
+
+    # Docs that weren't tagged by the component fall back to checking every token
+    untagged = nlp.make_doc(r'C:\a.exe /q')
+    untagged[0]._.is_path = True
+    assert [i for i, t in untagged._.path] == [0]
+    assert untagged[1:]._.has_path == False
+
 def test_cmdline_arg(nlp):
     nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
     cmdline_tagger = CommandLineTagger(nlp)
@@ -119,6 +152,16 @@ def test_cmdline_stemming(nlp):
     assert Sys86._.stems == [r'?sys32']
     assert Sys64._.stems == [r'?sys64']
     
+def test_classify_token():
+    assert classify_token(r'C:\Windows\notepad.exe') == PATH | VAL
+    assert classify_token(r'"C:\Program Files\MyProgram.exe"') == PATH | CMD | VAL
+    assert classify_token(r'\\?\C:\test') == PATH | VAL
+    assert classify_token('/d') == ARG
+    assert classify_token('--file') == ARG
+    assert classify_token('-a b') == 0
+    assert classify_token(r'"C:\Users\Alice\file.txt --file C:\test.py"') == CMD | VAL
+    assert classify_token('|') == 0
+
 def test_cmd_normalization(nlp):
     nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
     cmdline_tagger = CommandLineTagger(nlp)
@@ -151,3 +194,353 @@ def test_windows_commandline_processor_subcmds(nlp):
     assert processor.get_normalized_paths(cmd_line, include_nested_commands=True) == ['"?pf64\\myprogram.exe"', '?usrtmp\\test.exe', '?c\\test.py']
     assert processor.get_normalized_paths(cmd_line, include_nested_commands=False) == ['"?pf64\\myprogram.exe"']    
 
+
+def test_windows_commandline_processor_analyze(nlp):
+    processor = WindowsCommandlineProcessor()
+    cmd_line = r'"C:\Program Files\MyProgram.exe" /d "C:\Users\Alice\appdata\local\temp\test.exe --file C:\test.py"'
+    analysis = processor.analyze(cmd_line)
+    assert analysis['tokens'] == [r'"C:\Program Files\MyProgram.exe"', '/d', r'"C:\Users\Alice\appdata\local\temp\test.exe --file C:\test.py"']
+    assert analysis['args'] == processor.get_args(cmd_line)
+    assert analysis['paths'] == processor.get_paths(cmd_line)
+    assert analysis['normalized_paths'] == processor.get_normalized_paths(cmd_line)
+    assert analysis['normalized'] == processor.normalize(cmd_line)
+    flat = processor.analyze(cmd_line, include_nested_commands=False)
+    assert flat['args'] == processor.get_args(cmd_line, include_nested_commands=False)
+    assert flat['paths'] == processor.get_paths(cmd_line, include_nested_commands=False)
+
+    piped = processor.analyze(r'cmd.exe /c "dir C:\Users | findstr (x)" 2>nul')
+    assert piped['args'] == ['/c']
+    assert piped['normalized'] == r'cmd.exe /c ""dir ?c\users | findstr (x)" 2> nul"'
+    assert processor.analyze('tasklist | findstr x')['normalized'] == 'tasklist | findstr x'
+
+def test_windows_commandline_processor_batch_errors(nlp):
+    processor = WindowsCommandlineProcessor()
+    cmd_lines = ['tasklist | findstr x', 'a.exe "', r'C:\Windows\Syswow64\svchost.exe -k netsvcs']
+    analyses = list(processor.analyze_many(cmd_lines, return_exceptions=True))
+    assert analyses[0] == processor.analyze(cmd_lines[0])
+    assert isinstance(analyses[1], ValueError)
+    assert analyses[2] == processor.analyze(cmd_lines[2])
+    normalized = list(processor.normalize_many(cmd_lines, return_exceptions=True))
+    assert normalized[0] == 'tasklist | findstr x' and isinstance(normalized[1], ValueError)
+    assert normalized[2] == r'?sys32\svchost.exe -k netsvcs'
+    with pytest.raises(ValueError):
+        list(processor.analyze_many(cmd_lines))
+
+def test_windows_commandline_processor_batch(nlp):
+    processor = WindowsCommandlineProcessor()
+    cmd_lines = [
+        r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+        r'C:\Windows\System32\cmd.exe /c C:\Users\Alice\appdata\local\temp\file.txt --file C:\test.py',
+        r'C:\Windows\Syswow64\svchost.exe -k netsvcs',
+    ]
+    normalized = processor.normalize_many(iter(cmd_lines), batch_size=2)
+    assert not isinstance(normalized, list)
+    assert list(normalized) == [processor.normalize(c) for c in cmd_lines]
+    analyses = list(processor.analyze_many(cmd_lines, batch_size=2))
+    assert analyses == [processor.analyze(c) for c in cmd_lines]
+    assert [a['paths'] for a in analyses] == [processor.get_paths(c) for c in cmd_lines]
+
+def test_windows_commandline_processor_parallel(nlp):
+    processor = WindowsCommandlineProcessor()
+    parallel = WindowsCommandlineProcessor(n_process=2)
+    cmd_lines = [
+        r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+        r'C:\Windows\System32\cmd.exe /c C:\Users\Alice\appdata\local\temp\file.txt --file C:\test.py',
+        r'C:\Windows\Syswow64\svchost.exe -k netsvcs',
+    ] * 5
+    assert list(parallel.normalize_many(cmd_lines, batch_size=4)) == list(processor.normalize_many(cmd_lines))
+    assert list(parallel.analyze_many(cmd_lines, batch_size=4)) == list(processor.analyze_many(cmd_lines))
+
+    # A line that can't be parsed doesn't lose the rest of its chunk
+    cmd_lines[5:5] = ['tasklist | findstr x', 'a.exe "']
+    analyses = list(parallel.analyze_many(cmd_lines, batch_size=4, return_exceptions=True))
+    assert isinstance(analyses[6], ValueError)
+    del analyses[6], cmd_lines[6]
+    assert analyses == list(processor.analyze_many(cmd_lines))
+    assert analyses[5]['normalized'] == 'tasklist | findstr x'
+    normalized = parallel.normalize_many(cmd_lines[:5] + ['a.exe "'], batch_size=4)
+    assert next(normalized) == processor.normalize(cmd_lines[0])
+    with pytest.raises(ValueError):
+        list(normalized)
+    parallel.close()
+
+def test_windows_commandline_processor_reuses_pool(nlp):
+    cmd_lines = [r'C:\Windows\System32\svchost.exe -k netsvcs', 'tasklist | findstr x'] * 4
+    with WindowsCommandlineProcessor(n_process=2) as processor:
+        assert processor._pool is None
+        expected = list(processor.normalize_many(cmd_lines, batch_size=2))
+        pool = processor._pool
+        assert list(processor.normalize_many(cmd_lines, batch_size=3)) == expected
+        assert list(processor.analyze_many(cmd_lines[:2]))[1]['normalized'] == 'tasklist | findstr x'
+        assert processor._pool is pool
+    assert processor._pool is None
+    # A closed processor starts a new pool when it is used again
+    assert list(processor.normalize_many(cmd_lines)) == expected
+    processor.close()
+
+def test_windows_commandline_processor_async(nlp):
+    processor = WindowsCommandlineProcessor(async_batch_size=4)
+    cmd_lines = [
+        r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+        r'C:\Windows\System32\cmd.exe /c C:\Users\Alice\appdata\local\temp\file.txt --file C:\test.py',
+        r'C:\Windows\Syswow64\svchost.exe -k netsvcs',
+    ] * 5
+
+    async def stream():
+        for cmd_line in cmd_lines:
+            yield cmd_line
+
+    async def main():
+        normalized = await asyncio.gather(*(processor.anormalize(c) for c in cmd_lines))
+        analyses = [a async for a in processor.aanalyze_many(stream(), include_nested_commands=False)]
+        poisoned = await asyncio.gather(processor.anormalize(cmd_lines[0]),
+                                        processor.anormalize('a.exe "'),
+                                        processor.anormalize('tasklist | findstr x'),
+                                        return_exceptions=True)
+        return normalized, analyses, poisoned
+
+    normalized, analyses, poisoned = asyncio.run(main())
+    processor.close()
+    assert normalized == [processor.normalize(c) for c in cmd_lines]
+    assert poisoned[0] == normalized[0] and isinstance(poisoned[1], ValueError)
+    assert poisoned[2] == 'tasklist | findstr x'
+    assert analyses == [processor.analyze(c, include_nested_commands=False) for c in cmd_lines]
+
+def test_micro_batcher():
+    calls = []
+
+    def upper(items):
+        calls.append(len(items))
+        if 'fail' in items:
+            raise ValueError('bad batch')
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(upper, max_batch_size=3, max_pending=3)
+
+    async def main():
+        results = await asyncio.gather(*(batcher.submit(s) for s in 'abcdefg'))
+        streamed = [r async for r in batcher.map(iter('hijk'))]
+        with pytest.raises(ValueError):
+            await batcher.submit('fail')
+        # Only the caller of the bad item gets its exception
+        mixed = await asyncio.gather(*(batcher.submit(s) for s in ['x', 'fail', 'y']),
+                                     return_exceptions=True)
+        return results, streamed, mixed
+
+    results, streamed, mixed = asyncio.run(main())
+    batcher.close()
+    assert results == list('ABCDEFG')
+    assert streamed == list('HIJK')
+    assert mixed[0] == 'X' and isinstance(mixed[1], ValueError) and mixed[2] == 'Y'
+    assert max(calls) == 3
+    assert batcher.items == 13
+
+    with pytest.raises(ValueError):
+        MicroBatcher(upper, max_batch_size=4, max_pending=2)
+
+def test_micro_batcher_event_loops():
+    batcher = MicroBatcher(lambda items: [item.upper() for item in items], max_batch_size=2)
+    processor = WindowsCommandlineProcessor(async_batch_size=2)
+    cmd_lines = [r'C:\Windows\System32\cmd.exe /c C:\test.py', r'C:\Users\Alice\a.exe'] * 3
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit(s) for s in 'abcdefg'))
+        normalized = await asyncio.gather(*(processor.anormalize(c) for c in cmd_lines))
+        return results, normalized
+
+    async def main():
+        return await asyncio.wait_for(run(), 10)
+
+    # Each asyncio.run has its own event loop
+    first = asyncio.run(main())
+    second = asyncio.run(main())
+    batcher.close()
+    processor.close()
+    assert first == second
+    assert first[0] == list('ABCDEFG')
+    assert first[1] == [processor.normalize(c) for c in cmd_lines]
+
+def test_windows_commandline_processor_n_process(nlp):
+    with pytest.raises(ValueError):
+        WindowsCommandlineProcessor(n_process=0)
+
+def test_windows_commandline_processor_cache(nlp):
+    processor = WindowsCommandlineProcessor(cache_size=2)
+    cmd_line = r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py'
+    normalized = processor.normalize(cmd_line)
+    assert processor.get_paths(cmd_line) == ['"C:\\Program Files\\MyProgram.exe"', 'C:\\Users\\Alice\\file.txt', 'C:\\test.py']
+    assert processor.get_normalized_paths(cmd_line) == ['"?pf64\\myprogram.exe"', '?usr\\file.txt', '?c\\test.py']
+    processor.get_args(cmd_line).append('mutated')
+    assert processor.get_args(cmd_line) == ["/d", "--file"]
+    assert processor.normalize(cmd_line) == normalized
+    info = processor.cache_info()
+    assert (info['hits'], info['misses'], info['evictions'], info['size']) == (5, 1, 0, 1)
+
+    list(processor.normalize_many([r'C:\a.exe', r'C:\b.exe', r'C:\a.exe']))
+    info = processor.cache_info()
+    assert (info['misses'], info['evictions'], info['size']) == (3, 1, 2)
+    assert WindowsCommandlineProcessor(cache_size=0).cache_info() is None
+
+def test_windows_commandline_processor_operators(nlp):
+    # Pipes, redirections and parentheses are unclassified tokens
+    for cache_size in (0, 1024):
+        processor = WindowsCommandlineProcessor(cache_size=cache_size)
+        cmd_line = 'foo.exe a|b>c 2>nul'
+        assert processor.get_args(cmd_line) == []
+        assert processor.get_paths(cmd_line) == []
+        assert processor.get_normalized_paths(cmd_line) == []
+        assert processor.normalize(cmd_line) == 'foo.exe a | b > c 2> nul'
+
+        cmd_line = r'powershell.exe -c "(Get-Item C:\Users\bob\x.txt) | Out-File C:\tmp\y"'
+        assert processor.get_args(cmd_line) == ['-c']
+        assert processor.get_paths(cmd_line) == [r'C:\Users\bob\x.txt)', r'C:\tmp\y']
+        assert processor.get_normalized_paths(cmd_line) == [r'?usr\x.txt)', r'?c\tmp\y']
+        assert processor.get_paths(cmd_line, include_nested_commands=False) == []
+        assert processor.normalize(cmd_line) == \
+            r'powershell.exe -c "(Get-Item ?usr\x.txt) | Out-File ?c\tmp\y"'
+
+def test_lru_cache_policies():
+    from cyberspacy.cache import LRUCache
+    lru = LRUCache(2)
+    fifo = LRUCache(2, policy='fifo')
+    for cache in (lru, fifo):
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+    assert 'a' in lru and 'b' not in lru
+    assert 'a' not in fifo and 'b' in fifo
+    with pytest.raises(ValueError):
+        LRUCache(2, policy='random')
+
+def test_lru_cache_threads():
+    import threading
+    from cyberspacy.cache import LRUCache
+    cache = LRUCache(8)
+    errors = []
+
+    def hammer(seed):
+        try:
+            for i in range(20000):
+                key = (seed * i) % 13
+                if cache.get(key) is None:
+                    cache.put(key, i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(seed,)) for seed in (1, 3, 5, 7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    info = cache.info()
+    assert info['hits'] + info['misses'] == 80000
+    assert info['size'] == 8
+
+def test_normalize_path_matches_sequential_rules():
+    import re
+    from cyberspacy.stemmer import NormalizeWinPath
+    normalizer = NormalizeWinPath('x86_64')
+    paths = [
+        r'C:\Windows\System32\svchost.exe', r'C:\Windows\SysWOW64\rundll32.exe',
+        r'"C:\Program Files (x86)\App\app.exe"', r'"C:\Program Files\App\app.exe"',
+        r'C:\Users\Alice\AppData\Local\Temp\x.exe', r'C:\Users\Alice\x.txt',
+        r'\??\C:\Windows\notepad.exe', r'\\?\C:\test', r'C:\Windows\test C:\test',
+        r'\?\Volume{26a21bda-a627-11d7-9931-806e6f6e6963}', r'D:\data\{26A21BDA-A627-11D7-9931-806E6F6E6963}',
+        r'C:\Windows', r'c:\\', r'relative\path', '',
+        # Matches of different rules overlap
+        r'C:\Users\c:\Windows\System32\x', r'{12345678-1234-1234-1234-12345678901c:\windows\x',
+        # A later rule matches across the edge of an earlier replacement
+        r'C:\Users\bob\??\C:\Windows\x', r'C:\users\ (x86)\??\C:\ (x86)',
+    ]
+    for path in paths:
+        expected = path
+        for rule in normalizer.rules:
+            expected = re.sub(rule['regex'], rule['replacement'], expected.lower())
+        assert normalizer.normalize_path(path) == expected
+    assert normalizer.normalize_path(paths[-4]) == r'?usr\x'
+    assert normalizer.normalize_path(paths[-3]) == r'{12345678-1234-1234-1234-12345678901?win\x'
+    assert normalizer.normalize_path(paths[-2]) == r'?usr?win\x'
+    assert normalizer.normalize_path(paths[-1]) == r'?usr?c\ (x86)'
+
+def test_normalizer_rules_per_architecture():
+    from cyberspacy.stemmer import NormalizeWinPath
+    x86_64 = NormalizeWinPath('x86_64')
+    x86 = NormalizeWinPath('x86')
+    for _ in range(5):
+        NormalizeWinPath('x86_64')
+    assert len(NormalizeWinPath('x86_64').rules) == len(x86_64.rules) == 9
+    assert NormalizeWinPath('x86_64').rules is x86_64.rules
+    assert len(x86.rules) == 7
+    assert x86_64.normalize_path(r'C:\Windows\System32\cmd.exe') == r'?sys64\cmd.exe'
+    assert x86.normalize_path(r'C:\Windows\System32\cmd.exe') == r'?sys32\cmd.exe'
+    assert x86.normalize_path(r'C:\Program Files\app.exe') == r'?pf86\app.exe'
+    assert NormalizeWinPath.settings.get('architecture') is None
+    with pytest.raises(TypeError):
+        x86.rules[0]['replacement'] = '?x'
+    with pytest.raises(ValueError):
+        NormalizeWinPath('arm64')
+
+def test_compiled_rule_sets_are_bounded():
+    from cyberspacy.stemmer import NormalizeWinPath
+    maxsize = NormalizeWinPath._compiled.maxsize
+    for i in range(maxsize * 2):
+        rules = [{'regex': f'tenant{i}', 'replacement': '?tenant'}]
+        assert NormalizeWinPath(rules=rules).normalize_path(f'C:\\tenant{i}') == r'?c\?tenant'
+    assert len(NormalizeWinPath._compiled) == maxsize
+    # Evicted rule sets are compiled again
+    assert NormalizeWinPath(rules=[{'regex': 'tenant0', 'replacement': '?t'}]).normalize_path('tenant0') == '?t'
+
+def test_normalize_paths():
+    from cyberspacy.stemmer import NormalizeWinPath
+    paths = [r'C:\Windows\System32\cmd.exe', r'C:\Users\Alice\a.txt', None,
+             r'C:\Windows\System32\cmd.exe', r'D:\data.zip']
+    normalizer = NormalizeWinPath('x86_64')
+    assert normalizer.normalize_paths(iter(paths)) == \
+        [r'?sys64\cmd.exe', r'?usr\a.txt', None, r'?sys64\cmd.exe', r'd:\data.zip']
+    # Each distinct path is only normalized once
+    assert normalizer.cache_info()['misses'] == 3
+    assert normalizer.cache_info()['hits'] == 0
+    assert NormalizeWinPath('x86_64', cache_size=0).cache_info() is None
+    assert NormalizeWinPath('x86_64', cache_size=0).normalize_paths(paths[:2]) == [r'?sys64\cmd.exe', r'?usr\a.txt']
+
+    pd = pytest.importorskip('pandas')
+    series = pd.Series(paths, index=list('abcde'), name='path')
+    normalized = normalizer.normalize_paths(series)
+    assert list(normalized.index) == list('abcde') and normalized.name == 'path'
+    assert normalized['d'] == r'?sys64\cmd.exe'
+    assert list(normalizer.normalize_paths(series.to_numpy())) == list(normalized)
+
+def test_tagger_uses_path_cache(nlp):
+    nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    tagger = CommandLineTagger(nlp)
+    nlp.add_pipe(tagger)
+    for _ in range(3):
+        nlp(r'C:\Windows\System32\svchost.exe -k netsvcs')
+    assert tagger.normalizer.cache_info()['misses'] == 1
+    assert tagger.normalizer.cache_info()['hits'] == 2
+
+def test_sub_cmd_parsed_once():
+    processor = WindowsCommandlineProcessor(cache_size=0)
+    tokenizer = processor.nlp.tokenizer
+    calls = []
+
+    def counting_tokenizer(text):
+        calls.append(text)
+        return tokenizer(text)
+
+    processor.nlp.tokenizer = counting_tokenizer
+    cmd_line = r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\file.exe --file C:\test.py"'
+    doc = processor.nlp(cmd_line)
+    assert len(calls) == 1
+    sub_cmd = doc[2]._.sub_cmd
+    assert doc[2]._.sub_cmd is sub_cmd
+    assert doc._.normalize == r'?sys64\cmd.exe /c "?usr\file.exe --file ?c\test.py"'
+    assert len(calls) == 2
+    assert doc[0]._.sub_cmd is None
+
+    # The processor parses with cyberspacy.core and never goes through nlp
+    del calls[:]
+    processor.analyze(cmd_line)
+    assert calls == []
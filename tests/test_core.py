@@ -0,0 +1,135 @@
+from spacy.lang.xx import Language
+import pytest
+
+import random
+import re
+import time
+
+from cyberspacy.core import parse_cmdline, ParsedCommandLine, PATH, ARG, CMD, VAL, MAX_NESTING_DEPTH
+from cyberspacy.core import classify_token, cmd_re, is_path_text, path_re, _search_quoted_path
+from cyberspacy.tokenizer import CommandLineTokenizer
+from cyberspacy.tagger import CommandLineTagger
+
+CMD_LINES = [
+    r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+    r'"C:\Program Files\MyProgram.exe" /d "C:\Users\Alice\appdata\local\temp\file.txt --file C:\test.py" -f C:\Users\Bob\file',
+    r'C:\Windows\System32\cmd.exe /c C:\Users\Alice\appdata\local\temp\file.txt --file C:\test.py',
+    r'C:\Windows\System32\cmd.exe /c "C:\Windows\System32\cmd.exe /k ""C:\x.exe"" /q"',
+    r'\??\C:\Windows\system32\conhost.exe 0xffffffff -ForceV1',
+    r'tasklist | findstr x 2>nul',
+    r'powershell.exe -c "(Get-Item C:\Users\bob\x.txt) | Out-File C:\tmp\y"',
+]
+
+@pytest.fixture(scope='module')
+def nlp():
+    nlp = Language()
+    nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    nlp.add_pipe(CommandLineTagger(nlp), last=True)
+    return nlp
+
+def test_parse_cmdline():
+    parsed = parse_cmdline(r'"C:\Program Files\MyProgram.exe" /d "C:\Users\Alice\file.txt --file C:\test.py"')
+    assert isinstance(parsed, ParsedCommandLine)
+    assert not hasattr(parsed, '__dict__')
+    assert len(parsed) == 3
+    assert parsed.kinds == [PATH, ARG, CMD | VAL]
+    assert parsed.stems == [r'"?pf64\myprogram.exe"', '/d', r'"C:\Users\Alice\file.txt --file C:\test.py"']
+    assert parsed.sub_cmd(0) is None
+    assert parsed.sub_cmd(2) is parsed.sub_cmd(2)
+    assert parsed.sub_cmd(2).tokens == [r'C:\Users\Alice\file.txt', '--file', r'C:\test.py']
+    assert parsed.normalize() == r'"?pf64\myprogram.exe" /d "?usr\file.txt --file ?c\test.py"'
+    assert parsed.args() == ['/d', '--file']
+    assert parsed.args(include_nested_commands=False) == ['/d']
+    assert parsed.normalized_paths() == [r'"?pf64\myprogram.exe"', r'?usr\file.txt', r'?c\test.py']
+
+def test_normalize_unclassified_tokens():
+    parsed = parse_cmdline(r'C:\Windows\System32\cmd.exe /c "dir C:\Users\bob | findstr (x)"')
+    assert parse_cmdline('tasklist | findstr x').stems[1] is None
+    assert parse_cmdline('tasklist | findstr x').normalize() == 'tasklist | findstr x'
+    assert parsed.normalize() == r'?sys64\cmd.exe /c "dir ?c\users\bob | findstr (x)"'
+
+def test_parse_cmdline_architecture():
+    assert parse_cmdline(r'C:\Windows\System32\cmd.exe', 'x86').stems == [r'?sys32\cmd.exe']
+    assert parse_cmdline(r'C:\Windows\System32\cmd.exe').stems == [r'?sys64\cmd.exe']
+
+@pytest.mark.parametrize('cmd_line', CMD_LINES)
+def test_parse_cmdline_matches_doc(nlp, cmd_line):
+    doc = nlp(cmd_line)
+    parsed = parse_cmdline(cmd_line)
+    assert parsed.tokens == doc._.tokens
+    assert parsed.stems == doc._.stems
+    assert parsed.normalize() == doc._.normalize
+    for i, token in enumerate(doc):
+        kind = parsed.kinds[i]
+        assert (bool(kind & PATH), bool(kind & ARG), bool(kind & CMD), bool(kind & VAL)) == \
+            (token._.is_path, token._.is_arg, token._.is_cmd, token._.is_val)
+
+def test_lazy_package_attributes():
+    import cyberspacy
+    from cyberspacy.tagger import IPTagger
+    assert cyberspacy.IPTagger is IPTagger
+    assert 'WindowsCommandlineProcessor' in dir(cyberspacy)
+    with pytest.raises(AttributeError):
+        cyberspacy.NotATagger
+
+def test_core_does_not_import_spacy():
+    import subprocess, sys
+    code = ("import sys, cyberspacy.core; "
+            "from cyberspacy import WindowsCommandlineProcessor; "
+            r"WindowsCommandlineProcessor().normalize(r'C:\Windows\notepad.exe'); "
+            "sys.exit('spacy' in sys.modules)")
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
+
+# The patterns before they were rewritten to avoid catastrophic backtracking
+ORIGINAL_PATH_RE = re.compile(r"""(\\\?\?\\[^ ]+|\\\?\\[^ ]+)|("(([a-zA-Z]:)|([a-zA-Z]:\\Program Files \(x86\)))([^\"\s])+(\s((\S+\\)+\S*))*"|^[a-zA-Z]?:[^ ]+)""")
+ORIGINAL_QUOTED_PATH_RE = re.compile(r"""("(([a-zA-Z]:)|([a-zA-Z]:\\Program Files \(x86\)))([^\"\s])+(\s((\S+\\)+\S*))*")""")
+ORIGINAL_CMD_RE = re.compile(r"""(".*")""")
+
+def test_patterns_match_original():
+    rng = random.Random(0)
+    pieces = ['"', 'C:', '\\', ' ', '  ', 'a', '\\Program Files (x86)', ' Files', '\n', '\xa0',
+              '\\??\\', '\\?\\', ':', 'x', '"C:', '"C:\\Program Files (x86)']
+    for _ in range(20000):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+        assert bool(path_re.search(text)) == bool(ORIGINAL_PATH_RE.search(text)), text
+        assert _search_quoted_path(text) == bool(ORIGINAL_QUOTED_PATH_RE.search(text)), text
+        assert bool(cmd_re.search(text)) == bool(ORIGINAL_CMD_RE.search(text)), text
+
+@pytest.mark.parametrize('text', [
+    '"C:a ' + 'a\\' * 5000 + ' ',
+    '"C:a ' + ('a\\' * 5000 + ' ') * 3,
+    '"C:\\a ' * 2000,
+    '"' + 'a' * 20000,
+    '"\n' * 10000,
+    'a "b ' * 800 + 'c"' * 800,
+])
+def test_adversarial_tokens(text):
+    start = time.perf_counter()
+    is_path_text(text)
+    classify_token(text)
+    parse_cmdline(text).normalize()
+    assert time.perf_counter() - start < 1
+
+def test_max_token_length():
+    path = 'C:\\' + 'a\\' * 100
+    parsed = parse_cmdline(f'tool.exe {path} /q', max_token_length=50)
+    assert parsed.kinds == [0, 0, ARG]
+    assert parsed.normalize() == f'tool.exe {path} /q'
+    assert parse_cmdline(f'tool.exe {path}').kinds[1] == PATH | VAL
+    assert parse_cmdline(f'tool.exe {path}', max_token_length=None).kinds[1] == PATH | VAL
+
+def test_max_nesting_depth(nlp):
+    cmd_line = 'a "b ' * (MAX_NESTING_DEPTH + 4) + 'c' + '"' * (MAX_NESTING_DEPTH + 4)
+    parsed = parse_cmdline(cmd_line)
+    doc = nlp(cmd_line)
+    for depth in range(MAX_NESTING_DEPTH):
+        assert parsed.depth == depth
+        parsed = parsed.sub_cmd(len(parsed) - 1)
+        doc = doc[len(doc) - 1]._.sub_cmd
+    assert parsed.depth == MAX_NESTING_DEPTH
+    assert parsed.kinds[-1] & CMD
+    assert parsed.sub_cmd(len(parsed) - 1) is None
+    assert doc[len(doc) - 1]._.is_cmd
+    assert doc[len(doc) - 1]._.sub_cmd is None
+    assert parsed.normalize() == doc._.normalize == parsed.text
+    assert parse_cmdline(cmd_line).normalize() == nlp(cmd_line)._.normalize == cmd_line
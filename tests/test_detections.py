@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 from spacy.lang.en import English
 import pytest
 
-from cyberspacy import IPTagger, URLTagger, EmailTagger
+from cyberspacy import IPTagger, IPv6Tagger, URLTagger, EmailTagger, IOCTagger
 
 @pytest.fixture(scope='function')
 def nlp():
@@ -15,6 +15,11 @@ def test_ip_integration(nlp):
     nlp.add_pipe(Tagger, last=True)
     assert nlp.pipe_names[-1] == 'ip_tagger'
 
+def test_ipv6_integration(nlp):
+    Tagger = IPv6Tagger(nlp, force_extension=True)
+    nlp.add_pipe(Tagger, last=True)
+    assert nlp.pipe_names[-1] == 'ipv6_tagger'
+
 def test_url_integration(nlp):
     Tagger = URLTagger(nlp, force_extension=True)
     nlp.add_pipe(Tagger, last=True)
@@ -26,6 +31,11 @@ def test_email_integration(nlp):
     assert nlp.pipe_names[-1] == 'email_addr_tagger'
 
 
+def test_ioc_integration(nlp):
+    Tagger = IOCTagger(nlp, force_extension=True)
+    nlp.add_pipe(Tagger, last=True)
+    assert nlp.pipe_names[-1] == 'ioc_tagger'
+
 def test_ip_Tagger(nlp):
     ip_Tagger = IPTagger(nlp, force_extension=True)
     nlp.add_pipe(ip_Tagger, first=True)
@@ -38,6 +48,41 @@ def test_ip_Tagger(nlp):
     assert idx == 6
     assert ipv4_token.text == '2.3.4.5'
 
+def test_ipv6_Tagger(nlp):
+    ipv6_Tagger = IPv6Tagger(nlp, force_extension=True, token_match=True)
+    nlp.add_pipe(ipv6_Tagger, first=True)
+    doc = nlp(u'This is a sentence which contains 2001:db8::1 as an IP address, not 10:30 or cafe::babe::1')
+    assert doc._.has_ipv6 == True
+    assert doc[0]._.is_ipv6 == False
+    assert doc[6]._.is_ipv6 == True
+    assert len(doc._.ipv6) == 1
+    idx, ipv6_token = doc._.ipv6[0]
+    assert idx == 6
+    assert ipv6_token.text == '2001:db8::1'
+    assert ipv6_token.lemma_ == '2001:0db8:0000:0000:0000:0000:0000:0001'
+
+def test_ipv6_forms(nlp):
+    ipv6_Tagger = IPv6Tagger(nlp, force_extension=True)
+    for text in ['::1', 'fe80::1ff:fe23:4567:890a', '::ffff:10.0.0.1', '2001:DB8:0:0:8:800:200C:417A']:
+        assert ipv6_Tagger.is_ipv6_text(text)
+    for text in ['10:30', 'deadbeef', 'cafe::babe::1', '1:2:3:4:5:6:7:8:9', 'cafe:babe']:
+        assert not ipv6_Tagger.is_ipv6_text(text)
+
+def test_ipv6_stemming(nlp):
+    ipv6_Tagger = IPv6Tagger(nlp, force_extension=True, hextets_to_keep=4, token_match=True)
+    nlp.add_pipe(ipv6_Tagger, first=True)
+    doc = nlp(u'Traffic from fe80::1ff:fe23:4567:890a was blocked')
+    idx, ipv6_token = doc._.ipv6[0]
+    assert ipv6_token.lemma_ == 'fe80:0000:0000:0000'
+
+def test_ipv6_token_match_is_opt_in(nlp):
+    text = 'Traffic from 2001:db8::1 was blocked'
+    tokens = [t.text for t in nlp(text)]
+    IPv6Tagger(nlp, force_extension=True)
+    assert [t.text for t in nlp(text)] == tokens
+    IPv6Tagger(nlp, force_extension=True, token_match=True)
+    assert [t.text for t in nlp(text)] == ['Traffic', 'from', '2001:db8::1', 'was', 'blocked']
+
 def test_url_Tagger(nlp):
     url_Tagger = URLTagger(nlp, force_extension=True)
     nlp.add_pipe(url_Tagger, first=True)
@@ -63,6 +108,87 @@ def test_email_Tagger(nlp):
     assert idx == 6
     assert url_token.text == 'test@example.com'    
 
+def test_prefilters_match_regex(nlp):
+    import re
+    from cyberspacy.expressions import ipv4_expr, url_expr, email_expr
+
+    checks = [
+        (IPTagger(nlp, force_extension=True, max_length=None).is_ipv4_text, ipv4_expr),
+        (URLTagger(nlp, force_extension=True, max_length=None).is_url_text, url_expr),
+        (EmailTagger(nlp, force_extension=True, max_length=None).is_email_addr_text, email_expr),
+    ]
+    texts = ['', 'the', '2.3.4.5', '2.3.4.5:80/x', '10.0.0', 'HTTPS://Example.com', 'ftp://host',
+             'httpſ://example.com', '~/docs', 'WWW.example.com', 'user@host', 'a@b.co', '@b.co',
+             'a@b@c.com', 'v1.2.3.4', '٣.٤.٥.٦', 'wwwx.com', 'hello@']
+    for check, expr in checks:
+        regex = re.compile(expr, re.VERBOSE | re.I | re.UNICODE)
+        for text in texts:
+            assert check(text) == bool(regex.match(text)), text
+
+def test_url_expr_matches_original():
+    import random
+    import re
+    from cyberspacy.expressions import url_expr
+
+    # url_expr before its nested quantifiers were flattened
+    original = re.compile(r"""
+        (?:(?:(?:(?:
+          (?:ht|f)tp(?:s?)://|~/)
+          (?:[-;:&=+$,\w'.]+@)?
+          (?:[A-Za-z0-9.-:]+))
+          |(?:(?:www\.|[-;:&=+$,\w'.]+@)
+          (?:[A-Za-z0-9.-:]+))|
+          (?:(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})))
+          (?:[-\w~!$+|.,=/\?'#%*:&@;]*))
+        """, re.VERBOSE | re.I | re.UNICODE)
+    regex = re.compile(url_expr, re.VERBOSE | re.I | re.UNICODE)
+    rng = random.Random(0)
+    pieces = ['http://', 'ftps://', '~/', 'www.', '@', 'a', 'K', '1.2.3.4', '.', ':', '/', '-',
+              'ſ', ' ', '!', '?x=1']
+    for _ in range(20000):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 6)))
+        expected = original.match(text)
+        match = regex.match(text)
+        assert (match and match.span()) == (expected and expected.span()), text
+
+def test_max_length(nlp):
+    url = 'https://example.com/' + 'a' * 100
+    assert URLTagger(nlp, force_extension=True).is_url_text(url)
+    assert not URLTagger(nlp, force_extension=True, max_length=50).is_url_text(url)
+    assert not EmailTagger(nlp, force_extension=True, max_length=10).is_email_addr_text('test@example.com')
+    assert not IPTagger(nlp, force_extension=True, max_length=6).is_ipv4_text('2.3.4.5')
+
+def test_ioc_Tagger(nlp):
+    ioc_Tagger = IOCTagger(nlp, force_extension=True, subnets_to_keep=3)
+    nlp.add_pipe(ioc_Tagger, first=True)
+    doc = nlp(u'Mail test@example.com about https://example.com/a and 2.3.4.5')
+    assert doc[1]._.is_email_addr == True
+    assert doc[1]._.is_ipv4 == False
+    assert doc[3]._.is_url == True
+    assert doc[3].lemma_ == 'example.com'
+    # 2.3.4.5 is also matched by url_expr, the IPv4 lemma takes precedence
+    assert doc[5]._.is_ipv4 == True
+    assert doc[5]._.is_url == True
+    assert doc[5].lemma_ == '2.3.4'
+    assert [i for i, t in doc._.ipv4] == [5]
+    assert doc[0:2]._.has_email_addr == True
+    assert doc[0:1]._.has_url == False
+
+def test_ioc_matches_stacked_taggers():
+    texts = [u'Mail test@example.com about https://example.com/a and 2.3.4.5',
+             u'Nothing to see here', u'www.example.org and ftp://10.0.0.1/x and a@b.co']
+
+    stacked = English()
+    for Tagger in (IPTagger, URLTagger, EmailTagger):
+        stacked.add_pipe(Tagger(stacked, force_extension=True), last=True)
+    single = English()
+    single.add_pipe(IOCTagger(single, force_extension=True))
+
+    def annotations(nlp):
+        return [(t.text, t.lemma_, t._.is_ipv4, t._.is_url, t._.is_email_addr)
+                for doc in nlp.pipe(texts) for t in doc]
+    assert annotations(single) == annotations(stacked)
+
 def test_ip_stemming(nlp):
     ip_Tagger = IPTagger(nlp, force_extension=True, subnets_to_keep=3)
     nlp.add_pipe(ip_Tagger, first=True)
@@ -77,3 +203,9 @@ def test_subnet_range(nlp):
     with pytest.raises(ValueError):
         ip_Tagger = IPTagger(nlp, force_extension=True, subnets_to_keep=5)
 
+def test_hextet_range(nlp):
+    with pytest.raises(ValueError):
+        IPv6Tagger(nlp, force_extension=True, hextets_to_keep=0)
+
+    with pytest.raises(ValueError):
+        IPv6Tagger(nlp, force_extension=True, hextets_to_keep=9)
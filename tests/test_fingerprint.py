@@ -0,0 +1,63 @@
+import pytest
+
+from cyberspacy.core import parse_cmdline
+from cyberspacy.fingerprint import (TemplateIndex, fingerprint, hamming, minhash, similarity,
+                                    simhash, skeleton, template_tokens, WILDCARD)
+from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.rules import RuleSet
+
+
+def test_template_tokens():
+    tokens = template_tokens(parse_cmdline(r'C:\Windows\System32\cmd.exe /c "C:\a.exe -k Netsvcs"'))
+    assert tokens == ['1:?sys64\\cmd.exe', '2:/c', '4:"', '1:?c\\a.exe', '2:-k', '8:netsvcs', '4:"']
+    assert skeleton(tokens)[-2] == WILDCARD
+    long_token = template_tokens(parse_cmdline('tool.exe ' + 'x' * 10000))[1]
+    assert long_token.startswith('8:')
+
+def test_signatures():
+    a = template_tokens(parse_cmdline(r'C:\Windows\System32\svchost.exe -k netsvcs -p'))
+    b = template_tokens(parse_cmdline(r'c:\windows\system32\SVCHOST.EXE -k netsvcs -p'))
+    c = template_tokens(parse_cmdline(r'C:\Windows\System32\svchost.exe -k LocalService -p'))
+    d = template_tokens(parse_cmdline(r'"C:\Program Files\App\app.exe" --type=renderer'))
+    # Stable across processes: blake2b, not the salted built-in hash
+    assert fingerprint(a) == fingerprint(b) == 0xac5811011248ca43
+    assert fingerprint(a) != fingerprint(c)
+    assert similarity(minhash(a), minhash(b)) == 1.0
+    assert similarity(minhash(a), minhash(c)) > similarity(minhash(a), minhash(d))
+    assert hamming(simhash(a), simhash(c)) < hamming(simhash(a), simhash(d))
+    assert len(minhash([], num_perm=32)) == 32
+
+def test_template_index():
+    index = TemplateIndex()
+    services = [index.add(rf'C:\Windows\System32\svchost.exe -k {name} -p')
+                for name in ('netsvcs', 'LocalService', 'DcomLaunch', 'netsvcs')]
+    browser = index.add(r'"C:\Program Files\App\app.exe" --type=renderer --no-sandbox '
+                        r'--disable-gpu --enable-logging --log-level=0 --lang=en')
+    nested = index.add(r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\a.exe /q"')
+    assert len(index) == 3
+    assert all(template is services[0] for template in services)
+    assert services[0].count == 4
+    assert services[0].text == r'?sys64\svchost.exe -k <*> -p'
+    assert nested.text == r'?sys64\cmd.exe /c " ?usr\a.exe /q "'
+    assert [t.id for t in index.most_common(2)] == [services[0].id, browser.id]
+    assert index[browser.id] is browser
+    assert services[0].to_dict()['example'] == r'C:\Windows\System32\svchost.exe -k netsvcs -p'
+
+    # Near duplicates are found through LSH, without adding them
+    template, score = index.match(r'"C:\Program Files\App\app.exe" --type=renderer --no-sandbox '
+                                  r'--disable-gpu --enable-logging --log-level=0 --lang=de')
+    assert template is browser and score >= index.threshold
+    assert index.match(r'D:\tools\other.exe /x /y /z') is None
+    assert len(index) == 3 and browser.count == 1
+    assert list(index.add_many([r'C:\Windows\System32\svchost.exe -k x -p'])) == [services[0]]
+
+    with pytest.raises(ValueError):
+        TemplateIndex(num_perm=64, bands=10)
+
+def test_template_index_processor():
+    processor = WindowsCommandlineProcessor(rules=RuleSet.extended())
+    index = TemplateIndex(processor=processor, fingerprint_cache_size=0)
+    a = index.add(r'C:\ProgramData\App\app.exe /q')
+    assert a.text == r'?progdata\app\app.exe /q'
+    assert index.add(parse_cmdline(r'C:\ProgramData\App\app.exe /q', normalizer=processor.normalizer)) is a
+    assert a.count == 2
@@ -0,0 +1,73 @@
+import json
+
+from spacy.lang.en import English
+from spacy.lang.xx import Language
+
+from cyberspacy import instrument
+from cyberspacy.core import cmdline_split
+from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.tagger import CommandLineTagger, IOCTagger
+from cyberspacy.tokenizer import CommandLineTokenizer
+
+
+def test_instrument_processor():
+    processor = WindowsCommandlineProcessor(cache_size=0)
+    cmd_lines = [r'C:\Windows\System32\svchost.exe -k netsvcs',
+                 r'C:\Windows\System32\cmd.exe /c "C:\a.exe /q"',
+                 'x' * 5000]
+
+    with instrument.enabled(top_n=2, max_input_length=100):
+        assert instrument.is_enabled()
+        normalized = [processor.normalize(c) for c in cmd_lines[:2]]
+        processor.get_args(cmd_lines[2])
+    assert not instrument.is_enabled()
+    assert normalized == [processor.normalize(c) for c in cmd_lines[:2]]
+
+    stats = instrument.snapshot()
+    json.dumps(stats)
+    parse = stats['stages']['parse_cmdline']
+    assert parse['count'] == 3
+    assert sum(parse['histogram'].values()) + parse['histogram_overflow'] == 3
+    assert len(parse['slowest']) == 2
+    assert parse['slowest'][0]['seconds'] >= parse['slowest'][1]['seconds']
+    assert parse['p50_us'] <= parse['max_us']
+    long_input = [s for s in parse['slowest'] if s['length'] == 5000]
+    assert not long_input or long_input[0]['input'] == 'x' * 100
+    assert stats['stages']['sub_cmd']['count'] >= 1
+    assert {'cmdline_split', 'tag_tokens', 'normalize_path'} <= set(stats['stages'])
+
+    # Disabled: nothing more is recorded and the original functions are back
+    processor.normalize(cmd_lines[0])
+    assert instrument.snapshot()['stages']['parse_cmdline']['count'] == 3
+    assert instrument.format_snapshot().splitlines()[0].startswith('stage')
+
+
+def test_instrument_restores_functions():
+    from cyberspacy import core
+
+    original = core.cmdline_split
+    instrument.enable()
+    assert core.cmdline_split is not original
+    instrument.reset()
+    assert instrument.snapshot()['stages'] == {}
+    instrument.disable()
+    assert core.cmdline_split is original is cmdline_split
+
+
+def test_instrument_pipelines():
+    with instrument.enabled():
+        nlp = Language()
+        nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+        nlp.add_pipe(CommandLineTagger(nlp, force_extension=True))
+        nlp(r'C:\Windows\System32\cmd.exe /c "C:\a.exe /q"')._.normalize
+
+        english = English()
+        english.add_pipe(IOCTagger(english, force_extension=True))
+        english('Contact admin@example.com at 10.0.0.1')
+
+    stages = instrument.snapshot()['stages']
+    assert stages['cmdline_tagger']['count'] == 2
+    assert stages['sub_cmd']['count'] >= 1
+    assert stages['ioc_tagger']['count'] == 1
+    assert stages['ioc_flag']['count'] >= 1
+    assert stages['cmdline_tagger']['slowest'][0]['input'] is not None
@@ -0,0 +1,168 @@
+import json
+import random
+import re
+
+import pytest
+
+from cyberspacy.core import parse_cmdline
+from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.rules import RuleSet
+from cyberspacy.stemmer import NormalizeWinPath
+
+
+def test_rule_set():
+    rules = RuleSet().add('a', 'b', name='first').add('c', 'd', priority=5)
+    assert len(rules) == 2
+    assert 'first' in rules and 'rule1' in rules
+    assert [rule['name'] for rule in rules] == ['rule1', 'first']
+    rules.remove('rule1')
+    assert [rule['name'] for rule in rules] == ['first']
+    assert rules.add('e', 'f')._rules[-1]['name'] == 'rule2'
+    with pytest.raises(KeyError):
+        rules.remove('rule1')
+    with pytest.raises(ValueError):
+        rules.add('x', 'y', name='first')
+    with pytest.raises(ValueError):
+        rules.add('(', 'y')
+    with pytest.raises(ValueError):
+        rules.add('(?P<name>x)', 'y')
+    with pytest.raises(ValueError):
+        rules.add('x', r'\1')
+    with pytest.raises(ValueError):
+        RuleSet([{'regex': 'x', 'replacement': 'y', 'flags': 'i'}])
+    with pytest.raises(TypeError):
+        rules._rules[0]['regex'] = 'z'
+    with pytest.raises(ValueError):
+        NormalizeWinPath(rules=RuleSet().add('${nope}', 'x'))
+    with pytest.raises(ValueError):
+        NormalizeWinPath(rules=RuleSet().add(r'(a)\1', 'x'))
+
+def test_rule_set_files(tmp_path):
+    rules = RuleSet().add(r'${systemdrive}programdata\\', r'?progdata\\', name='programdata')
+    path = tmp_path / 'rules.json'
+    path.write_text(rules.to_json())
+    assert RuleSet.from_file(path).to_dict() == rules.to_dict()
+    assert RuleSet.from_dict(json.loads(rules.to_json())['rules']).key() == rules.key()
+    normalizer = NormalizeWinPath(rules=str(path))
+    assert normalizer.normalize_path(r'C:\ProgramData\x.exe') == r'?progdata\x.exe'
+
+    pytest.importorskip('yaml')
+    path = tmp_path / 'rules.yaml'
+    path.write_text('rules:\n'
+                    '  - name: programdata\n'
+                    "    regex: '${systemdrive}programdata\\\\'\n"
+                    "    replacement: '?progdata\\\\'\n")
+    assert RuleSet.from_file(path).to_dict() == rules.to_dict()
+
+def test_user_rules_priority():
+    normalizer = NormalizeWinPath(cache_size=0)
+    assert normalizer.normalize_path(r'C:\ProgramData\x.exe') == r'?c\programdata\x.exe'
+
+    # Default priority: after ?sys64, before the catch-all ?c\ rule
+    normalizer.add_rule(r'${systemdrive}programdata\\', r'?progdata\\')
+    normalizer.add_rule(r'${systemroot}system32\\', r'?mine\\')
+    assert normalizer.normalize_path(r'C:\ProgramData\x.exe') == r'?progdata\x.exe'
+    assert normalizer.normalize_path(r'C:\Windows\System32\x.exe') == r'?sys64\x.exe'
+
+    normalizer.add_rule(r'${systemroot}system32\\', r'?first\\', name='first', priority=1)
+    assert normalizer.normalize_path(r'C:\Windows\System32\x.exe') == r'?first\x.exe'
+    assert [rule['name'] for rule in normalizer.rules][:2] == ['first', 'sys32']
+
+    with pytest.raises(ValueError):
+        normalizer.add_rule('${nope}', 'x')
+    assert 'rule3' not in normalizer.user_rules
+    assert len(normalizer.rules) == 9 + 3
+
+def test_add_rule_clears_cache():
+    normalizer = NormalizeWinPath()
+    assert normalizer.normalize_path(r'C:\ProgramData\x.exe') == r'?c\programdata\x.exe'
+    normalizer.add_rule(r'${systemdrive}programdata\\', r'?progdata\\')
+    assert normalizer.normalize_path(r'C:\ProgramData\x.exe') == r'?progdata\x.exe'
+    # Other normalizers, and the shared compiled rules, are unchanged
+    assert NormalizeWinPath().rules is NormalizeWinPath('x86_64').rules
+    assert len(NormalizeWinPath().rules) == 9
+
+def test_add_and_remove_rules_incrementally():
+    normalizer = NormalizeWinPath()
+    shared = len(NormalizeWinPath._compiled)
+    for i in range(100):
+        normalizer.add_rule(f'app{i}\\\\', f'?app{i}\\\\', name=f'app{i}')
+    assert normalizer.normalize_path(r'D:\app99\x.exe') == r'd:\?app99\x.exe'
+    # The rule sets built up one rule at a time aren't kept for other normalizers
+    assert len(NormalizeWinPath._compiled) == shared
+    normalizer.remove_rule('app99')
+    assert normalizer.normalize_path(r'D:\app99\x.exe') == r'd:\app99\x.exe'
+    assert len(normalizer.rules) == 9 + 99
+    with pytest.raises(KeyError):
+        normalizer.remove_rule('app99')
+
+def test_extended_rules_match_sequential_rules():
+    normalizer = NormalizeWinPath('x86_64', cache_size=0, rules=RuleSet.extended())
+    paths = {
+        r'C:\Users\Alice\AppData\Roaming\x.exe': r'?appdata\x.exe',
+        r'C:\Users\Alice\AppData\Local\Temp\ab12.tmp': r'?usrtmp\{tmp}',
+        r'C:\Users\Alice\AppData\Local\x.exe': r'?localappdata\x.exe',
+        r'%APPDATA%\x.exe': r'?appdata\x.exe',
+        r'%windir%\x.exe': r'?win\x.exe',
+        r'%FOO%\x.exe': r'?env\x.exe',
+        r'\\server\share\x.exe': r'?unc\x.exe',
+        r'\Device\HarddiskVolume3\x.exe': r'?vol\x.exe',
+        r'\\?\GLOBALROOT\Device\HarddiskVolumeShadowCopy2\x.exe': r'?vss\x.exe',
+        r'C:\ProgramData\x.exe': r'?progdata\x.exe',
+        r'C:\$Recycle.Bin\S-1-5-21-1004-500\x': r'?c\$recycle.bin\{sid}\x',
+        r'D:\d41d8cd98f00b204e9800998ecf8427e.bin': r'd:\{hash}.bin',
+        r'C:\Windows\System32\x.exe': r'?sys64\x.exe',
+        r'C:\Users\c:\Windows\System32\x': r'?usr\x',
+        r'{12345678-1234-1234-1234-12345678901c:\windows\x': r'{12345678-1234-1234-1234-12345678901?win\x',
+    }
+    for path, expected in paths.items():
+        sequential = path
+        for rule in normalizer.rules:
+            sequential = re.sub(rule['regex'], rule['replacement'], sequential.lower())
+        assert normalizer.normalize_path(path) == sequential == expected
+
+def test_rules_applied_to_replacements():
+    # A rule after the built-in ones sees their replacements, as it did when the
+    # rules were applied one after another
+    rules = [{'regex': r'\?usr\\documents\\', 'replacement': r'?docs\\', 'priority': -20}]
+    normalizer = NormalizeWinPath(cache_size=0, rules=rules)
+    assert normalizer.normalize_path(r'C:\Users\Alice\Documents\x.docx') == r'?docs\x.docx'
+    assert normalizer.normalize_path(r'C:\Users\Alice\x.docx') == r'?usr\x.docx'
+
+def test_single_pass_matches_sequential_rules_on_random_paths():
+    pieces = ['c:\\', 'C:\\', '\\??\\', '\\\\?\\', '\\', '?', ':', 'users\\', 'x\\', 'Windows\\',
+              'System32', 'SysWOW64', 'Program Files', ' (x86)', 'AppData\\Local\\Temp\\',
+              'ProgramData\\', '%APPDATA%\\', '{12345678-1234-1234-1234-123456789abc}',
+              '12345678-1234-1234-1234-12345678901', 'c']
+    normalizers = [NormalizeWinPath('x86_64', cache_size=0), NormalizeWinPath('x86', cache_size=0),
+                   NormalizeWinPath(cache_size=0, rules=RuleSet.extended())]
+    rng = random.Random(0)
+    for _ in range(5000):
+        path = ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 6)))
+        for normalizer in normalizers:
+            assert normalizer.normalize_path(path) == normalizer._normalize_sequentially(path), path
+
+def test_processor_rules():
+    rules = RuleSet().add(r'${systemdrive}programdata\\', r'?progdata\\')
+    cmd_line = r'C:\Windows\System32\cmd.exe /c "C:\ProgramData\a.exe /q"'
+    expected = r'?sys64\cmd.exe /c "?progdata\a.exe /q"'
+    processor = WindowsCommandlineProcessor(rules=rules)
+    assert processor.normalize(cmd_line) == expected
+    assert processor.nlp(cmd_line)._.normalize == expected
+    assert list(WindowsCommandlineProcessor(n_process=2, rules=rules).normalize_many([cmd_line])) == [expected]
+    assert WindowsCommandlineProcessor().normalize(cmd_line) == r'?sys64\cmd.exe /c "?c\programdata\a.exe /q"'
+    assert parse_cmdline(cmd_line, normalizer=processor.normalizer).normalize() == expected
+    assert processor.parse(cmd_line).normalize() == expected
+    assert processor.parse(cmd_line).normalized_paths() == [r'?sys64\cmd.exe', r'?progdata\a.exe']
+
+def test_rules_grouped_on_leading_literal():
+    rules = [{'regex': r'\%q', 'replacement': 'a'}, {'regex': r'x\d', 'replacement': 'b'},
+             {'regex': '%qq', 'replacement': 'c'}, {'regex': 'ab|cd', 'replacement': 'd'},
+             {'regex': '%qx', 'replacement': 'e'}, {'regex': 'x*y', 'replacement': 'f'},
+             {'regex': r'[\]|]x', 'replacement': 'g'}, {'regex': 'x', 'replacement': 'h'}]
+    normalizer = NormalizeWinPath(cache_size=0, rules=rules)
+    for path in ('%qq %qx x1 xxy ab cd ]x |x x', r'C:\%qx\x1', ''):
+        sequential = path
+        for rule in normalizer.rules:
+            sequential = re.sub(rule['regex'], rule['replacement'], sequential.lower())
+        assert normalizer.normalize_path(path) == sequential
@@ -0,0 +1,101 @@
+from spacy.lang.xx import Language
+from spacy.tokens import DocBin
+import pytest
+
+from cyberspacy import CommandLineTagger, CommandLineTokenizer, serialize
+from cyberspacy.core import CMD, VAL, MAX_NESTING_DEPTH
+
+CMD_LINES = [
+    r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\a.exe /q C:\b.txt" -x 5',
+    r'"C:\Program Files\MyProgram.exe" /d C:\Users\Alice\file.txt --file C:\test.py',
+    r'notepad.exe',
+]
+
+def make_nlp():
+    nlp = Language()
+    nlp.tokenizer = CommandLineTokenizer(nlp.vocab)
+    tagger = CommandLineTagger(nlp)
+    nlp.add_pipe(tagger)
+    return nlp, tagger
+
+def annotations(doc):
+    return {
+        'tokens': doc._.tokens,
+        'stems': doc._.stems,
+        'normalize': doc._.normalize,
+        'path': [i for i, t in doc._.path],
+        'arg': [i for i, t in doc._.arg],
+        'val': [i for i, t in doc._.val],
+        'cmd': [i for i, t in doc._.cmd],
+        'sub_cmds': [t._.sub_cmd._.stems for t in doc if t._.is_cmd],
+    }
+
+def loader():
+    """A tagger that can't parse, to check loading doesn't re-run it. Extensions
+    are global, so this replaces the getters of taggers created before it."""
+    nlp = Language()
+    tagger = CommandLineTagger(nlp)
+    tagger.nlp = None
+    return nlp.vocab, tagger
+
+def test_to_bytes_round_trip():
+    nlp, tagger = make_nlp()
+    docs = list(nlp.pipe(CMD_LINES))
+    expected = [annotations(doc) for doc in docs]
+    data = [serialize.to_bytes(doc, tagger) for doc in docs]
+    # The original Docs keep their own user_data
+    assert not any(serialize.USER_DATA_KEY in doc.user_data for doc in docs)
+
+    vocab, loading_tagger = loader()
+    restored = [serialize.from_bytes(item, loading_tagger, vocab) for item in data]
+    assert [annotations(doc) for doc in restored] == expected
+
+def test_docbin_round_trip():
+    nlp, tagger = make_nlp()
+    docbin = DocBin(store_user_data=True)
+    docs = list(nlp.pipe(CMD_LINES))
+    expected = [annotations(doc) for doc in docs]
+    for doc in docs:
+        serialize.add_to_docbin(docbin, doc, tagger)
+    data = docbin.to_bytes()
+
+    vocab, loading_tagger = loader()
+    restored = list(serialize.get_docs(DocBin(store_user_data=True).from_bytes(data),
+                                       loading_tagger, vocab))
+    assert [annotations(doc) for doc in restored] == expected
+
+def test_pack_format():
+    nlp, tagger = make_nlp()
+    doc = nlp(CMD_LINES[0])
+    packed = serialize.pack(doc, tagger)
+    # The nested command holds another quoted command
+    root, nested, nested_nested = packed['docs']
+    assert root['parent'] == -1
+    assert len(root['kinds']) == len(doc)
+    assert root['kinds'][2] == CMD | VAL
+    assert nested['parent'] == 0 and nested['token'] == 2
+    assert nested['words'] == doc[2]._.sub_cmd._.tokens
+    assert nested_nested['parent'] == 1 and nested_nested['token'] == 0
+    assert doc.vocab.strings[root['stems'][0]] == doc[0]._.stem
+
+def test_docbin_requires_user_data():
+    nlp, tagger = make_nlp()
+    with pytest.raises(ValueError):
+        serialize.add_to_docbin(DocBin(), nlp(CMD_LINES[2]), tagger)
+    with pytest.raises(ValueError):
+        list(serialize.get_docs(DocBin(), tagger))
+
+def test_round_trip_stops_at_max_nesting_depth():
+    nlp, tagger = make_nlp()
+    cmd_line = 'a "b ' * (MAX_NESTING_DEPTH + 2) + 'c' + '"' * (MAX_NESTING_DEPTH + 2)
+    doc = nlp(cmd_line)
+    packed = serialize.pack(doc, tagger)
+    assert len(packed['docs']) == MAX_NESTING_DEPTH + 1
+
+    vocab, loading_tagger = loader()
+    restored = serialize.from_bytes(serialize.to_bytes(doc, tagger), loading_tagger, vocab)
+    assert restored._.normalize == doc._.normalize == cmd_line
+    for depth in range(MAX_NESTING_DEPTH):
+        restored = restored[len(restored) - 1]._.sub_cmd
+    assert restored[len(restored) - 1]._.is_cmd
+    assert restored[len(restored) - 1]._.sub_cmd is None
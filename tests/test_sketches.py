@@ -0,0 +1,121 @@
+import pickle
+from collections import Counter
+
+import pytest
+
+from cyberspacy.core import parse_cmdline
+from cyberspacy.processor import WindowsCommandlineProcessor
+from cyberspacy.sketches import (CountMinSketch, HyperLogLog, RaritySketch, event_features,
+                                 rarity, _hashes)
+
+CMD_LINES = [r'C:\Windows\System32\svchost.exe -k netsvcs -p'] * 50 + [
+    rf'C:\Windows\System32\svchost.exe -k service{i} -p' for i in range(30)] + [
+    r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\a.exe /q"',
+    r'"C:\Program Files\App\app.exe" --type=renderer',
+]
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=64, depth=4)
+    values = [str(i % 100) for i in range(1000)] + [str(i) for i in range(100, 400)]
+    for value in values:
+        sketch.add(_hashes([value]))
+    counts = sketch.query(_hashes([str(i) for i in range(400)]))
+    # Never underestimated
+    assert all(count >= true for count, true in zip(counts, [10] * 100 + [1] * 300))
+    assert sketch.query(_hashes(['0']))[0] < 20
+    with pytest.raises(ValueError):
+        sketch.merge(CountMinSketch(width=32, depth=4))
+
+def test_hyperloglog():
+    for n in (0, 10, 1000, 50000):
+        hll = HyperLogLog(precision=12)
+        hll.add(_hashes([str(i) for i in range(n)]))
+        assert abs(hll.count() - n) <= 0.05 * n
+    a, b = HyperLogLog(precision=12), HyperLogLog(precision=12)
+    a.add(_hashes([str(i) for i in range(0, 3000)]))
+    b.add(_hashes([str(i) for i in range(2000, 5000)]))
+    assert abs(a.merge(b).count() - 5000) <= 250
+    with pytest.raises(ValueError):
+        a.merge(HyperLogLog(precision=10))
+
+def test_rarity_scores():
+    assert rarity(0, 0) == rarity(0, 100) == 1.0
+    assert rarity(100, 100) == 0.0
+    sketch = RaritySketch(width=2 ** 12)
+    scores = list(sketch.add_many(CMD_LINES))
+    assert scores[0]['score'] == 1.0
+    assert scores[49]['score'] < 0.01
+    one_by_one = RaritySketch(width=2 ** 12)
+    assert [one_by_one.add(cmd_line) for cmd_line in CMD_LINES] == scores
+    batched = RaritySketch(width=2 ** 12)
+    assert list(batched.add_many(CMD_LINES, batch_size=7)) == scores
+    assert sketch.events == len(CMD_LINES)
+    assert sketch.count('normalized', r'?sys64\svchost.exe -k netsvcs -p') == 50
+    assert sketch.count('pairs', (r'?sys64\svchost.exe', '-k')) == 80
+    assert sketch.count('normalized_paths', r'?usr\a.exe') == 1
+    assert sketch.distinct('normalized') == 33
+    assert sketch.distinct('args') == 5
+
+    common = sketch.score(r'c:\windows\system32\svchost.exe -k netsvcs -p')
+    new_service = sketch.score(r'C:\Windows\System32\svchost.exe -k other -p')
+    new_arg = sketch.score(r'C:\Windows\System32\svchost.exe -k netsvcs -s')
+    assert common['score'] < 0.2
+    assert new_service['normalized'] == 1.0 and new_service['pairs'] < 0.2
+    assert new_arg['pairs'] == new_arg['args'] == 1.0
+    assert sketch.score('')['args'] == 0.0
+    assert sketch.events == len(CMD_LINES)
+
+def test_event_inputs():
+    cmd_line = r'C:\Windows\System32\cmd.exe /c "C:\Users\Alice\a.exe /q /q"'
+    analysis = WindowsCommandlineProcessor().analyze(cmd_line)
+    features = event_features(analysis)
+    assert features['pairs'] == [(r'?sys64\cmd.exe', '/c'), (r'?sys64\cmd.exe', '/q')]
+    assert features['normalized_paths'] == [r'?sys64\cmd.exe', r'?usr\a.exe']
+
+    sketch = RaritySketch(width=2 ** 12)
+    for event in (cmd_line, analysis, parse_cmdline(cmd_line)):
+        sketch.add(event)
+    assert sketch.count('normalized', analysis['normalized']) == 3
+    assert sketch.distinct('pairs') == 2
+
+def test_unclassified_tokens_and_bad_lines():
+    cmd_lines = [r'tasklist /v | findstr x 2>nul', r'cmd.exe /c "dir C:\Users | findstr (x)"',
+                 r'C:\Windows\System32\a.exe "', r'tasklist /v | findstr x 2>nul']
+    sketch = RaritySketch(width=2 ** 12)
+    scores = list(sketch.add_many(cmd_lines, return_exceptions=True))
+    assert scores[0]['score'] == scores[1]['score'] == 1.0
+    assert isinstance(scores[2], ValueError)
+    assert scores[3]['normalized'] < 1.0
+    assert sketch.events == 3
+    assert sketch.count('normalized', 'tasklist /v | findstr x 2> nul') == 2
+    assert sketch.score(cmd_lines[1])['normalized'] < 1.0
+
+    strict = RaritySketch(width=2 ** 12)
+    added = []
+    with pytest.raises(ValueError):
+        for score in strict.add_many(cmd_lines):
+            added.append(score)
+    assert added == scores[:2] and strict.events == 2
+
+def test_merge_and_serialize():
+    whole = RaritySketch(width=2 ** 12, precision=10)
+    parts = [RaritySketch(width=2 ** 12, precision=10) for _ in range(3)]
+    for i, cmd_line in enumerate(CMD_LINES):
+        whole.add(cmd_line)
+        # Sketches go back and forth between worker processes pickled
+        parts[i % 3].add(cmd_line)
+    parts = [pickle.loads(pickle.dumps(part)) for part in parts]
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert merged.events == whole.events
+    assert merged.distinct('normalized') == whole.distinct('normalized')
+    true_counts = Counter(CMD_LINES)
+    processor = WindowsCommandlineProcessor()
+    for cmd_line, count in true_counts.items():
+        assert merged.count('normalized', processor.normalize(cmd_line)) >= count
+
+    restored = RaritySketch.from_bytes(whole.to_bytes())
+    assert restored.nbytes == whole.nbytes
+    assert restored.score(CMD_LINES[-1]) == whole.score(CMD_LINES[-1])
+    with pytest.raises(ValueError):
+        whole.merge(RaritySketch(width=2 ** 10))